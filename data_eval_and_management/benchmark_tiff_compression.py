@@ -0,0 +1,59 @@
+from pathlib import Path
+import os
+import time
+import tifffile
+from lsfm_data_processing.utils.tiff_io import tiff_write_options, write_tiff
+
+
+# User parameters
+input_image_path = Path(r"Z:\PATH\TO\SAMPLE_IMAGES")  # Folder with a few representative TIFFs (e.g. raw slices or MIPs)
+output_directory = Path(r"Z:\PATH\TO\BENCHMARK_OUTPUT")  # Where test files are written; use the storage you write to in practice
+max_images = 5  # Number of images from input_image_path to benchmark
+workers = 4  # Encoder threads for the multithreaded settings
+
+# (label, tiff_write_options keyword arguments)
+settings = [
+    ("none", dict(compression="none")),
+    ("lzw", dict(compression="lzw")),
+    ("lzw+pred", dict(compression="lzw", predictor=True)),
+    ("deflate6+pred", dict(compression="deflate", compression_level=6, predictor=True)),
+    ("zstd3", dict(compression="zstd", compression_level=3)),
+    ("zstd3+pred", dict(compression="zstd", compression_level=3, predictor=True)),
+    ("zstd3+pred tiled", dict(compression="zstd", compression_level=3, predictor=True, tile=256)),
+    (f"zstd3+pred tiled x{workers}", dict(compression="zstd", compression_level=3, predictor=True, tile=256, workers=workers)),
+    ("zstd9+pred", dict(compression="zstd", compression_level=9, predictor=True)),
+]
+
+
+# Run code
+images = sorted(input_image_path.glob("*.tif*"))[:max_images]
+if not images:
+    raise RuntimeError(f"No TIFF files found in:\n{input_image_path}")
+output_directory.mkdir(parents=True, exist_ok=True)
+arrays = [tifffile.TiffFile(image).asarray() for image in images]
+raw_bytes = sum(a.nbytes for a in arrays)
+print(f"Benchmarking {len(arrays)} images ({raw_bytes / 1e6:.1f} MB decoded, dtype {arrays[0].dtype})\n")
+
+print(f"{'setting':<26}{'write MB/s':>12}{'read MB/s':>12}{'ratio':>8}")
+for label, kwargs in settings:
+    tiff_options = tiff_write_options(**kwargs)
+    out_paths = [output_directory / f"bench_{i}.tif" for i in range(len(arrays))]
+
+    start = time.perf_counter()
+    for out_path, array in zip(out_paths, arrays):
+        write_tiff(out_path, array, tiff_options)
+        # Include the flush to disk/network share in the write time
+        with open(out_path, "rb+") as f:
+            os.fsync(f.fileno())
+    write_time = time.perf_counter() - start
+    file_bytes = sum(p.stat().st_size for p in out_paths)
+
+    start = time.perf_counter()
+    for out_path in out_paths:
+        tifffile.imread(out_path, maxworkers=tiff_options["maxworkers"])
+    read_time = time.perf_counter() - start
+
+    print(f"{label:<26}{raw_bytes / 1e6 / write_time:>12.1f}{raw_bytes / 1e6 / read_time:>12.1f}"
+          f"{raw_bytes / file_bytes:>8.2f}")
+    for out_path in out_paths:
+        out_path.unlink()
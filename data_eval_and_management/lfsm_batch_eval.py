@@ -2,6 +2,7 @@ from PIL import Image
 from pathlib import Path
 import cv2
 import numpy as np
+from lsfm_data_processing.utils.image_ops import compute_percentiles
 
 ### Edit list of path (input as many as you want, separated by commas)
 
@@ -48,8 +49,7 @@ for path in list_of_paths:
     image_array = np.array(image_pil)
 
     # Define clipping thresholds
-    lower_threshold = np.percentile(image_array, 0)
-    upper_threshold = np.percentile(image_array, 99.8)
+    lower_threshold, upper_threshold = compute_percentiles(image_array, (0, 99.8))
 
     # Clip the image pixel values
     clipped_image = np.clip(image_array, lower_threshold, upper_threshold)
@@ -6,56 +6,181 @@ from .cellpose_io import (
     load_prediction_masks,
     match_prediction_for_mip,
 )
-from .chunking import chunk_image, chunk_z_stack, get_avg_pixel_value
-from .image_ops import _raise_if_windows_path_too_long, convert_to_uint8, normalize_array
+from .chunk_catalog import CATALOG_NAME, add_chunk_rows, catalog_path, chunk_row, create_catalog, load_catalog
+from .chunking import (
+    block_region_histograms,
+    block_stats,
+    chunk_and_filter_image,
+    chunk_image,
+    chunk_images,
+    chunk_mean,
+    chunk_z_stack,
+    get_avg_pixel_value,
+    image_block_stats,
+    image_region_histograms,
+    iter_chunks,
+    read_catalog_chunks,
+)
+from .image_ops import (
+    _raise_if_windows_path_too_long,
+    apply_lut,
+    compute_percentiles,
+    convert_to_uint8,
+    histogram_percentiles,
+    integer_histogram,
+    normalization_lut,
+    normalize_array,
+    normalize_tiff_tiled,
+    stack_percentiles,
+    tiff_histogram,
+)
 from .io_helpers import (
+    LINK_MODES,
+    link_mode_from_config,
+    list_image_files,
     list_tiff_files,
     load_script_config,
+    materialize_file,
     normalize_user_path,
     require_dir,
     require_file,
     require_subpath,
 )
-from .mip import create_mips_from_folder
+from .manifest import file_signature, load_manifest, output_is_current, record_output, save_manifest
+from .mip import create_mips_from_folder, create_mips_from_folders
 from .naming import get_underscore_int, get_underscore_token
+from .prefetch import WriteBehind, prefetch
 from .selection import (
+    RegionIncidence,
     balanced_random_seed_selection,
     greedy_region_coverage_select,
     random_fill_selection,
     select_evenly_spaced_items,
     select_sections_evenly,
     stable_seed,
+    stochastic_greedy_region_coverage_select,
 )
 from .stacks import tifs_to_zstack
+from .tiff_io import (
+    PACKED_SUFFIX,
+    TIFF_COMPRESSIONS,
+    band_rows_for_budget,
+    iter_packed_chunks,
+    iter_tiff_bands,
+    iter_tiff_row_bands,
+    iter_tiles,
+    open_packed_chunks,
+    pack_chunks,
+    require_2d_pages,
+    tiff_nbytes,
+    tiff_options_from_config,
+    tiff_write_options,
+    write_packed_chunk,
+    write_tiff,
+)
+from .zarr_io import (
+    ZARR_COMPRESSORS,
+    ZARR_SUFFIX,
+    copy_image,
+    image_shape,
+    is_zarr_image,
+    iter_image_bands,
+    open_image,
+    pyramid_row_multiple,
+    write_ome_zarr,
+    write_ome_zarr_bands,
+)
 
 __all__ = [
+    "CATALOG_NAME",
+    "LINK_MODES",
+    "PACKED_SUFFIX",
+    "RegionIncidence",
+    "TIFF_COMPRESSIONS",
+    "WriteBehind",
+    "ZARR_COMPRESSORS",
+    "ZARR_SUFFIX",
     "_raise_if_windows_path_too_long",
+    "add_chunk_rows",
+    "apply_lut",
     "atlas_slice_for_mip",
     "build_prediction_index",
+    "catalog_path",
+    "chunk_and_filter_image",
     "chunk_image",
+    "chunk_images",
+    "chunk_mean",
+    "chunk_row",
     "chunk_z_stack",
+    "compute_percentiles",
+    "copy_image",
     "convert_to_uint8",
+    "create_catalog",
     "create_cellpose_npy_dict",
     "create_mips_from_folder",
+    "create_mips_from_folders",
     "create_outlines_from_masks",
+    "file_signature",
     "get_avg_pixel_value",
+    "histogram_percentiles",
+    "image_block_stats",
+    "image_region_histograms",
+    "image_shape",
+    "integer_histogram",
+    "is_zarr_image",
+    "iter_chunks",
+    "iter_image_bands",
+    "iter_packed_chunks",
+    "iter_tiff_bands",
+    "iter_tiff_row_bands",
+    "iter_tiles",
+    "link_mode_from_config",
+    "list_image_files",
     "list_tiff_files",
+    "load_catalog",
+    "load_manifest",
     "load_prediction_masks",
     "load_script_config",
     "match_prediction_for_mip",
+    "materialize_file",
     "get_underscore_int",
     "get_underscore_token",
+    "normalization_lut",
     "normalize_array",
+    "normalize_tiff_tiled",
     "normalize_user_path",
+    "open_image",
+    "open_packed_chunks",
+    "pack_chunks",
+    "output_is_current",
+    "prefetch",
+    "pyramid_row_multiple",
+    "read_catalog_chunks",
+    "band_rows_for_budget",
     "balanced_random_seed_selection",
+    "block_region_histograms",
+    "block_stats",
     "greedy_region_coverage_select",
     "random_fill_selection",
     "select_evenly_spaced_items",
     "select_sections_evenly",
     "stable_seed",
+    "stack_percentiles",
+    "stochastic_greedy_region_coverage_select",
+    "record_output",
     "relabel_sequential_for_preview",
+    "require_2d_pages",
     "require_dir",
     "require_file",
     "require_subpath",
+    "save_manifest",
+    "tiff_histogram",
+    "tiff_nbytes",
+    "tiff_options_from_config",
+    "tiff_write_options",
     "tifs_to_zstack",
+    "write_ome_zarr",
+    "write_ome_zarr_bands",
+    "write_packed_chunk",
+    "write_tiff",
 ]
@@ -0,0 +1,211 @@
+import json
+import sqlite3
+from collections.abc import Iterable
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+
+CATALOG_NAME = "chunk_catalog.sqlite"
+CATALOG_VERSION = 3
+
+_SCHEMA = """
+CREATE TABLE chunks (
+    id INTEGER PRIMARY KEY,
+    chunk_file TEXT NOT NULL UNIQUE,
+    source_file TEXT NOT NULL,
+    y INTEGER NOT NULL,
+    x INTEGER NOT NULL,
+    chunk_size INTEGER NOT NULL,
+    stack INTEGER NOT NULL,
+    shape TEXT NOT NULL,
+    dtype TEXT NOT NULL,
+    mean REAL NOT NULL,
+    nonzero_fraction REAL NOT NULL,
+    atlas_source_file TEXT,
+    atlas_chunk_file TEXT,
+    container_file TEXT,
+    container_index INTEGER,
+    virtual INTEGER NOT NULL
+);
+CREATE TABLE chunk_regions (
+    chunk_id INTEGER NOT NULL REFERENCES chunks(id),
+    region INTEGER NOT NULL,
+    pixels INTEGER NOT NULL
+);
+CREATE INDEX chunk_regions_chunk ON chunk_regions(chunk_id);
+CREATE INDEX chunks_mean ON chunks(mean);
+"""
+
+_COLUMNS = (
+    "chunk_file",
+    "source_file",
+    "y",
+    "x",
+    "chunk_size",
+    "stack",
+    "shape",
+    "dtype",
+    "mean",
+    "nonzero_fraction",
+    "atlas_source_file",
+    "atlas_chunk_file",
+    "container_file",
+    "container_index",
+    "virtual",
+)
+
+
+def catalog_path(folder: Path) -> Path:
+    """Return the catalog path of a chunk folder."""
+    return folder / CATALOG_NAME
+
+
+def chunk_row(
+    chunk_file: str,
+    source_file: Path,
+    y: int,
+    x: int,
+    chunk: np.ndarray,
+    mean: float,
+    chunk_size: int,
+    stack: bool = False,
+    atlas_source_file: Path | None = None,
+    atlas_chunk_file: str | None = None,
+    atlas_chunk: np.ndarray | None = None,
+    nonzero_fraction: float | None = None,
+    container_file: Path | None = None,
+    container_index: int | None = None,
+    virtual: bool = False,
+) -> dict[str, Any]:
+    """
+    Return the catalog row of one chunk.
+
+    `mean` is the filter statistic (`chunking.chunk_mean`). With `atlas_chunk`,
+    the row also gets the atlas region histogram (`regions`: region id ->
+    pixel count). `nonzero_fraction` is computed from `chunk` unless given
+    (e.g. from `chunking.block_stats`). `virtual` rows have no loose chunk file:
+    the chunk is read from its packed container (`container_file`, series
+    `container_index`) or, without one, cropped from `source_file` when it is
+    selected. Atlas chunks of virtual rows are cropped from
+    `atlas_source_file`. See `chunking.read_catalog_chunks`.
+    """
+    if nonzero_fraction is None:
+        nonzero_fraction = np.count_nonzero(chunk) / chunk.size if chunk.size else 0.0
+
+    row = {
+        "chunk_file": chunk_file,
+        "source_file": str(source_file),
+        "y": int(y),
+        "x": int(x),
+        "chunk_size": int(chunk_size),
+        "stack": bool(stack),
+        "shape": list(chunk.shape),
+        "dtype": str(chunk.dtype),
+        "mean": float(mean),
+        "nonzero_fraction": float(nonzero_fraction),
+        "atlas_source_file": str(atlas_source_file) if atlas_source_file is not None else None,
+        "atlas_chunk_file": atlas_chunk_file,
+        "container_file": str(container_file) if container_file is not None else None,
+        "container_index": int(container_index) if container_index is not None else None,
+        "virtual": bool(virtual),
+        "regions": None,
+    }
+    if atlas_chunk is not None:
+        regions, counts = np.unique(np.asarray(atlas_chunk), return_counts=True)
+        row["regions"] = dict(zip(regions.tolist(), counts.tolist()))
+    return row
+
+
+def create_catalog(folder: Path) -> sqlite3.Connection:
+    """
+    Create an empty chunk catalog in `folder`, replacing an existing one.
+
+    Add rows with `add_chunk_rows` and close the connection when done.
+    """
+    path = catalog_path(folder)
+    path.unlink(missing_ok=True)
+    conn = sqlite3.connect(path)
+    conn.executescript(_SCHEMA)
+    conn.execute(f"PRAGMA user_version = {CATALOG_VERSION}")
+    return conn
+
+
+def add_chunk_rows(conn: sqlite3.Connection, rows: Iterable[dict[str, Any]]) -> None:
+    """Insert catalog rows (see `chunk_row`) and their region histograms in one transaction."""
+    with conn:
+        for row in rows:
+            values = [row[c] for c in _COLUMNS]
+            values[_COLUMNS.index("shape")] = json.dumps(row["shape"])
+            chunk_id = conn.execute(
+                f"INSERT INTO chunks ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})",
+                values,
+            ).lastrowid
+            if row.get("regions"):
+                conn.executemany(
+                    "INSERT INTO chunk_regions (chunk_id, region, pixels) VALUES (?, ?, ?)",
+                    [(chunk_id, region, pixels) for region, pixels in row["regions"].items()],
+                )
+
+
+def load_catalog(
+    folder: Path,
+    min_mean: float | None = None,
+    with_regions: bool = False,
+) -> list[dict[str, Any]] | None:
+    """
+    Load the chunk catalog of a folder, or None if it has none.
+
+    Parameters
+    ----------
+    folder : Path
+        Folder containing `chunk_catalog.sqlite`.
+    min_mean : float | None, optional
+        Only return chunks whose mean is above this value (same rule as
+        `4_filter_black_chunks.py`).
+    with_regions : bool, optional
+        Also load the atlas region histograms (`regions`, None for chunks
+        without an atlas pair).
+
+    Returns
+    -------
+    list[dict[str, Any]] | None
+        Rows in the order they were written.
+    """
+    path = catalog_path(folder)
+    if not path.exists():
+        return None
+
+    conn = sqlite3.connect(path)
+    try:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version != CATALOG_VERSION:
+            raise RuntimeError(
+                f"Unsupported chunk catalog version {version} (expected {CATALOG_VERSION}), re-run 3_chunk_data.py:\n{path}"
+            )
+
+        query = f"SELECT id, {', '.join(_COLUMNS)} FROM chunks"
+        params: tuple = ()
+        if min_mean is not None:
+            query += " WHERE mean > ?"
+            params = (min_mean,)
+        rows = {}
+        for chunk_id, *values in conn.execute(query + " ORDER BY id", params):
+            row = dict(zip(_COLUMNS, values))
+            row["shape"] = json.loads(row["shape"])
+            row["stack"] = bool(row["stack"])
+            row["virtual"] = bool(row["virtual"])
+            row["regions"] = None
+            rows[chunk_id] = row
+
+        if with_regions:
+            for chunk_id, region, pixels in conn.execute("SELECT chunk_id, region, pixels FROM chunk_regions"):
+                row = rows.get(chunk_id)
+                if row is not None:
+                    if row["regions"] is None:
+                        row["regions"] = {}
+                    row["regions"][region] = pixels
+    finally:
+        conn.close()
+
+    return list(rows.values())
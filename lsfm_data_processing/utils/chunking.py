@@ -1,39 +1,528 @@
-import tifffile
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from pathlib import Path
 
+import numpy as np
 
-def get_avg_pixel_value(path_to_image):
-    image = tifffile.TiffFile(path_to_image).asarray()
-    shape = image.shape
+from .chunk_catalog import add_chunk_rows, chunk_row
+from .prefetch import WriteBehind
+from .tiff_io import (
+    PACKED_SUFFIX,
+    iter_packed_chunks,
+    open_packed_chunks,
+    pack_chunks,
+    write_packed_chunk,
+    write_tiff,
+)
+from .zarr_io import iter_image_bands, open_image
+
+
+def chunk_mean(chunk):
+    # Mean of a 2D chunk, or of the middle plane of a 3D chunk.
+    shape = chunk.shape
 
     if len(shape) == 2:
-        average_pixel_value = image.mean()
+        average_pixel_value = np.asarray(chunk[:, :]).mean()
     elif len(shape) == 3:
         middle_z = int(shape[0] / 2)
-        image = image[middle_z, :, :]
-        average_pixel_value = image.mean()
+        average_pixel_value = np.asarray(chunk[middle_z, :, :]).mean()
     else:
         raise ValueError(f"Unsupported image shape: {shape}")
 
     return average_pixel_value
 
 
-def chunk_image(path_to_image, image_outdir, chunk_size):
-    img = tifffile.TiffFile(path_to_image).asarray()
+def get_avg_pixel_value(path_to_image):
+    return chunk_mean(open_image(path_to_image))
+
+
+def _band_chunks(band, chunk_size, stack=False):
+    # Yield (x, chunk) across one row of chunks.
+    if stack:
+        for j in range(0, band.shape[2], chunk_size):
+            yield j, band[:, :, j : j + chunk_size]
+    else:
+        for j in range(0, band.shape[1], chunk_size):
+            yield j, band[:, j : j + chunk_size]
+
+
+def iter_chunks(path_to_image, chunk_size, stack=False):
+    # Yield (y, x, chunk) in row-major order, reading one row of chunks at a time;
+    # the image is never loaded whole. Stacks are chunked in y/x over all planes.
+    for i, band in iter_image_bands(path_to_image, chunk_size):
+        for j, chunk in _band_chunks(band, chunk_size, stack):
+            yield i, j, chunk
+
+
+def block_stats(image, block_size, stack=False, bins=None):
+    """
+    Compute per-block statistics of a whole image in one vectorized pass.
+
+    Parameters
+    ----------
+    image : array-like
+        2D image `(y, x)`, RGB image `(y, x, samples)` or, with `stack=True`,
+        z-stack `(z, y, x)`. Memory maps and Zarr arrays are read once.
+    block_size : int
+        Block edge in pixels; blocks follow the chunk grid of `iter_chunks`,
+        so edge blocks are smaller when the image is not a multiple of it.
+    stack : bool, optional
+        Treat a 3D image as a z-stack chunked in y/x over all planes.
+    bins : sequence of float, optional
+        Increasing bin edges (e.g. percentiles from `compute_percentiles`).
+        Adds the per-block value counts per bin, with `np.histogram` edge rules.
+
+    Returns
+    -------
+    np.ndarray
+        Structured grid of shape `(ceil(y / block_size), ceil(x / block_size))`
+        with fields `mean` (of the middle plane for stacks, as in
+        `chunk_mean`; over all samples for RGB), `max`, `nonzero` and `size` (values over all
+        planes/samples) and, with `bins`, `hist`.
+    """
+    data = np.asarray(image)
+    if stack:
+        if data.ndim != 3:
+            raise ValueError(f"Expected a (z, y, x) stack, got shape {data.shape}")
+        mean_plane = data[data.shape[0] // 2]
+        mean_depth = 1
+        depth = data.shape[0]
+        yx_shape = data.shape[1:]
+        # Reduce the planes first, then the blocks
+        max_plane = data.max(axis=0)
+        nonzero_plane = np.count_nonzero(data, axis=0)
+    elif data.ndim == 2:
+        mean_plane = data
+        mean_depth = 1
+        depth = 1
+        yx_shape = data.shape
+        max_plane = data
+        nonzero_plane = data != 0
+    elif data.ndim == 3:
+        mean_plane = data.sum(axis=2, dtype=_sum_dtype(data))
+        mean_depth = depth = data.shape[2]
+        yx_shape = data.shape[:2]
+        max_plane = data.max(axis=2)
+        nonzero_plane = np.count_nonzero(data, axis=2)
+    else:
+        raise ValueError(f"Unsupported image shape: {data.shape}")
+
+    row_starts = np.arange(0, yx_shape[0], block_size)
+    col_starts = np.arange(0, yx_shape[1], block_size)
+    heights = np.diff(np.append(row_starts, yx_shape[0]))
+    widths = np.diff(np.append(col_starts, yx_shape[1]))
+    pixels = heights[:, None] * widths[None, :]
+
+    fields = [("mean", np.float64), ("max", data.dtype), ("nonzero", np.int64), ("size", np.int64)]
+    if bins is not None:
+        bins = np.asarray(bins)
+        fields.append(("hist", np.int64, (len(bins) - 1,)))
+    grid = np.empty((len(row_starts), len(col_starts)), dtype=fields)
+    if grid.size == 0:
+        return grid
+
+    def reduce_blocks(ufunc, plane, dtype=None):
+        reduced = ufunc.reduceat(plane, row_starts, axis=0, dtype=dtype)
+        return ufunc.reduceat(reduced, col_starts, axis=1, dtype=dtype)
+
+    # Integer sums are exact, so integer means match chunk_mean exactly
+    grid["mean"] = reduce_blocks(np.add, mean_plane, _sum_dtype(mean_plane)) / (pixels * mean_depth)
+    grid["max"] = reduce_blocks(np.maximum, max_plane)
+    grid["nonzero"] = reduce_blocks(np.add, nonzero_plane, np.int64)
+    grid["size"] = pixels * depth
+
+    if bins is not None:
+        for k in range(len(bins) - 1):
+            last = k == len(bins) - 2
+            inside = (data >= bins[k]) & ((data <= bins[k + 1]) if last else (data < bins[k + 1]))
+            if data.ndim == 3:
+                inside = inside.sum(axis=0 if stack else 2, dtype=np.int64)
+            grid["hist"][..., k] = reduce_blocks(np.add, inside, np.int64)
+
+    return grid
+
+
+def _sum_dtype(data):
+    # Exact integer sums, float64 sums for everything else
+    return np.int64 if np.issubdtype(data.dtype, np.integer) or data.dtype == bool else np.float64
+
+
+def image_block_stats(path_to_image, block_size, stack=False, bins=None):
+    """
+    Return the `block_stats` grid of a TIFF or Zarr image, reading one row of blocks at a time.
+    """
+    rows = [block_stats(band, block_size, stack, bins) for _, band in iter_image_bands(path_to_image, block_size)]
+    return np.concatenate(rows, axis=0)
+
+
+def block_region_histograms(labels, block_size):
+    """
+    Compute the region histogram of every block of a 2D label image (e.g. an atlas slice) in one pass.
+
+    Pixels are counted per (block, label) with one `np.bincount` per row of
+    blocks, instead of one `np.unique` per chunk. Small non-negative integer
+    labels index the counts directly; other labels (e.g. raw Allen CCF ids)
+    are first relabeled to a dense index with `np.unique`.
+
+    Parameters
+    ----------
+    labels : array-like
+        2D label image `(y, x)`. Memory maps and Zarr arrays are read once.
+    block_size : int
+        Block edge in pixels; blocks follow the chunk grid of `iter_chunks`.
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray]
+        Object grids `regions` and `pixels` of shape
+        `(ceil(y / block_size), ceil(x / block_size))`: the sorted labels present
+        in each block (background included) and their pixel counts.
+    """
+    data = np.asarray(labels)
+    if data.ndim != 2:
+        raise ValueError(f"Expected a 2D label image, got shape {data.shape}")
+
+    n_cols = -(-data.shape[1] // block_size)
+    regions = np.empty((-(-data.shape[0] // block_size), n_cols), dtype=object)
+    pixels = np.empty(regions.shape, dtype=object)
+    block_of_col = np.arange(data.shape[1]) // block_size
+    for i, row in enumerate(range(0, data.shape[0], block_size)):
+        band = data[row : row + block_size]
+        region_ids, dense = _dense_labels(band, n_cols)
+        keys = block_of_col[np.newaxis, :] * len(region_ids) + dense
+        counts = np.bincount(keys.reshape(-1), minlength=n_cols * len(region_ids)).reshape(n_cols, len(region_ids))
+        for j in range(n_cols):
+            present = np.flatnonzero(counts[j])
+            regions[i, j] = region_ids[present]
+            pixels[i, j] = counts[j, present]
+    return regions, pixels
+
+
+def _dense_labels(band, n_blocks):
+    # (label of each index, band as indices); small non-negative integer labels are their own index
+    if np.issubdtype(band.dtype, np.integer) and band.size:
+        low, high = int(band.min()), int(band.max())
+        # Only while the (block, label) count table stays about as small as the band
+        if low >= 0 and n_blocks * (high + 1) <= max(4 * band.size, 2**16):
+            return np.arange(high + 1, dtype=band.dtype), band
+    region_ids, dense = np.unique(band, return_inverse=True)
+    return region_ids, dense.reshape(band.shape)
+
+
+def image_region_histograms(path_to_image, block_size):
+    """
+    Return the `block_region_histograms` grids of a 2D TIFF or Zarr label image, reading one row of blocks at a time.
+    """
+    bands = [block_region_histograms(band, block_size) for _, band in iter_image_bands(path_to_image, block_size)]
+    if not bands:
+        return np.empty((0, 0), dtype=object), np.empty((0, 0), dtype=object)
+    return np.concatenate([r for r, _ in bands], axis=0), np.concatenate([p for _, p in bands], axis=0)
+
+
+def chunk_image(
+    path_to_image,
+    image_outdir,
+    chunk_size,
+    tiff_options=None,
+    packed=False,
+    write_workers=1,
+    max_inflight_bytes=256 * 2**20,
+):
+    # With packed=True all chunks go into one container, <image stem>_chunks.tif (see tiff_io.pack_chunks).
+    # write_workers > 1 encodes/writes loose chunks on that many threads, holding at most
+    # max_inflight_bytes of queued chunks (see prefetch.WriteBehind); containers are written in order.
     image_name = path_to_image.stem
-    shape = img.shape
 
-    for i in range(0, shape[0], chunk_size):
-        for j in range(0, shape[1], chunk_size):
-            chunk = img[i : i + chunk_size, j : j + chunk_size]
-            tifffile.imwrite(f"{image_outdir}/{image_name}_chunk_{i}_{j}.tif", chunk)
+    if packed:
+        pack_chunks(f"{image_outdir}/{image_name}{PACKED_SUFFIX}", iter_chunks(path_to_image, chunk_size), tiff_options)
+        return
+
+    with WriteBehind(write_workers, max_inflight_bytes) as writes:
+        for i, j, chunk in iter_chunks(path_to_image, chunk_size):
+            path = f"{image_outdir}/{image_name}_chunk_{i}_{j}.tif"
+            writes.submit(write_tiff, path, chunk, tiff_options, nbytes=chunk.nbytes)
 
 
-def chunk_z_stack(path_to_image, image_outdir, chunk_size):
-    full_stack = tifffile.TiffFile(path_to_image).asarray()
-    shape = full_stack.shape
+def chunk_z_stack(
+    path_to_image,
+    image_outdir,
+    chunk_size,
+    tiff_options=None,
+    packed=False,
+    write_workers=1,
+    max_inflight_bytes=256 * 2**20,
+):
     image_name = path_to_image.stem
 
-    for i in range(0, shape[1], chunk_size):
-        for j in range(0, shape[2], chunk_size):
-            stack_chunk = full_stack[:, i : i + chunk_size, j : j + chunk_size]
-            tifffile.imwrite(f"{image_outdir}/{image_name}_chunk_{i}_{j}.tif", stack_chunk)
\ No newline at end of file
+    if packed:
+        stack_chunks = iter_chunks(path_to_image, chunk_size, stack=True)
+        pack_chunks(f"{image_outdir}/{image_name}{PACKED_SUFFIX}", stack_chunks, tiff_options, photometric="minisblack")
+        return
+
+    with WriteBehind(write_workers, max_inflight_bytes) as writes:
+        for i, j, stack_chunk in iter_chunks(path_to_image, chunk_size, stack=True):
+            path = f"{image_outdir}/{image_name}_chunk_{i}_{j}.tif"
+            writes.submit(write_tiff, path, stack_chunk, tiff_options, nbytes=stack_chunk.nbytes)
+
+
+def chunk_and_filter_image(
+    path_to_image,
+    image_outdir,
+    chunk_size,
+    pixel_val_threshold=None,
+    stack=False,
+    atlas_path=None,
+    atlas_outdir=None,
+    tiff_options=None,
+    catalog=None,
+    packed=False,
+    write_workers=1,
+    max_inflight_bytes=256 * 2**20,
+):
+    """
+    Chunk an image, writing only chunks brighter than `pixel_val_threshold` (all chunks if None).
+
+    A chunk is kept when its `chunk_mean` (the value `get_avg_pixel_value`
+    gives for the written chunk) is above the threshold, so the output is
+    the same as chunking followed by `4_filter_black_chunks.py`, without
+    writing and re-reading the dark chunks. Means and nonzero counts come from
+    one `block_stats` reduction per row of chunks. With `atlas_path`, the atlas
+    slice is chunked in lockstep; with `atlas_outdir` the atlas chunks paired
+    with kept image chunks are written there as `<atlas stem>_chunk_<y>_<x>.tif`.
+
+    With `catalog` (a connection from `chunk_catalog.create_catalog`), one
+    row per kept chunk is added, including the atlas region histogram
+    when `atlas_path` is given. With `image_outdir=None` no chunk is written
+    and the catalog rows are virtual (see `read_catalog_chunks`). With
+    `packed=True` the kept chunks go into one container in `image_outdir`,
+    `<image stem>_chunks.tif`, instead of one TIFF each.
+
+    With `write_workers > 1`, loose chunk TIFFs are encoded and written on
+    that many threads while the next chunks are read, holding at most
+    `max_inflight_bytes` of queued chunks (see `prefetch.WriteBehind`).
+    Containers are always written in order.
+
+    Returns the number of kept and total chunks.
+    """
+    rows = [] if catalog is not None else None
+    kept, total = _chunk_and_filter(
+        path_to_image,
+        image_outdir,
+        chunk_size,
+        pixel_val_threshold,
+        stack,
+        atlas_path,
+        atlas_outdir,
+        tiff_options,
+        rows,
+        packed,
+        write_workers,
+        max_inflight_bytes,
+    )
+    if catalog is not None:
+        add_chunk_rows(catalog, rows)
+    return kept, total
+
+
+def _chunk_and_filter(
+    path_to_image,
+    image_outdir,
+    chunk_size,
+    pixel_val_threshold=None,
+    stack=False,
+    atlas_path=None,
+    atlas_outdir=None,
+    tiff_options=None,
+    rows=None,
+    packed=False,
+    write_workers=1,
+    max_inflight_bytes=256 * 2**20,
+):
+    # chunk_and_filter_image, appending the catalog rows to `rows` (if given) instead of
+    # inserting them, so worker processes can hand them to the process that owns the catalog.
+    image_name = path_to_image.stem
+    atlas_chunks = iter_chunks(atlas_path, chunk_size) if atlas_path is not None else None
+
+    kept = 0
+    total = 0
+    container_file = None
+    if packed and image_outdir is not None:
+        container_file = Path(f"{image_outdir}/{image_name}{PACKED_SUFFIX}")
+    writer = None
+    with ExitStack() as resources:
+        writes = resources.enter_context(WriteBehind(write_workers, max_inflight_bytes))
+        for i, j, chunk, stats in _iter_chunks_with_stats(path_to_image, chunk_size, stack):
+            atlas_chunk = None
+            if atlas_chunks is not None:
+                atlas_i, atlas_j, atlas_chunk = next(atlas_chunks, (None, None, None))
+                chunk_yx = chunk.shape[1:3] if stack else chunk.shape[:2]
+                if (atlas_i, atlas_j) != (i, j) or atlas_chunk.shape[:2] != chunk_yx:
+                    raise ValueError(f"Atlas slice does not match the image size:\n{atlas_path}\n{path_to_image}")
+
+            total += 1
+            # chunk_mean reads RGB chunks like stacks; keep its rule for them so the output still matches step 4
+            mean = stats["mean"] if stack or chunk.ndim == 2 else chunk_mean(chunk)
+            if pixel_val_threshold is not None and mean <= pixel_val_threshold:
+                continue
+
+            chunk_file = f"{image_name}_chunk_{i}_{j}.tif"
+            container_index = None
+            if container_file is not None:
+                # Opened on the first kept chunk, so sources without kept chunks leave no container
+                if writer is None:
+                    writer = resources.enter_context(open_packed_chunks(container_file))
+                # Explicit for stacks, so 3-plane chunks are not stored as RGB
+                photometric = {"photometric": "minisblack"} if stack else {}
+                write_packed_chunk(writer, chunk, i, j, tiff_options, **photometric)
+                container_index = kept
+            elif image_outdir is not None:
+                writes.submit(write_tiff, f"{image_outdir}/{chunk_file}", chunk, tiff_options, nbytes=chunk.nbytes)
+            atlas_chunk_file = None
+            if atlas_chunk is not None:
+                atlas_chunk_file = f"{atlas_path.stem}_chunk_{i}_{j}.tif"
+                if atlas_outdir is not None:
+                    writes.submit(
+                        write_tiff,
+                        f"{atlas_outdir}/{atlas_chunk_file}",
+                        atlas_chunk,
+                        tiff_options,
+                        nbytes=atlas_chunk.nbytes,
+                    )
+            if rows is not None:
+                rows.append(
+                    chunk_row(
+                        chunk_file,
+                        path_to_image,
+                        i,
+                        j,
+                        chunk,
+                        mean,
+                        chunk_size,
+                        stack=stack,
+                        atlas_source_file=atlas_path,
+                        atlas_chunk_file=atlas_chunk_file,
+                        atlas_chunk=atlas_chunk,
+                        nonzero_fraction=stats["nonzero"] / stats["size"] if stats["size"] else 0.0,
+                        container_file=container_file,
+                        container_index=container_index,
+                        virtual=image_outdir is None or container_file is not None,
+                    )
+                )
+            kept += 1
+
+    if atlas_chunks is not None and next(atlas_chunks, None) is not None:
+        raise ValueError(f"Atlas slice does not match the image size:\n{atlas_path}\n{path_to_image}")
+
+    return kept, total
+
+
+def chunk_images(jobs, catalog=None, num_workers=1):
+    """
+    Run `chunk_and_filter_image` for several images, optionally on a process pool.
+
+    Parameters
+    ----------
+    jobs : list[dict]
+        `chunk_and_filter_image` keyword arguments, one dictionary per image
+        (`path_to_image`, `image_outdir`, `chunk_size` and optional filter,
+        atlas, TIFF, packing and `write_workers`/`max_inflight_bytes`
+        settings). A job's `catalog` entry is a bool: whether its chunks are
+        added to `catalog`.
+    catalog : sqlite3.Connection | None, optional
+        Catalog from `chunk_catalog.create_catalog`. Only this process writes
+        it; workers send their rows back, and rows are inserted in job order,
+        so the catalog is the same as a serial run's.
+    num_workers : int, optional
+        Number of processes chunking images in parallel (1 = serial, in this
+        process). Scripts using more than one must guard their entry point
+        with `if __name__ == "__main__":`.
+
+    Yields
+    ------
+    tuple[dict, int, int]
+        `(job, kept, total)` per image, in job order, once its chunks are written.
+    """
+    if num_workers < 1:
+        raise ValueError("num_workers must be >= 1.")
+
+    if num_workers == 1:
+        results = (_run_chunk_job(job) for job in jobs)
+        for job, (kept, total, rows) in zip(jobs, results):
+            if rows is not None and catalog is not None:
+                add_chunk_rows(catalog, rows)
+            yield job, kept, total
+        return
+
+    with ProcessPoolExecutor(max_workers=num_workers) as pool:
+        futures = [pool.submit(_run_chunk_job, job) for job in jobs]
+        try:
+            for job, future in zip(jobs, futures):
+                kept, total, rows = future.result()
+                if rows is not None and catalog is not None:
+                    add_chunk_rows(catalog, rows)
+                yield job, kept, total
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+def _run_chunk_job(job):
+    # One chunk_images job; returns (kept, total, catalog rows or None).
+    job = dict(job)
+    rows = [] if job.pop("catalog", False) else None
+    kept, total = _chunk_and_filter(**job, rows=rows)
+    return kept, total, rows
+
+
+def _iter_chunks_with_stats(path_to_image, chunk_size, stack=False):
+    # iter_chunks, plus each chunk's block_stats from one reduction per row of chunks.
+    for i, band in iter_image_bands(path_to_image, chunk_size):
+        band = np.asarray(band)
+        band_stats = block_stats(band, chunk_size, stack=stack)[0]
+        for j, chunk in _band_chunks(band, chunk_size, stack):
+            yield i, j, chunk, band_stats[j // chunk_size]
+
+
+def read_catalog_chunks(rows, atlas=False):
+    """
+    Yield `(row, chunk)` for virtual chunk catalog rows.
+
+    Packed rows are decoded from their container, other rows are cropped from
+    their source images. With `atlas=True` the paired atlas chunks are cropped
+    from `atlas_source_file` instead. Rows are grouped by container/source;
+    each source is read one row of chunks at a time (as in `iter_chunks`),
+    stopping after its last requested chunk, so only the sources of the given
+    rows are read.
+    """
+    rows_by_container = defaultdict(list)
+    rows_by_source = defaultdict(dict)
+    for row in rows:
+        if not atlas and row["container_file"] is not None:
+            rows_by_container[row["container_file"]].append(row)
+            continue
+        source = row["atlas_source_file"] if atlas else row["source_file"]
+        if source is None:
+            raise ValueError(f"Chunk catalog row has no atlas source:\n{row['chunk_file']}")
+        # Atlas slices are 2D even when the image chunks are stack chunks
+        key = (source, row["chunk_size"], row["stack"] and not atlas)
+        rows_by_source[key][(row["y"], row["x"])] = row
+
+    for container_file, container_rows in rows_by_container.items():
+        container_rows = sorted(container_rows, key=lambda row: row["container_index"])
+        indices = [row["container_index"] for row in container_rows]
+        for row, (_, y, x, chunk) in zip(container_rows, iter_packed_chunks(container_file, indices)):
+            if (y, x) != (row["y"], row["x"]):
+                raise RuntimeError(f"Packed chunk container does not match its catalog:\n{container_file}")
+            yield row, chunk
+
+    for (source, chunk_size, stack), wanted in rows_by_source.items():
+        for i, j, chunk in iter_chunks(Path(source), chunk_size, stack=stack):
+            row = wanted.pop((i, j), None)
+            if row is not None:
+                yield row, np.asarray(chunk)
+            if not wanted:
+                break
+
+        if wanted:
+            raise RuntimeError(f"Chunk catalog rows lie outside their source image:\n{source}")
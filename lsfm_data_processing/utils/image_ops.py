@@ -1,8 +1,20 @@
+import os
 import sys
+from collections.abc import Iterator, Sequence
+from functools import partial
 from pathlib import Path
 
 import cv2
 import numpy as np
+import tifffile
+
+from .prefetch import prefetch
+from .tiff_io import band_rows_for_budget, iter_tiff_bands, iter_tiles, require_2d_pages, tiff_write_options
+from .zarr_io import pyramid_row_multiple, write_ome_zarr_bands
+
+
+# Pixels processed per block by the histogram and lookup-table passes, so neither copies a whole image.
+_BLOCK_PIXELS = 1 << 16
 
 
 def convert_to_uint8(image_array: np.ndarray) -> np.ndarray:
@@ -11,6 +23,10 @@ def convert_to_uint8(image_array: np.ndarray) -> np.ndarray:
     if arr.size == 0:
         return arr.astype(np.uint8)
 
+    if supports_histogram_percentiles(arr.dtype):
+        lut = _uint8_minmax_lut(np.iinfo(arr.dtype).max + 1, int(arr.min()), int(arr.max()))
+        return apply_lut(arr, lut)
+
     arr_f = arr.astype(np.float32)
     min_val = float(np.min(arr_f))
     max_val = float(np.max(arr_f))
@@ -21,6 +37,15 @@ def convert_to_uint8(image_array: np.ndarray) -> np.ndarray:
     return np.rint(out).astype(np.uint8)
 
 
+def _uint8_minmax_lut(n_levels: int, min_level: int, max_level: int) -> np.ndarray:
+    """Return the `convert_to_uint8` lookup table for integer data spanning min_level..max_level."""
+    lut = np.zeros(n_levels, dtype=np.uint8)
+    if max_level > min_level:
+        levels = np.arange(min_level, max_level + 1, dtype=np.float32)
+        lut[min_level:max_level + 1] = np.rint(cv2.normalize(levels, None, 0, 255, cv2.NORM_MINMAX)).astype(np.uint8)
+    return lut
+
+
 def _raise_if_windows_path_too_long(path: Path, limit: int = 260) -> None:
     """Raise a clear error when a Windows path likely exceeds legacy MAX_PATH."""
     if not sys.platform.startswith("win"):
@@ -35,33 +60,376 @@ def _raise_if_windows_path_too_long(path: Path, limit: int = 260) -> None:
         )
 
 
-def normalize_array(image_array: np.ndarray, min_val=0, max_val=99.5, convert_to_8bit=False):
-    """Normalize an image array using given percentile min/max values."""
+def supports_histogram_percentiles(dtype) -> bool:
+    """Return True for dtypes whose percentiles can be read from an integer histogram (uint8/uint16)."""
+    return np.dtype(dtype) in (np.dtype(np.uint8), np.dtype(np.uint16))
+
+
+def integer_histogram(image_array: np.ndarray, counts: np.ndarray | None = None) -> np.ndarray:
+    """
+    Count the pixel values of a uint8/uint16 image, one bin per possible value.
+
+    Pixels are counted in fixed-size blocks, so no full-size temporary is made.
+    Pass the result back in as `counts` to accumulate several images into one
+    histogram.
+    """
+    arr = np.asarray(image_array)
+    if not supports_histogram_percentiles(arr.dtype):
+        raise TypeError(f"Integer histograms need uint8 or uint16 data, got {arr.dtype}")
+
+    n_bins = np.iinfo(arr.dtype).max + 1
+    if counts is None:
+        counts = np.zeros(n_bins, dtype=np.int64)
+    elif counts.shape != (n_bins,):
+        raise ValueError(f"Histogram has {counts.shape[0]} bins, expected {n_bins} for {arr.dtype} data")
+
+    flat = arr.reshape(-1)
+    for start in range(0, flat.size, _BLOCK_PIXELS):
+        counts += np.bincount(flat[start:start + _BLOCK_PIXELS], minlength=n_bins)
+    return counts
+
+
+def histogram_percentiles(counts: np.ndarray, percentiles) -> list[np.float64]:
+    """
+    Return percentiles of the values counted in `counts` (bin index = value).
+
+    Matches `np.percentile(values, q)` with the default linear method exactly,
+    including its interpolation rounding.
+    """
+    cumulative = np.cumsum(counts)
+    n = int(cumulative[-1]) if cumulative.size else 0
+    if n == 0:
+        raise ValueError("Cannot compute percentiles of an empty histogram")
+
+    results = []
+    for q in percentiles:
+        if not 0 <= q <= 100:
+            raise ValueError("Percentiles must be in the range [0, 100]")
+        virtual_index = (n - 1) * np.float64(np.true_divide(q, 100))
+        previous_index = min(int(np.floor(virtual_index)), n - 1)
+        next_index = min(previous_index + 1, n - 1)
+        # Value at sorted position i is the first bin whose cumulative count exceeds i.
+        a, b = np.searchsorted(cumulative, [previous_index, next_index], side="right").astype(np.float64)
+        gamma = virtual_index - np.floor(virtual_index) if virtual_index < n - 1 else np.float64(0)
+        # Same two-sided lerp as numpy, so results agree to the last bit.
+        diff = b - a
+        results.append(b - diff * (1 - gamma) if gamma >= 0.5 else a + diff * gamma)
+    return results
+
+
+def apply_lut(image_array: np.ndarray, lut: np.ndarray) -> np.ndarray:
+    """
+    Map a uint8/uint16 image through a lookup table (`lut[value]`).
+
+    The output is written straight into the dtype of `lut` in one blockwise
+    pass, without float or index temporaries of the full image size.
+    """
+    arr = np.asarray(image_array)
+    if not supports_histogram_percentiles(arr.dtype):
+        raise TypeError(f"Lookup tables need uint8 or uint16 data, got {arr.dtype}")
+    if lut.shape != (np.iinfo(arr.dtype).max + 1,):
+        raise ValueError(f"Lookup table has {lut.shape[0]} entries, expected {np.iinfo(arr.dtype).max + 1}")
+
+    out = np.empty(arr.shape, dtype=lut.dtype)
+    flat_in = arr.reshape(-1)
+    flat_out = out.reshape(-1)
+    for start in range(0, flat_in.size, _BLOCK_PIXELS):
+        stop = start + _BLOCK_PIXELS
+        np.take(lut, flat_in[start:stop], out=flat_out[start:stop])
+    return out
+
+
+def compute_percentiles(image_array: np.ndarray, percentiles) -> list[np.float64]:
+    """
+    Return `np.percentile(image_array, q)` for each q in `percentiles`.
+
+    uint8/uint16 images use a single integer histogram (O(n), no full-size
+    copy); other dtypes fall back to `np.percentile`.
+    """
+    if supports_histogram_percentiles(image_array.dtype) and image_array.size:
+        return histogram_percentiles(integer_histogram(image_array), percentiles)
+    return [np.percentile(image_array, q) for q in percentiles]
+
+
+def tiff_histogram(
+    path: Path,
+    counts: np.ndarray | None = None,
+    tile_budget_bytes: int = 256 * 1024**2,
+) -> np.ndarray:
+    """
+    Return the `integer_histogram` of all pages of a uint8/uint16 TIFF, read band by band.
+
+    At most about `tile_budget_bytes` of decoded pixels are held at once (see
+    `iter_tiff_bands`), so this works on frames larger than memory.
+    """
+    with tifffile.TiffFile(path) as tif:
+        pages = require_2d_pages(tif, path)
+        if not supports_histogram_percentiles(pages[0].dtype):
+            raise TypeError(f"Integer histograms need uint8 or uint16 data, got {pages[0].dtype}:\n{path}")
+        band_rows = band_rows_for_budget(pages[0], tile_budget_bytes, 2 * pages[0].dtype.itemsize)
+        for page in pages:
+            for _, band in iter_tiff_bands(page, band_rows, buffersize=tile_budget_bytes // 4):
+                counts = integer_histogram(band, counts)
+    return counts
+
+
+def stack_percentiles(
+    image_paths: Sequence[Path],
+    percentiles,
+    slice_step: int = 1,
+    read_ahead: int = 0,
+    tile_budget_bytes: int | None = None,
+) -> list[np.float64]:
+    """
+    Return percentiles of the pooled pixels of a uint8/uint16 image stack.
+
+    Slices are streamed into one combined integer histogram, so only the
+    slice being counted (plus `read_ahead` prefetched ones) is held in memory.
+    With `slice_step > 1` only every `slice_step`-th slice is counted. With
+    `tile_budget_bytes`, each slice is read band by band (see
+    `tiff_histogram`) instead of as a whole frame.
+    """
+    if slice_step < 1:
+        raise ValueError("slice_step must be >= 1.")
+    paths = list(image_paths)[::slice_step]
+    if not paths:
+        raise ValueError("No images to compute stack percentiles from.")
+
+    counts = None
+    if tile_budget_bytes is not None:
+        read_histogram = partial(tiff_histogram, tile_budget_bytes=tile_budget_bytes)
+        for path, future in zip(paths, prefetch(read_histogram, paths, read_ahead)):
+            slice_counts = future.result()
+            if counts is not None and counts.size != slice_counts.size:
+                raise TypeError(f"Slice dtype differs from the rest of the stack:\n{path}")
+            counts = slice_counts if counts is None else counts + slice_counts
+        return histogram_percentiles(counts, percentiles)
+
+    for path, future in zip(paths, prefetch(tifffile.imread, paths, read_ahead)):
+        image_array = future.result()
+        if not supports_histogram_percentiles(image_array.dtype):
+            raise TypeError(
+                "Stack percentiles need uint8 or uint16 slices.\n"
+                f"Got {image_array.dtype} in:\n{path}"
+            )
+        if counts is not None and counts.size != np.iinfo(image_array.dtype).max + 1:
+            raise TypeError(f"Slice dtype differs from the rest of the stack:\n{path}")
+        counts = integer_histogram(image_array, counts)
+    return histogram_percentiles(counts, percentiles)
+
+
+def _scale_clipped(
+    clipped_image: np.ndarray,
+    lower_threshold: float,
+    upper_threshold: float,
+    out_min: float,
+    out_max: float,
+    fixed_range: bool,
+) -> np.ndarray:
+    """Scale a clipped float32 image to [out_min, out_max], from its own min/max or from the thresholds."""
+    if not fixed_range:
+        return cv2.normalize(clipped_image, None, out_min, out_max, cv2.NORM_MINMAX)
+    scale = (out_max - out_min) / (upper_threshold - lower_threshold)
+    return (clipped_image - np.float32(lower_threshold)) * np.float32(scale) + np.float32(out_min)
+
+
+def normalization_lut(
+    dtype,
+    counts: np.ndarray | None = None,
+    min_val=0,
+    max_val=99.5,
+    convert_to_8bit=False,
+    thresholds: Sequence[float] | None = None,
+) -> np.ndarray:
+    """
+    Return the lookup table `normalize_array` applies to uint8/uint16 data.
+
+    The table is built by running the float clip/scale/round steps of
+    `normalize_array` on every possible input level, so mapping an image
+    through it (`apply_lut`) gives output identical to the float path.
+    `counts` is the `integer_histogram` of the image (or of several images or
+    tiles, for out-of-core use); it is needed unless valid `thresholds` are
+    given. Without fixed thresholds, the levels are limited to the image's
+    own min..max, which gives the clipped ramp the same min/max that
+    `cv2.NORM_MINMAX` sees on the image.
+    """
+    dtype = np.dtype(dtype)
+    n_levels = np.iinfo(dtype).max + 1
+    fixed_range = thresholds is not None
+
+    if fixed_range:
+        lower_threshold, upper_threshold = (np.float64(t) for t in thresholds)
+    else:
+        lower_threshold, upper_threshold = histogram_percentiles(counts, (min_val, max_val))
+
+    if fixed_range and upper_threshold > lower_threshold:
+        min_level, max_level = 0, n_levels - 1
+    else:
+        if counts is None:
+            raise ValueError("A histogram (counts) is needed unless valid thresholds are given.")
+        present = np.flatnonzero(counts)
+        min_level, max_level = int(present[0]), int(present[-1])
+
+    if upper_threshold <= lower_threshold:
+        if convert_to_8bit:
+            return _uint8_minmax_lut(n_levels, min_level, max_level)
+        return np.arange(n_levels, dtype=dtype)
+
+    if convert_to_8bit:
+        out_dtype, out_min, out_max = np.dtype(np.uint8), 0, 255
+    else:
+        out_dtype = dtype
+        out_min, out_max = np.iinfo(out_dtype).min, np.iinfo(out_dtype).max
+
+    levels = np.arange(min_level, max_level + 1, dtype=dtype)
+    clipped_levels = np.clip(levels, lower_threshold, upper_threshold).astype(np.float32)
+    scaled_levels = _scale_clipped(clipped_levels, lower_threshold, upper_threshold, out_min, out_max, fixed_range)
+
+    lut = np.zeros(n_levels, dtype=out_dtype)
+    lut[min_level:max_level + 1] = np.rint(scaled_levels).astype(out_dtype)
+    return lut
+
+
+def normalize_array(
+    image_array: np.ndarray,
+    min_val=0,
+    max_val=99.5,
+    convert_to_8bit=False,
+    thresholds: Sequence[float] | None = None,
+):
+    """
+    Normalize an image array using given percentile min/max values.
+
+    If `thresholds` (lower, upper intensity) is given, it replaces the
+    per-image percentiles and the output range is mapped from exactly these
+    values, so every image normalized with the same thresholds shares one
+    intensity scale (e.g. sample-level thresholds from `stack_percentiles`).
+
+    uint8/uint16 images are mapped through a lookup table in one pass (see
+    `normalization_lut`); other dtypes use the float clip/scale path.
+    """
     input_dtype = image_array.dtype
+    fixed_range = thresholds is not None
 
-    lower_threshold = np.percentile(image_array, min_val)
-    upper_threshold = np.percentile(image_array, max_val)
-    clipped_image = np.clip(image_array, lower_threshold, upper_threshold).astype(np.float32)
+    if supports_histogram_percentiles(input_dtype) and image_array.size > 0:
+        needs_counts = not fixed_range or thresholds[1] <= thresholds[0]
+        counts = integer_histogram(image_array) if needs_counts else None
+        lut = normalization_lut(input_dtype, counts, min_val, max_val, convert_to_8bit, thresholds)
+        return apply_lut(image_array, lut)
+
+    if fixed_range:
+        lower_threshold, upper_threshold = (np.float64(t) for t in thresholds)
+    else:
+        lower_threshold, upper_threshold = compute_percentiles(image_array, (min_val, max_val))
 
     if upper_threshold <= lower_threshold:
         return convert_to_uint8(image_array) if convert_to_8bit else image_array.astype(input_dtype)
 
+    clipped_image = np.clip(image_array, lower_threshold, upper_threshold).astype(np.float32)
+
     if convert_to_8bit:
-        normalized_image = cv2.normalize(clipped_image, None, 0, 255, cv2.NORM_MINMAX)
+        normalized_image = _scale_clipped(clipped_image, lower_threshold, upper_threshold, 0, 255, fixed_range)
         return np.rint(normalized_image).astype(np.uint8)
 
     if np.issubdtype(input_dtype, np.integer):
         dtype_info = np.iinfo(input_dtype)
-        normalized_image = cv2.normalize(
+        normalized_image = _scale_clipped(
             clipped_image,
-            None,
+            lower_threshold,
+            upper_threshold,
             dtype_info.min,
             dtype_info.max,
-            cv2.NORM_MINMAX,
+            fixed_range,
         )
         return np.rint(normalized_image).astype(input_dtype)
     if np.issubdtype(input_dtype, np.floating):
-        normalized_image = cv2.normalize(clipped_image, None, 0.0, 1.0, cv2.NORM_MINMAX)
+        normalized_image = _scale_clipped(clipped_image, lower_threshold, upper_threshold, 0.0, 1.0, fixed_range)
         return normalized_image.astype(input_dtype)
 
-    raise TypeError(f"Unsupported image dtype for normalization: {input_dtype}")
\ No newline at end of file
+    raise TypeError(f"Unsupported image dtype for normalization: {input_dtype}")
+
+
+def normalize_tiff_tiled(
+    input_path: Path,
+    output_path: Path,
+    min_val=0,
+    max_val=99.5,
+    convert_to_8bit=False,
+    thresholds: Sequence[float] | None = None,
+    tile_budget_bytes: int = 256 * 1024**2,
+    tile: tuple[int, int] = (256, 256),
+    tiff_options: dict | None = None,
+    zarr_options: dict | None = None,
+) -> None:
+    """
+    Normalize a uint8/uint16 TIFF out of core, band by band.
+
+    The output matches `normalize_array` on the whole image (all pages
+    pooled), but the frame is never held in memory: without `thresholds` a
+    first pass streams every band into one `integer_histogram` to get the
+    percentiles, then a second pass maps each band through the
+    `normalization_lut` and writes it as tiles. The output is written under a
+    temporary name and moved into place once complete.
+
+    `tile_budget_bytes` is the approximate peak memory for the input band,
+    output band and decode buffers (at least one row of strips/tiles), and
+    `tile` the output tile shape (multiples of 16). `tiff_options` (from
+    `tiff_write_options`, default LZW) sets the codec; its `tile`, if any,
+    replaces `tile`. With `zarr_options`
+    (keyword arguments of `write_ome_zarr_bands`), the bands are written to an
+    OME-Zarr pyramid at `output_path` instead of a tiled TIFF.
+    """
+    with tifffile.TiffFile(input_path) as tif:
+        pages = require_2d_pages(tif, input_path)
+        dtype = pages[0].dtype
+        if not supports_histogram_percentiles(dtype):
+            raise TypeError(f"Tiled normalization needs uint8 or uint16 data, got {dtype}:\n{input_path}")
+
+        write_options = dict(tiff_options or tiff_write_options("lzw"))
+        tile = write_options.pop("tile", tile)
+        out_dtype = np.dtype(np.uint8) if convert_to_8bit else dtype
+        # input band + spill/decode slack + output band
+        bytes_per_pixel = 2 * dtype.itemsize + out_dtype.itemsize
+        if zarr_options is None:
+            row_multiple = tile[0]
+        else:
+            row_multiple = pyramid_row_multiple(
+                zarr_options.get("chunk_size", 256), zarr_options.get("pyramid_levels", 4)
+            )
+        band_rows = band_rows_for_budget(pages[0], tile_budget_bytes, bytes_per_pixel, row_multiple=row_multiple)
+        buffersize = max(tile_budget_bytes // 4, 1)
+
+        counts = None
+        if thresholds is None or thresholds[1] <= thresholds[0]:
+            for page in pages:
+                for _, band in iter_tiff_bands(page, band_rows, buffersize):
+                    counts = integer_histogram(band, counts)
+        lut = normalization_lut(dtype, counts, min_val, max_val, convert_to_8bit, thresholds)
+
+        shape = pages[0].shape if len(pages) == 1 else (len(pages), *pages[0].shape)
+
+        if zarr_options is not None:
+            def _bands() -> Iterator[tuple[tuple[int, ...], np.ndarray]]:
+                for z, page in enumerate(pages):
+                    for row, band in iter_tiff_bands(page, band_rows, buffersize):
+                        yield ((row,) if len(pages) == 1 else (z, row)), apply_lut(band, lut)
+
+            write_ome_zarr_bands(output_path, shape, out_dtype, _bands(), **zarr_options)
+            return
+
+        def _tiles() -> Iterator[np.ndarray]:
+            for page in pages:
+                for _, band in iter_tiff_bands(page, band_rows, buffersize):
+                    yield from iter_tiles(apply_lut(band, lut), tile)
+
+        tmp_path = output_path.with_suffix(".part")
+        tifffile.imwrite(
+            tmp_path,
+            _tiles(),
+            shape=shape,
+            dtype=out_dtype,
+            tile=tile,
+            buffersize=buffersize,
+            **write_options,
+        )
+    os.replace(tmp_path, output_path)
@@ -1,7 +1,16 @@
 from pathlib import Path
 from typing import Any
+import os
+import shutil
+import sys
 import tomllib
 
+LINK_MODES = ("copy", "hardlink", "symlink", "reflink")
+
+# Linux FICLONE ioctl: share the data blocks of one file with another (btrfs, XFS, ...)
+_FICLONE = 0x40049409
+_reported_fallbacks: set[tuple[str, str]] = set()
+
 
 # -------------------------
 # PATH NORMALIZATION
@@ -157,6 +166,122 @@ def list_tiff_files(folder: Path) -> list[Path]:
     )
 
 
+def list_image_files(folder: Path) -> list[Path]:
+    """
+    Return sorted TIFF files and OME-Zarr image folders directly inside a folder.
+
+    Parameters
+    ----------
+    folder : Path
+        Folder to scan (non-recursive).
+
+    Returns
+    -------
+    list[Path]
+        Sorted list of .tif/.tiff files and .zarr folders.
+    """
+    zarr_images = [p for p in folder.iterdir() if p.is_dir() and p.suffix.lower() == ".zarr"]
+    return sorted(list_tiff_files(folder) + zarr_images)
+
+
+# -------------------------
+# FILE MATERIALIZATION
+# -------------------------
+
+def link_mode_from_config(cfg: dict[str, Any], default: str = "copy") -> str:
+    """
+    Read and validate the `link_mode` key of a script config.
+
+    Parameters
+    ----------
+    cfg : dict[str, Any]
+        Parsed script config.
+    default : str, optional
+        Mode used when the key is missing.
+
+    Returns
+    -------
+    str
+        One of `LINK_MODES`.
+
+    Raises
+    ------
+    RuntimeError
+        If the mode is unknown.
+    """
+    link_mode = cfg.get("link_mode", default)
+    if link_mode not in LINK_MODES:
+        raise RuntimeError(
+            f"Unknown link_mode {link_mode!r}.\n"
+            f"Expected one of: {', '.join(LINK_MODES)}"
+        )
+    return link_mode
+
+
+def _reflink(src: Path, dst: Path) -> None:
+    if not sys.platform.startswith("linux"):
+        raise OSError("reflinks are only supported on Linux")
+    import fcntl
+
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+    shutil.copystat(src, dst)
+
+
+def materialize_file(src: str | Path, dst: str | Path, link_mode: str = "copy") -> str:
+    """
+    Put a file at `dst` with the same content as `src`: copy, hardlink, symlink or reflink.
+
+    `hardlink` and `symlink` use no extra space, but the output shares its data
+    with (or points to) the source: edits show up in both, and a symlink breaks
+    when the source moves. `reflink` shares data blocks until either file is
+    changed (copy-on-write filesystems such as btrfs or XFS). When linking is not
+    possible (different volume, unsupported filesystem, no symlink permission),
+    the file is copied instead and a warning is printed once per mode and reason.
+
+    Parameters
+    ----------
+    src : str | Path
+        Existing file.
+    dst : str | Path
+        Output file path; an existing file is replaced, as with `shutil.copy2`.
+    link_mode : str, optional
+        One of `LINK_MODES`.
+
+    Returns
+    -------
+    str
+        The mode actually used (`"copy"` after a fallback).
+    """
+    src = Path(src)
+    dst = Path(dst)
+    if link_mode not in LINK_MODES:
+        raise ValueError(f"Unknown link_mode {link_mode!r}, expected one of {LINK_MODES}")
+    if dst.exists() and not dst.is_symlink() and src.resolve() == dst.resolve():
+        raise ValueError(f"Source and output are the same file:\n{src}")
+
+    if link_mode != "copy":
+        try:
+            if dst.is_symlink() or dst.exists():
+                dst.unlink()
+            if link_mode == "hardlink":
+                os.link(src, dst)
+            elif link_mode == "symlink":
+                os.symlink(src.resolve(), dst)
+            else:
+                _reflink(src, dst)
+            return link_mode
+        except OSError as e:
+            dst.unlink(missing_ok=True)
+            reason = e.strerror or str(e)
+            if (link_mode, reason) not in _reported_fallbacks:
+                _reported_fallbacks.add((link_mode, reason))
+                print(f"Warning: {link_mode} not possible ({reason}), copying instead:\n{src}")
+
+    shutil.copy2(src, dst)
+    return "copy"
+
+
 # -------------------------
 # CONFIG LOADER
 # -------------------------
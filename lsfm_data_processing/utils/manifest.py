@@ -0,0 +1,103 @@
+import json
+import os
+from pathlib import Path
+from typing import Any
+
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+
+
+def file_signature(path: Path) -> dict[str, Any]:
+    """Return the path, size and modification time used to detect changed files."""
+    st = path.stat()
+    return {"path": str(path), "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def _json_roundtrip(value: Any) -> Any:
+    """Normalize a value the way it will look after being saved and reloaded."""
+    return json.loads(json.dumps(value))
+
+
+def load_manifest(output_dir: Path, parameters: dict[str, Any], resume: bool) -> dict[str, Any]:
+    """
+    Load the run manifest of an output folder, or start a new one.
+
+    The manifest records the processing parameters of a run and, for every
+    completed output, the signatures of its inputs and of the written file.
+    An existing manifest is only reused when `resume` is True and its
+    parameters match `parameters`; otherwise every output is treated as stale.
+
+    Parameters
+    ----------
+    output_dir : Path
+        Folder containing (or receiving) the outputs and `manifest.json`.
+    parameters : dict[str, Any]
+        JSON-serializable processing parameters of the current run.
+    resume : bool
+        If True, reuse a matching manifest so up-to-date outputs can be skipped.
+
+    Returns
+    -------
+    dict[str, Any]
+        Manifest dictionary to pass to `output_is_current` / `record_output`.
+    """
+    parameters = _json_roundtrip(parameters)
+    fresh = {"version": MANIFEST_VERSION, "parameters": parameters, "outputs": {}}
+
+    manifest_path = output_dir / MANIFEST_NAME
+    if not resume or not manifest_path.exists():
+        return fresh
+
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"Warning: could not read {manifest_path} ({e}). All outputs will be recreated.")
+        return fresh
+
+    if manifest.get("version") != MANIFEST_VERSION or manifest.get("parameters") != parameters:
+        print(f"Parameters changed since the last run in {output_dir}. All outputs will be recreated.")
+        return fresh
+
+    return manifest
+
+
+def output_is_current(
+    manifest: dict[str, Any],
+    output_path: Path,
+    input_signatures: list[dict[str, Any]],
+) -> bool:
+    """
+    Return True when `output_path` was recorded as complete from unchanged inputs.
+
+    The output must exist with the recorded size/mtime, and `input_signatures`
+    (current `file_signature` of each input) must match the recorded ones.
+    """
+    entry = manifest["outputs"].get(output_path.name)
+    if entry is None or not output_path.exists():
+        return False
+    if entry["output"] != file_signature(output_path):
+        return False
+    return entry["inputs"] == input_signatures
+
+
+def record_output(
+    manifest: dict[str, Any],
+    output_path: Path,
+    input_signatures: list[dict[str, Any]],
+) -> None:
+    """Record a completed output with the signatures its inputs had when it was planned."""
+    manifest["outputs"][output_path.name] = {
+        "inputs": input_signatures,
+        "output": file_signature(output_path),
+    }
+
+
+def save_manifest(output_dir: Path, manifest: dict[str, Any]) -> None:
+    """Atomically write `manifest.json` so an interrupted save never corrupts it."""
+    manifest_path = output_dir / MANIFEST_NAME
+    tmp_path = manifest_path.with_suffix(".part")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+
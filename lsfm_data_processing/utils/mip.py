@@ -1,72 +1,624 @@
+from collections.abc import Iterable, Sequence
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import islice
 from pathlib import Path
+import math
+import os
 
 import cv2
 import numpy as np
-import tifffile
 
 from .image_ops import _raise_if_windows_path_too_long, convert_to_uint8, normalize_array
+from .manifest import file_signature, load_manifest, output_is_current, record_output, save_manifest
 from .naming import get_underscore_token
+from .prefetch import prefetch
+from .tiff_io import tiff_write_options, write_tiff
+from .zarr_io import ZARR_SUFFIX, write_ome_zarr
 
 
-def create_mips_from_folder(
+def _read_slice(path: Path) -> np.ndarray:
+    """Decode one 2D slice with OpenCV, raising a clear error on failure."""
+    img = cv2.imread(str(path), cv2.IMREAD_UNCHANGED)
+    if img is None:
+        raise RuntimeError(f"Could not read image slice:\n{path}")
+    return img
+
+
+def _fold_max(accumulator: np.ndarray | None, img: np.ndarray) -> np.ndarray:
+    """
+    Fold one slice into a running maximum projection in place.
+
+    The first slice seeds a preallocated accumulator (a copy, so the caller
+    can release or reuse the decoded slice); later slices are merged with
+    `np.maximum(..., out=accumulator)`, so peak memory stays at about two
+    planes regardless of how many slices are folded.
+    """
+    if accumulator is None:
+        accumulator = np.empty_like(img)
+        np.copyto(accumulator, img)
+        return accumulator
+
+    if img.shape != accumulator.shape or img.dtype != accumulator.dtype:
+        raise RuntimeError(
+            "All slices in a MIP group must share shape and dtype.\n"
+            f"Expected {accumulator.shape} {accumulator.dtype}, got {img.shape} {img.dtype}."
+        )
+    np.maximum(accumulator, img, out=accumulator)
+    return accumulator
+
+
+def _project_max(slices: Iterable[np.ndarray]) -> np.ndarray:
+    """Return the max-intensity projection of decoded slices, folding one slice at a time."""
+    mip_img = None
+    for img in slices:
+        mip_img = _fold_max(mip_img, img)
+    if mip_img is None:
+        raise ValueError("Cannot project an empty list of slices.")
+    return mip_img
+
+
+def _init_mip_worker() -> None:
+    """Keep OpenCV single-threaded inside pool workers to avoid oversubscribing cores."""
+    cv2.setNumThreads(1)
+
+
+def _finish_mip(
+    mip_img: np.ndarray,
+    mip_path: Path,
+    do_normalization: bool,
+    min_val: float,
+    max_val: float,
+    convert_to_8bit: bool,
+    tiff_options: dict,
+    norm_thresholds: Sequence[float] | None = None,
+    zarr_options: dict | None = None,
+) -> Path:
+    """
+    Post-process and write one projected MIP.
+
+    The TIFF (or OME-Zarr folder, with `zarr_options`) is written under a
+    temporary name and moved into place once complete, so an interrupted or
+    failed group never leaves a partial MIP.
+    """
+    if do_normalization:
+        mip_img = normalize_array(
+            mip_img,
+            min_val=min_val,
+            max_val=max_val,
+            convert_to_8bit=convert_to_8bit,
+            thresholds=norm_thresholds,
+        )
+    elif convert_to_8bit:
+        mip_img = convert_to_uint8(mip_img)
+
+    if zarr_options is not None:
+        return write_ome_zarr(mip_path, mip_img, **zarr_options)
+
+    tmp_path = mip_path.with_suffix(".part")
+    write_tiff(tmp_path, mip_img, tiff_options)
+    os.replace(tmp_path, mip_path)
+    return mip_path
+
+
+def _project_unit(slice_futures, unit: dict, **finish_kwargs) -> list[Path]:
+    """
+    Project one unit of consecutive slices into every requested MIP thickness.
+
+    Slices are folded into MIPs of the finest thickness; each finished fine MIP
+    is then folded into one accumulator per coarser thickness, so every slice
+    is read once however many thicknesses are produced. `unit["outputs"]`
+    holds, per thickness, `(number of fine MIPs, output path)` for each MIP in
+    the unit; outputs whose path is None are up to date and are neither
+    accumulated nor written. Sliding-window units are handed to
+    `_project_sliding_unit`.
+    """
+    if "window_blocks" in unit:
+        return _project_sliding_unit(slice_futures, unit, **finish_kwargs)
+
+    levels = unit["outputs"]
+    position = [0] * len(levels)
+    remaining = [outputs[0][0] for outputs in levels]
+    accumulators: list[np.ndarray | None] = [None] * len(levels)
+    written: list[Path] = []
+
+    for fine_size in unit["fine_sizes"]:
+        fine_mip = _project_max(future.result() for future in islice(slice_futures, fine_size))
+
+        for level, outputs in enumerate(levels):
+            n_fine, mip_path = outputs[position[level]]
+            if mip_path is not None:
+                # A MIP made of one fine MIP is that MIP; coarser ones accumulate into their own buffer.
+                accumulators[level] = fine_mip if n_fine == 1 else _fold_max(accumulators[level], fine_mip)
+
+            remaining[level] -= 1
+            if remaining[level] > 0:
+                continue
+
+            if mip_path is not None:
+                written.append(_finish_mip(accumulators[level], mip_path, **finish_kwargs))
+            accumulators[level] = None
+            position[level] += 1
+            if position[level] < len(outputs):
+                remaining[level] = outputs[position[level]][0]
+
+    return written
+
+
+def _project_sliding_unit(slice_futures, unit: dict, **finish_kwargs) -> list[Path]:
+    """
+    Project overlapping MIP windows with a van Herk/Gil-Werman running maximum.
+
+    Slices are first reduced to stride-sized blocks B_j, so each window is the
+    maximum of `k = window_blocks` consecutive blocks. The block sequence is cut
+    into segments of k blocks; for each segment we keep the suffix maxima
+    (max of B_i..end of segment, computed backward once the segment is
+    complete) and a running prefix maximum of the following segment. Every
+    window then spans at most one suffix and one prefix, so it costs one extra
+    `np.maximum` however thick it is, and each block is folded three times in
+    total. About 2k + 2 planes are held at once.
+    """
+    stride_slices = unit["stride_slices"]
+    k = unit["window_blocks"]
+    outputs = unit["outputs"]
+    n_blocks = len(outputs) + k - 1
+
+    segment: list[np.ndarray] = []
+    suffix: list[np.ndarray] = []
+    prefix = None
+    written: list[Path] = []
+
+    for j in range(n_blocks):
+        block = _project_max(future.result() for future in islice(slice_futures, stride_slices))
+
+        if j % k == 0:
+            # Turn the completed segment into suffix maxima, in place.
+            for i in range(len(segment) - 2, -1, -1):
+                np.maximum(segment[i], segment[i + 1], out=segment[i])
+            suffix, segment, prefix = segment, [], None
+        segment.append(block)
+        prefix = _fold_max(prefix, block)
+
+        window = j - k + 1
+        if window < 0 or outputs[window] is None:
+            continue
+        if j % k == k - 1:
+            # The window is exactly the current segment.
+            mip_img = prefix
+        else:
+            mip_img = np.maximum(suffix[window % k], prefix)
+        written.append(_finish_mip(mip_img, outputs[window], **finish_kwargs))
+
+    return written
+
+
+def _write_mip_unit(unit: dict, read_ahead: int, **finish_kwargs) -> list[Path]:
+    """Read, project and write one unit of MIPs (process-pool task)."""
+    slice_futures = prefetch(_read_slice, unit["slices"], read_ahead)
+    return _project_unit(slice_futures, unit, **finish_kwargs)
+
+
+def _mip_name(tiff_files: list[Path], start: int, end: int, underscores_to_plane_z: int) -> str:
+    first_plane = get_underscore_token(
+        tiff_files[start].stem,
+        underscores_to_plane_z,
+        "first plane z",
+    )
+    last_plane = get_underscore_token(
+        tiff_files[end - 1].stem,
+        underscores_to_plane_z,
+        "last plane z",
+    )
+    return f"MIP_{first_plane}_{last_plane}.tif"
+
+
+def _plan_block_units(
+    tiff_files: list[Path],
+    level_groups: list[list[tuple[int, int, Path, bool]]],
+    slices_per_level: list[int],
+) -> list[dict]:
+    """Split non-overlapping MIP groups of one or more thicknesses into independent units."""
+    num_files = len(tiff_files)
+    fine_slices = min(slices_per_level)
+
+    # A unit spans whole MIPs of every thickness, so units can be processed independently.
+    unit_slices = math.lcm(*slices_per_level)
+    units: list[dict] = []
+    for unit_start in range(0, num_files, unit_slices):
+        unit_end = min(unit_start + unit_slices, num_files)
+        outputs = []
+        for groups in level_groups:
+            outputs.append(
+                [
+                    (math.ceil((end - start) / fine_slices), None if is_current else mip_path)
+                    for start, end, mip_path, is_current in groups
+                    if unit_start <= start < unit_end
+                ]
+            )
+        if all(path is None for level in outputs for _, path in level):
+            continue
+        units.append(
+            {
+                "slices": tiff_files[unit_start:unit_end],
+                "fine_sizes": [
+                    min(fine_slices, unit_end - s) for s in range(unit_start, unit_end, fine_slices)
+                ],
+                "outputs": outputs,
+            }
+        )
+    return units
+
+
+def _plan_sliding_units(
+    tiff_files: list[Path],
+    windows: list[tuple[int, int, Path, bool]],
+    window_slices: int,
+    stride_slices: int,
+) -> list[dict]:
+    """
+    Split sliding-window MIPs into units of consecutive windows.
+
+    Each unit covers the slices of its windows, so neighbouring units re-read
+    the `window_slices - stride_slices` slices they overlap by; spans of many
+    windows keep that overhead small while still giving a process pool
+    enough units to share.
+    """
+    window_blocks = window_slices // stride_slices
+    windows_per_unit = max(64, 8 * window_blocks)
+    units: list[dict] = []
+    for first in range(0, len(windows), windows_per_unit):
+        span = windows[first : first + windows_per_unit]
+        if all(is_current for *_, is_current in span):
+            continue
+        start = span[0][0]
+        end = span[-1][1]
+        units.append(
+            {
+                "slices": tiff_files[start:end],
+                "stride_slices": stride_slices,
+                "window_blocks": window_blocks,
+                "outputs": [None if is_current else mip_path for _, _, mip_path, is_current in span],
+            }
+        )
+    return units
+
+
+def _plan_mips(
     input_dir: Path,
-    output_dir: Path,
+    output_dir: Path | Sequence[Path],
     z_step_size: float,
-    mip_thickness: float,
+    mip_thickness: float | Sequence[float],
     underscores_to_plane_z: int,
     do_normalization: bool = False,
     min_val: float = 0,
     max_val: float = 99.5,
     convert_to_8bit: bool = False,
     use_lzw_compression: bool = True,
-) -> None:
-    """Create max-intensity projections from sequential TIFF slices in a folder."""
-    slices_per_mip = int(mip_thickness / z_step_size)
-    if slices_per_mip < 1:
+    mip_stride: float | None = None,
+    norm_thresholds: Sequence[float] | None = None,
+    zarr_options: dict | None = None,
+    tiff_options: dict | None = None,
+    resume: bool = False,
+) -> dict:
+    """
+    Validate arguments, create output folders and split one input folder into MIP units.
+
+    Returns a plan dictionary with the units still to process, the manifests of
+    every output folder and the per-output bookkeeping used to record results.
+    """
+    if isinstance(mip_thickness, (int, float)):
+        thicknesses = [mip_thickness]
+        output_dirs = [output_dir]
+    else:
+        thicknesses = list(mip_thickness)
+        output_dirs = list(output_dir)
+        if len(output_dirs) != len(thicknesses):
+            raise ValueError("Provide exactly one output folder per MIP thickness.")
+    if len(set(thicknesses)) != len(thicknesses):
+        raise ValueError(f"MIP thicknesses must be unique. Got: {thicknesses}")
+    if len(set(output_dirs)) != len(output_dirs):
+        raise ValueError("Each MIP thickness needs its own output folder.")
+
+    slices_per_level = [int(t / z_step_size) for t in thicknesses]
+    if min(slices_per_level) < 1:
         raise ValueError("MIP thickness must be at least equal to the z-step size.")
+    fine_slices = min(slices_per_level)
+    if any(n % fine_slices for n in slices_per_level):
+        raise ValueError(
+            "Every MIP thickness must be a whole multiple of the finest thickness "
+            f"(in slices of {z_step_size} um). Got: {thicknesses}"
+        )
 
-    output_dir.mkdir(parents=True, exist_ok=False)
+    stride_slices = None
+    if mip_stride is not None:
+        if len(thicknesses) != 1:
+            raise ValueError("Sliding-window MIPs (mip_stride) support a single MIP thickness.")
+        stride_slices = int(mip_stride / z_step_size)
+        if stride_slices < 1:
+            raise ValueError("MIP stride must be at least equal to the z-step size.")
+        if slices_per_level[0] % stride_slices:
+            raise ValueError(
+                "Sliding-window MIP thickness must be a whole multiple of the stride "
+                f"(in slices of {z_step_size} um). Got thickness {thicknesses[0]}, stride {mip_stride}."
+            )
+
+    for out_dir in output_dirs:
+        out_dir.mkdir(parents=True, exist_ok=resume)
 
     tiff_files = sorted([f for f in input_dir.glob("*.tif*")])
     num_files = len(tiff_files)
 
-    print(f"Found {num_files} images")
+    print(f"Found {num_files} images in {input_dir.name}")
+
+    signatures = [file_signature(p) for p in tiff_files]
+    manifests = []
+    level_groups: list[list[tuple[int, int, Path, bool]]] = []
+    n_skipped = 0
+    for thickness, slices_per_mip, out_dir in zip(thicknesses, slices_per_level, output_dirs):
+        parameters = {
+            "input_dir": str(input_dir),
+            "z_step_size": z_step_size,
+            "mip_thickness": thickness,
+            "underscores_to_plane_z": underscores_to_plane_z,
+            "do_normalization": do_normalization,
+            "min_val": min_val,
+            "max_val": max_val,
+            "convert_to_8bit": convert_to_8bit,
+            "use_lzw_compression": use_lzw_compression,
+        }
+        if mip_stride is not None:
+            parameters["mip_stride"] = mip_stride
+        if norm_thresholds is not None:
+            parameters["norm_thresholds"] = [float(t) for t in norm_thresholds]
+        if zarr_options is not None:
+            parameters["zarr_options"] = zarr_options
+        if tiff_options is not None:
+            parameters["tiff_options"] = tiff_options
+        manifest = load_manifest(out_dir, parameters, resume)
+        manifests.append(manifest)
+
+        if stride_slices is None:
+            group_starts = range(0, num_files, slices_per_mip)
+        else:
+            # Sliding windows only cover full windows; trailing slices past the last one are not projected.
+            group_starts = range(0, num_files - slices_per_mip + 1, stride_slices)
+
+        groups = []
+        for start_slice in group_starts:
+            end_slice = min(start_slice + slices_per_mip, num_files)
+            mip_path = out_dir / _mip_name(tiff_files, start_slice, end_slice, underscores_to_plane_z)
+            if zarr_options is not None:
+                mip_path = mip_path.with_suffix(ZARR_SUFFIX)
+            _raise_if_windows_path_too_long(mip_path)
+            is_current = resume and output_is_current(manifest, mip_path, signatures[start_slice:end_slice])
+            n_skipped += is_current
+            groups.append((start_slice, end_slice, mip_path, is_current))
+        level_groups.append(groups)
+
+    if n_skipped:
+        print(f"Skipping {n_skipped} up-to-date MIPs")
+
+    if stride_slices is not None:
+        units = _plan_sliding_units(tiff_files, level_groups[0], slices_per_level[0], stride_slices)
+    else:
+        units = _plan_block_units(tiff_files, level_groups, slices_per_level)
+
+    return {
+        "input_dir": input_dir,
+        "output_dirs": output_dirs,
+        "manifests": manifests,
+        "units": units,
+        "finish_kwargs": dict(
+            do_normalization=do_normalization,
+            min_val=min_val,
+            max_val=max_val,
+            convert_to_8bit=convert_to_8bit,
+            tiff_options=tiff_options or tiff_write_options("lzw" if use_lzw_compression else "none"),
+            norm_thresholds=norm_thresholds,
+            zarr_options=zarr_options,
+        ),
+        "level_of_dir": {out_dir: level for level, out_dir in enumerate(output_dirs)},
+        "inputs_of_path": {
+            mip_path: signatures[start:end] for groups in level_groups for start, end, mip_path, _ in groups
+        },
+    }
+
+
+def _interleave_units(plans: list[dict]) -> list[tuple[dict, dict]]:
+    """Order `(plan, unit)` pairs round-robin across plans so reads alternate between input folders."""
+    iterators = [iter([(plan, unit) for unit in plan["units"]]) for plan in plans]
+    ordered = []
+    while iterators:
+        for iterator in list(iterators):
+            item = next(iterator, None)
+            if item is None:
+                iterators.remove(iterator)
+            else:
+                ordered.append(item)
+    return ordered
+
+
+def _run_mip_plans(plans: list[dict], num_workers: int, read_ahead: int) -> None:
+    """Process the units of one or more plans in a shared reader/worker schedule."""
+    scheduled = _interleave_units(plans)
+    failures: dict[str, BaseException] = {}
+    n_recorded = 0
+
+    def _completed(plan: dict, written: list[Path]) -> None:
+        nonlocal n_recorded
+        for mip_path in written:
+            level = plan["level_of_dir"][mip_path.parent]
+            record_output(plan["manifests"][level], mip_path, plan["inputs_of_path"][mip_path])
+            n_recorded += 1
+            # Periodic saves keep the manifest cheap to write while bounding rework after a crash.
+            if n_recorded % 20 == 0:
+                save_manifest(plan["output_dirs"][level], plan["manifests"][level])
+
+    def _failed(plan: dict, unit: dict, e: Exception) -> None:
+        if "window_blocks" in unit:
+            paths = unit["outputs"]
+        else:
+            paths = [path for level in unit["outputs"] for _, path in level]
+        names = ", ".join(path.name for path in paths if path is not None)
+        label = f"{plan['input_dir'].name}: {names}"
+        failures[label] = e
+        print(f"Failed to create {label}: {e}")
+
+    try:
+        if num_workers == 1:
+            pending_slices = [p for _, unit in scheduled for p in unit["slices"]]
+            slice_futures = prefetch(_read_slice, pending_slices, read_ahead)
+            for plan, unit in scheduled:
+                unit_futures = islice(slice_futures, len(unit["slices"]))
+                try:
+                    _completed(plan, _project_unit(unit_futures, unit, **plan["finish_kwargs"]))
+                except Exception as e:
+                    _failed(plan, unit, e)
+                    # Drain the rest of this unit so the next unit starts at its own first slice.
+                    for _ in unit_futures:
+                        pass
+        else:
+            print(f"Creating MIPs for {len(scheduled)} slice groups with {num_workers} worker processes")
+            with ProcessPoolExecutor(max_workers=num_workers, initializer=_init_mip_worker) as pool:
+                futures = {
+                    pool.submit(_write_mip_unit, unit, read_ahead, **plan["finish_kwargs"]): (plan, unit)
+                    for plan, unit in scheduled
+                }
+                for future in as_completed(futures):
+                    plan, unit = futures[future]
+                    try:
+                        _completed(plan, future.result())
+                    except Exception as e:
+                        _failed(plan, unit, e)
+    finally:
+        for plan in plans:
+            for out_dir, manifest in zip(plan["output_dirs"], plan["manifests"]):
+                save_manifest(out_dir, manifest)
+
+    if failures:
+        lines = [f"{label}: {failures[label]}" for label in sorted(failures)]
+        raise RuntimeError(
+            f"{len(failures)} of {len(scheduled)} MIP slice group(s) failed:\n" + "\n".join(lines)
+        )
+
 
-    for start_slice in range(0, num_files, slices_per_mip):
-        end_slice = min(start_slice + slices_per_mip, num_files)
-        slices = []
+def create_mips_from_folder(
+    input_dir: Path,
+    output_dir: Path | Sequence[Path],
+    z_step_size: float,
+    mip_thickness: float | Sequence[float],
+    underscores_to_plane_z: int,
+    do_normalization: bool = False,
+    min_val: float = 0,
+    max_val: float = 99.5,
+    convert_to_8bit: bool = False,
+    use_lzw_compression: bool = True,
+    num_workers: int = 1,
+    read_ahead: int = 0,
+    resume: bool = False,
+    mip_stride: float | None = None,
+    norm_thresholds: Sequence[float] | None = None,
+    zarr_options: dict | None = None,
+    tiff_options: dict | None = None,
+) -> None:
+    """
+    Create max-intensity projections from sequential TIFF slices in a folder.
+
+    Each projection is built by streaming its slices into one preallocated
+    output buffer (see `_fold_max`), so memory use does not grow with
+    `mip_thickness`.
+
+    `mip_thickness` may be a list of thicknesses with a matching list of
+    `output_dir`s. All thicknesses are then produced in one read pass: slices
+    are projected at the finest thickness and coarser MIPs are built from the
+    finer ones. Every thickness must be a whole multiple of the finest one
+    (in slices), e.g. 20, 40 and 80 um.
 
-        for i in range(start_slice, end_slice):
-            img = cv2.imread(str(tiff_files[i]), cv2.IMREAD_UNCHANGED)
-            slices.append(img)
+    With `mip_stride`, overlapping (sliding-window) MIPs of a single thickness
+    are created every `mip_stride` um, e.g. 20 um thick every 5 um. The
+    thickness must be a whole multiple of the stride. Windows are computed
+    with a running maximum (see `_project_sliding_unit`), so the cost per
+    output does not grow with thickness. Only full windows are written.
 
-        mip_img = np.max(np.stack(slices, axis=0), axis=0)
-        if do_normalization:
-            mip_img = normalize_array(
-                mip_img,
+    With `norm_thresholds` (lower, upper intensity), normalization clips and
+    scales every MIP with these fixed values instead of per-MIP percentiles,
+    e.g. sample-level thresholds from `stack_percentiles`.
+
+    With `zarr_options` (keyword arguments of `write_ome_zarr_bands`, e.g.
+    `{"compressor": "zstd", "pyramid_levels": 4}`), every MIP is written as an
+    OME-Zarr multiscale folder `MIP_<first>_<last>.zarr` instead of a TIFF, so
+    later steps can read single chunks (see `zarr_io.open_image`).
+
+    `tiff_options` (from `tiff_io.tiff_write_options`) sets the TIFF codec,
+    level, predictor, tiling and encoder threads; it replaces
+    `use_lzw_compression` when given.
+
+    The stack is split into units of consecutive slices that hold whole MIPs
+    of every thickness. With `num_workers > 1` units are processed in a
+    process pool; output names and contents do not depend on the worker
+    count. A failing unit does not stop the others: all failures are
+    reported together in one RuntimeError once every unit has finished.
+    Scripts calling this with `num_workers > 1` must guard their entry point
+    with `if __name__ == "__main__":` (required for process pools on Windows).
+
+    With `read_ahead > 0`, up to that many upcoming slices are fetched and
+    decoded on background threads while the current MIP is reduced and
+    written (see `prefetch`). In serial mode the read-ahead runs across unit
+    boundaries; with a process pool each worker prefetches within its unit.
+    Queued planes are capped at `read_ahead` per process.
+
+    Every run writes `manifest.json` (see `utils.manifest`) into each output
+    folder, recording the parameters, the input slices of each MIP (path,
+    size, mtime) and the completed outputs. With `resume=True` existing
+    output folders are reused and MIPs whose outputs and inputs are unchanged
+    are skipped; a change in parameters makes every MIP in that folder stale.
+    """
+    create_mips_from_folders(
+        [
+            dict(
+                input_dir=input_dir,
+                output_dir=output_dir,
+                z_step_size=z_step_size,
+                mip_thickness=mip_thickness,
+                underscores_to_plane_z=underscores_to_plane_z,
+                do_normalization=do_normalization,
                 min_val=min_val,
                 max_val=max_val,
                 convert_to_8bit=convert_to_8bit,
+                use_lzw_compression=use_lzw_compression,
+                mip_stride=mip_stride,
+                norm_thresholds=norm_thresholds,
+                zarr_options=zarr_options,
+                tiff_options=tiff_options,
             )
-        elif convert_to_8bit:
-            mip_img = convert_to_uint8(mip_img)
+        ],
+        num_workers=num_workers,
+        read_ahead=read_ahead,
+        resume=resume,
+    )
 
-        first_plane = get_underscore_token(
-            tiff_files[start_slice].stem,
-            underscores_to_plane_z,
-            "first plane z",
-        )
-        last_plane = get_underscore_token(
-            tiff_files[end_slice - 1].stem,
-            underscores_to_plane_z,
-            "last plane z",
-        )
 
-        mip_filename = f"MIP_{first_plane}_{last_plane}.tif"
-        mip_path = output_dir / mip_filename
-        _raise_if_windows_path_too_long(mip_path)
-        tifffile.imwrite(
-            mip_path,
-            mip_img,
-            compression="lzw" if use_lzw_compression else None,
-        )
+def create_mips_from_folders(
+    jobs: Sequence[dict],
+    num_workers: int = 1,
+    read_ahead: int = 0,
+    resume: bool = False,
+) -> None:
+    """
+    Create MIPs for several input folders (e.g. channels of one sample) in one shared schedule.
+
+    Each job is a dictionary of `create_mips_from_folder` arguments
+    (`input_dir`, `output_dir`, `z_step_size`, `mip_thickness`,
+    `underscores_to_plane_z` and optional normalization/compression/stride/threshold/Zarr
+    settings), so every folder can have its own normalization parameters.
+    Units from all jobs are interleaved round-robin and share one read-ahead
+    stream (serial) or one process pool (`num_workers > 1`), which keeps
+    reads alternating between folders instead of draining one at a time.
+    Failures from all jobs are reported together at the end.
+    """
+    if num_workers < 1:
+        raise ValueError("num_workers must be >= 1.")
+    if read_ahead < 0:
+        raise ValueError("read_ahead must be >= 0.")
+
+    plans = [_plan_mips(**job, resume=resume) for job in jobs]
+    _run_mip_plans(plans, num_workers=num_workers, read_ahead=read_ahead)
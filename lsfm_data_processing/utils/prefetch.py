@@ -0,0 +1,125 @@
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+def _completed_future(func: Callable[[T], R], item: T) -> Future:
+    future: Future = Future()
+    try:
+        future.set_result(func(item))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+
+def prefetch(
+    func: Callable[[T], R],
+    items: Iterable[T],
+    read_ahead: int,
+    max_workers: int | None = None,
+) -> Iterator[Future]:
+    """
+    Yield futures of `func(item)` in input order, computing ahead on background threads.
+
+    At most `read_ahead` results are queued ahead of the consumer, which caps the
+    memory held by decoded-but-unused items (e.g. image planes) at `read_ahead`
+    items plus the one currently being consumed. Futures are yielded rather than
+    results so a failing item can be handled by the caller without ending the
+    stream; call `.result()` to get the value or re-raise the error.
+
+    Parameters
+    ----------
+    func : Callable
+        Loader applied to each item, typically an I/O-bound decode such as
+        `cv2.imread` that releases the GIL.
+    items : Iterable
+        Items to load, in the order they should be consumed.
+    read_ahead : int
+        Number of items to load ahead of the consumer. 0 loads each item
+        synchronously when it is requested.
+    max_workers : int | None, optional
+        Number of loader threads. Defaults to `read_ahead`.
+
+    Yields
+    ------
+    Future
+        Completed or pending future for each item, in input order.
+    """
+    if read_ahead <= 0:
+        for item in items:
+            yield _completed_future(func, item)
+        return
+
+    iterator = iter(items)
+    pending: deque[Future] = deque()
+    with ThreadPoolExecutor(max_workers=max_workers or read_ahead) as pool:
+        try:
+            for item in iterator:
+                pending.append(pool.submit(func, item))
+                if len(pending) > read_ahead:
+                    yield pending.popleft()
+            while pending:
+                yield pending.popleft()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+class WriteBehind:
+    """
+    Run writes on background threads while the caller produces the next item.
+
+    A submitted write holds its data until it finishes, so `submit` blocks
+    while the writes already queued hold more than `max_pending_bytes`; this
+    caps the memory held by queued-but-unwritten items (e.g. image chunks).
+    With `max_workers` <= 1 every write runs synchronously inside `submit`.
+    Use as a context manager: leaving the block waits for all queued writes
+    and re-raises the first error. A failing write is also re-raised by a
+    later `submit`, so the producer stops early.
+    """
+
+    def __init__(self, max_workers: int = 1, max_pending_bytes: int = 256 * 2**20):
+        if max_workers < 1:
+            raise ValueError("max_workers must be >= 1.")
+        self.max_pending_bytes = max_pending_bytes
+        self._pool = ThreadPoolExecutor(max_workers=max_workers) if max_workers > 1 else None
+        self._pending: deque[tuple[Future, int]] = deque()
+        self._pending_bytes = 0
+
+    def submit(self, func: Callable[..., object], *args, nbytes: int = 0, **kwargs) -> None:
+        """Queue `func(*args, **kwargs)`; `nbytes` is the memory the call holds until it has run."""
+        if self._pool is None:
+            func(*args, **kwargs)
+            return
+
+        # Writes finish roughly in submission order, so checking the oldest one is enough
+        while self._pending and (
+            self._pending[0][0].done() or self._pending_bytes + nbytes > self.max_pending_bytes
+        ):
+            self._wait_oldest()
+        self._pending.append((self._pool.submit(func, *args, **kwargs), nbytes))
+        self._pending_bytes += nbytes
+
+    def _wait_oldest(self) -> None:
+        future, nbytes = self._pending.popleft()
+        self._pending_bytes -= nbytes
+        future.result()
+
+    def __enter__(self) -> "WriteBehind":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if self._pool is None:
+            return
+        try:
+            if exc_type is None:
+                while self._pending:
+                    self._wait_oldest()
+        finally:
+            for future, _ in self._pending:
+                future.cancel()
+            self._pool.shutdown(wait=True)
@@ -1,7 +1,8 @@
 from __future__ import annotations
 
-from collections.abc import Sequence
+from collections.abc import Iterable, Sequence
 import hashlib
+import heapq
 import math
 import random
 from typing import TypeVar
@@ -78,37 +79,287 @@ def select_evenly_spaced_items(items: Sequence[T], n_select: int) -> list[T]:
 
 def greedy_region_coverage_select(
     candidate_ids: Sequence[int],
-    regions_by_id: dict[int, set[int]],
+    regions_by_id: dict[int, set[int]] | RegionIncidence,
     limit: int,
     selected: set[int] | None = None,
     covered_regions: set[int] | None = None,
     secondary_score_by_id: dict[int, tuple[int, ...]] | None = None,
 ) -> tuple[set[int], set[int]]:
+    """
+    Greedily add candidates covering the most not-yet-covered regions until `selected` has `limit` ids.
+
+    Each pick maximizes `(new region count,) + secondary_score_by_id[cid]`;
+    ties go to the candidate listed first in `candidate_ids`. Picks are made
+    lazily (CELF): a candidate's new region count only shrinks as regions get
+    covered, so candidates wait in a priority queue under their last score
+    and only the top one is rescored, which gives the same picks as
+    rescoring every candidate for every pick.
+
+    `regions_by_id` can also be a `RegionIncidence` whose rows are the
+    candidate ids; the new region counts of all candidates are then kept in
+    one array and updated per newly covered region, with the same picks.
+    """
     if selected is None:
         selected = set()
     if covered_regions is None:
         covered_regions = set()
     if secondary_score_by_id is None:
         secondary_score_by_id = {}
+    if isinstance(regions_by_id, RegionIncidence):
+        return _greedy_incidence_select(
+            candidate_ids, regions_by_id, limit, selected, covered_regions, secondary_score_by_id
+        )
 
-    while len(selected) < limit:
-        best_id = None
-        best_score = None
+    heap = []
+    queued = set()
+    for position, cid in enumerate(candidate_ids):
+        if cid in selected or cid in queued:
+            continue
+        queued.add(cid)
+        new_count = len(regions_by_id.get(cid, set()) - covered_regions)
+        # Entries are (heap key, position, cid, picks when scored); the position breaks ties
+        heap.append((_heap_key((new_count,) + secondary_score_by_id.get(cid, ())), position, cid, 0))
+    heapq.heapify(heap)
 
-        for cid in candidate_ids:
-            if cid in selected:
+    # Scores computed after the latest pick are current; older ones are upper bounds
+    n_picks = 0
+    while len(selected) < limit and heap:
+        key, position, cid, scored_at = heap[0]
+        if scored_at != n_picks:
+            new_count = len(regions_by_id.get(cid, set()) - covered_regions)
+            if -new_count != key[0]:
+                heapq.heapreplace(heap, ((-new_count,) + key[1:], position, cid, n_picks))
                 continue
-            new_regions = regions_by_id.get(cid, set()) - covered_regions
-            score = (len(new_regions),) + secondary_score_by_id.get(cid, ())
-            if best_score is None or score > best_score:
-                best_score = score
-                best_id = cid
+            # Unchanged score: still ahead of every other upper bound
+
+        heapq.heappop(heap)
+        selected.add(cid)
+        covered_regions.update(regions_by_id.get(cid, set()))
+        n_picks += 1
+
+    return selected, covered_regions
+
+
+def _heap_key(score: tuple[int, ...]) -> tuple[float, ...]:
+    # Min-heap key for a descending score: negated, with a sentinel so a longer score
+    # that extends a shorter one still ranks first (as in tuple comparison).
+    return tuple(-value for value in score) + (math.inf,)
+
+
+class RegionIncidence:
+    """
+    Compact candidate-by-region incidence matrix for coverage selection.
+
+    Row `i` holds the regions of candidate `i` in CSR form (`indptr`,
+    `indices`) over a relabeled region index: `indices` point into
+    `region_ids`, the sorted original region labels. This replaces one
+    Python set per candidate (about 200 bytes per region) by 4 bytes per
+    candidate-region pair, and lets new region counts of all candidates be
+    computed with NumPy.
+
+    Parameters
+    ----------
+    region_lists : Iterable
+        Region labels of each candidate, in candidate id order (arrays such as
+        `np.unique` output, sets or lists). Repeated labels count once.
+    """
+
+    def __init__(self, region_lists: Iterable[Iterable[int]]):
+        labels = [
+            regions.reshape(-1) if isinstance(regions, np.ndarray) else np.fromiter(regions, dtype=np.int64)
+            for regions in region_lists
+        ]
+        rows = np.repeat(np.arange(len(labels), dtype=np.int64), [len(regions) for regions in labels])
+        all_labels = np.concatenate(labels).astype(np.int64) if labels else np.zeros(0, dtype=np.int64)
+        self.region_ids, indices = np.unique(all_labels, return_inverse=True)
+
+        # One sort of (row, region) pairs orders every row and drops repeated labels
+        pairs = np.sort(rows * max(len(self.region_ids), 1) + indices.reshape(-1))
+        keep = np.ones(len(pairs), dtype=bool)
+        keep[1:] = pairs[1:] != pairs[:-1]
+        rows, indices = np.divmod(pairs[keep], max(len(self.region_ids), 1))
+        self.indptr = np.concatenate([[0], np.cumsum(np.bincount(rows, minlength=len(labels)))])
+        self.indices = indices.astype(np.int32)
+        self._by_region = None
 
-        if best_id is None:
-            break
+    def __len__(self) -> int:
+        return len(self.indptr) - 1
+
+    @property
+    def n_regions(self) -> int:
+        return len(self.region_ids)
+
+    def region_counts(self) -> np.ndarray:
+        """Return the number of regions of every candidate."""
+        return np.diff(self.indptr)
+
+    def regions(self, candidate_id: int) -> np.ndarray:
+        """Return the region indices (into `region_ids`) of one candidate."""
+        return self.indices[self.indptr[candidate_id] : self.indptr[candidate_id + 1]]
+
+    def covered_mask(self, covered_regions: Iterable[int]) -> np.ndarray:
+        """Return a boolean mask over the region index of the given region labels."""
+        labels = np.fromiter(covered_regions, dtype=np.int64)
+        return np.isin(self.region_ids, labels)
+
+    def gains(self, covered: np.ndarray) -> np.ndarray:
+        """Return the number of regions not in the `covered` mask for every candidate."""
+        rows = np.repeat(np.arange(len(self)), self.region_counts())
+        covered_counts = np.bincount(rows, weights=covered[self.indices], minlength=len(self))
+        return self.region_counts() - covered_counts.astype(np.int64)
+
+    def candidates_with(self, region: int) -> np.ndarray:
+        """Return the candidates containing a region index (the transposed matrix is built on first use)."""
+        if self._by_region is None:
+            order = np.argsort(self.indices, kind="stable")
+            rows = np.repeat(np.arange(len(self), dtype=np.int32), self.region_counts())[order]
+            by_region_ptr = np.concatenate([[0], np.cumsum(np.bincount(self.indices, minlength=self.n_regions))])
+            self._by_region = (by_region_ptr, rows)
+        by_region_ptr, rows = self._by_region
+        return rows[by_region_ptr[region] : by_region_ptr[region + 1]]
+
+
+def stochastic_greedy_region_coverage_select(
+    candidate_ids: Sequence[int],
+    regions_by_id: dict[int, set[int]] | RegionIncidence,
+    limit: int,
+    rng: random.Random,
+    epsilon: float = 0.1,
+    selected: set[int] | None = None,
+    covered_regions: set[int] | None = None,
+    secondary_score_by_id: dict[int, tuple[int, ...]] | None = None,
+) -> tuple[set[int], set[int]]:
+    """
+    Stochastic-greedy variant of `greedy_region_coverage_select` for very large candidate pools.
+
+    Each pick scores only a random sample of `ceil(n / k * ln(1 / epsilon))`
+    of the not yet selected candidates (`n` candidates, `k` picks) and takes
+    the best of them, with the same score and tie-breaking as the exact
+    greedy. The expected coverage is within a factor `1 - 1/e - epsilon` of
+    the optimum, and the cost of all picks is about `n * ln(1 / epsilon)`
+    candidate scores instead of `n * k`. Picks depend only on the inputs and
+    the state of `rng`, so a seeded `random.Random` reproduces them.
+    """
+    if not 0 < epsilon < 1:
+        raise ValueError("epsilon must be between 0 and 1.")
+    if selected is None:
+        selected = set()
+    if covered_regions is None:
+        covered_regions = set()
+    if secondary_score_by_id is None:
+        secondary_score_by_id = {}
+
+    ids = _open_candidates(candidate_ids, selected)
+    n_picks = min(len(ids), limit - len(selected))
+    if n_picks <= 0:
+        return selected, covered_regions
+    sample_size = max(1, math.ceil(len(ids) / n_picks * math.log(1 / epsilon)))
+
+    keys = None
+    if isinstance(regions_by_id, RegionIncidence):
+        keys = _CoverageKeys(ids, regions_by_id, covered_regions, secondary_score_by_id)
+    # Samples are drawn by NumPy (much faster for large samples), seeded from rng
+    sampler = np.random.default_rng(rng.getrandbits(64))
+
+    # Positions (into ids) of the open candidates; a pick is swapped out with the last open one
+    pool = np.arange(len(ids))
+    n_open = len(ids)
+    for _ in range(n_picks):
+        if sample_size >= n_open:
+            sample = np.arange(n_open)
+        else:
+            sample = sampler.choice(n_open, sample_size, replace=False)
+        positions = pool[sample]
+        if keys is not None:
+            best = int(np.argmax(keys.keys[positions]))
+        else:
+            scores = [
+                (len(regions_by_id.get(int(ids[k]), set()) - covered_regions),)
+                + secondary_score_by_id.get(int(ids[k]), ())
+                + (-int(k),)
+                for k in positions
+            ]
+            best = max(range(len(scores)), key=scores.__getitem__)
+
+        k = int(positions[best])
+        n_open -= 1
+        pool[sample[best]] = pool[n_open]
+        if keys is not None:
+            keys.pick(k, selected, covered_regions)
+        else:
+            cid = int(ids[k])
+            selected.add(cid)
+            covered_regions.update(regions_by_id.get(cid, set()))
+
+    return selected, covered_regions
+
+
+def _open_candidates(candidate_ids: Sequence[int], selected: set[int]) -> np.ndarray:
+    # Candidate ids without repeats (first occurrence kept) and without already selected ones
+    ids = np.asarray(candidate_ids, dtype=np.int64).reshape(-1)
+    _, first = np.unique(ids, return_index=True)
+    ids = ids[np.sort(first)]
+    if selected:
+        ids = ids[~np.isin(ids, np.fromiter(selected, dtype=np.int64))]
+    return ids
+
+
+class _CoverageKeys:
+    # One int64 key per open candidate of a RegionIncidence: new region count * m + tie rank
+    # (higher secondary score first, then earlier position). Newly covered regions lower the
+    # keys of the candidates containing them by m; picked candidates get key -1.
+
+    def __init__(
+        self,
+        ids: np.ndarray,
+        incidence: RegionIncidence,
+        covered_regions: set[int],
+        secondary_score_by_id: dict[int, tuple[int, ...]],
+    ):
+        m = len(ids)
+        # The sort is stable, so equal secondary scores keep their candidate order
+        order = sorted(range(m), key=lambda k: secondary_score_by_id.get(int(ids[k]), ()), reverse=True)
+        tie_rank = np.empty(m, dtype=np.int64)
+        tie_rank[np.array(order, dtype=np.int64)] = np.arange(m - 1, -1, -1)
+
+        self.ids = ids
+        self.incidence = incidence
+        self.covered = incidence.covered_mask(covered_regions)
+        self.keys = incidence.gains(self.covered)[ids] * m + tie_rank
+        self.local = np.full(len(incidence), -1, dtype=np.int64)
+        self.local[ids] = np.arange(m)
+
+    def pick(self, k: int, selected: set[int], covered_regions: set[int]) -> None:
+        cid = int(self.ids[k])
+        selected.add(cid)
+        self.keys[k] = -1
+
+        regions = self.incidence.regions(cid)
+        new_regions = regions[~self.covered[regions]]
+        self.covered[new_regions] = True
+        covered_regions.update(self.incidence.region_ids[new_regions].tolist())
+        for region in new_regions:
+            affected = self.local[self.incidence.candidates_with(region)]
+            affected = affected[(affected >= 0) & (self.keys[np.maximum(affected, 0)] >= 0)]
+            self.keys[affected] -= len(self.ids)
+
+
+def _greedy_incidence_select(
+    candidate_ids: Sequence[int],
+    incidence: RegionIncidence,
+    limit: int,
+    selected: set[int],
+    covered_regions: set[int],
+    secondary_score_by_id: dict[int, tuple[int, ...]],
+) -> tuple[set[int], set[int]]:
+    # greedy_region_coverage_select on a RegionIncidence: each pick is the argmax of the keys
+    ids = _open_candidates(candidate_ids, selected)
+    if len(ids) == 0 or len(selected) >= limit:
+        return selected, covered_regions
 
-        selected.add(best_id)
-        covered_regions.update(regions_by_id.get(best_id, set()))
+    keys = _CoverageKeys(ids, incidence, covered_regions, secondary_score_by_id)
+    for _ in range(min(len(ids), limit - len(selected))):
+        keys.pick(int(np.argmax(keys.keys)), selected, covered_regions)
 
     return selected, covered_regions
 
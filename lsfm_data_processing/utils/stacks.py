@@ -1,17 +1,17 @@
 import numpy as np
-import tifffile
-from PIL import Image
 
+from .tiff_io import write_tiff
+from .zarr_io import open_image
 
-def tifs_to_zstack(file_list, out_dir, out_prefix):
+
+def tifs_to_zstack(file_list, out_dir, out_prefix, tiff_options=None):
     images = []
     names = []
     for file in file_list:
-        img = Image.open(file)
-        images.append(np.array(img))
+        images.append(np.asarray(open_image(file)[...]))
         names.append(file.stem)
 
     zstack_array = np.stack(images)
     output_filename = out_dir / f"{out_prefix}_zstack_{names[0]}_to_{names[-1]}.tif"
 
-    tifffile.imwrite(output_filename, zstack_array, photometric="minisblack")
\ No newline at end of file
+    write_tiff(output_filename, zstack_array, tiff_options, photometric="minisblack")
\ No newline at end of file
@@ -0,0 +1,310 @@
+import math
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+
+import numpy as np
+import tifffile
+
+TIFF_COMPRESSIONS = ("zstd", "deflate", "lzw", "none")
+PACKED_SUFFIX = "_chunks.tif"
+
+
+def tiff_nbytes(path: Path) -> int:
+    """Return the decoded size in bytes of all pages of a TIFF, read from its header only."""
+    with tifffile.TiffFile(path) as tif:
+        return sum(page.nbytes for page in tif.pages)
+
+
+def tiff_write_options(
+    compression: str = "none",
+    compression_level: int | None = None,
+    predictor: bool = False,
+    tile: int = 0,
+    workers: int = 1,
+) -> dict:
+    """
+    Return `tifffile.imwrite` keyword arguments for one compression setting.
+
+    Parameters
+    ----------
+    compression : str, optional
+        One of `TIFF_COMPRESSIONS`. "deflate" is written as Adobe Deflate (zlib),
+        the variant most TIFF readers support.
+    compression_level : int | None, optional
+        Codec level (zstd: 1-22, deflate: 1-9); None uses the codec default.
+        Ignored for "lzw" and "none".
+    predictor : bool, optional
+        Apply the horizontal differencing predictor (floating point predictor
+        for float data) before compression. Ignored without compression.
+    tile : int, optional
+        Write square tiles of this edge length (a multiple of 16) instead of
+        strips; 0 writes strips.
+    workers : int, optional
+        Threads encoding strips/tiles in parallel.
+
+    Returns
+    -------
+    dict
+        Keyword arguments for `tifffile.imwrite` (see `write_tiff`).
+    """
+    if compression not in TIFF_COMPRESSIONS:
+        raise ValueError(f"Unknown TIFF compression '{compression}'. Use one of: {', '.join(TIFF_COMPRESSIONS)}")
+    if tile and tile % 16:
+        raise ValueError(f"TIFF tile size must be a multiple of 16, got {tile}")
+
+    options = {"compression": None, "maxworkers": max(1, workers)}
+    if compression != "none":
+        options["compression"] = "zlib" if compression == "deflate" else compression
+        if compression_level is not None and compression != "lzw":
+            options["compressionargs"] = {"level": compression_level}
+        if predictor:
+            options["predictor"] = True
+    if tile:
+        options["tile"] = (tile, tile)
+    return options
+
+
+def tiff_options_from_config(cfg: dict, default_compression: str = "none") -> dict:
+    """
+    Build `tiff_write_options` from the shared `tiff_*` keys of a script config.
+
+    Missing keys fall back to the defaults of `tiff_write_options`, and a
+    missing `tiff_compression` to `default_compression`.
+    """
+    return tiff_write_options(
+        compression=cfg.get("tiff_compression", default_compression),
+        compression_level=cfg.get("tiff_compression_level"),
+        predictor=cfg.get("tiff_predictor", False),
+        tile=cfg.get("tiff_tile", 0),
+        workers=cfg.get("tiff_workers", 1),
+    )
+
+
+def write_tiff(path, image: np.ndarray, tiff_options: dict | None = None, **kwargs) -> None:
+    """
+    Write a TIFF with the shared compression settings from `tiff_write_options`.
+
+    Extra keyword arguments (e.g. `photometric`) are passed to
+    `tifffile.imwrite` and take precedence over `tiff_options`.
+    """
+    tifffile.imwrite(path, image, **{**(tiff_options or {}), **kwargs})
+
+
+def open_packed_chunks(path) -> tifffile.TiffWriter:
+    """
+    Open a packed chunk container for writing; add chunks with `write_packed_chunk`.
+
+    A container is a BigTIFF (so it can exceed 4 GB) holding one TIFF series
+    per chunk, instead of one small file per chunk.
+    """
+    return tifffile.TiffWriter(path, bigtiff=True)
+
+
+def write_packed_chunk(
+    writer: tifffile.TiffWriter,
+    chunk: np.ndarray,
+    y: int,
+    x: int,
+    tiff_options: dict | None = None,
+    **kwargs,
+) -> None:
+    """
+    Append a chunk to a packed container as its own series, with its y/x offset in the series metadata.
+
+    Extra keyword arguments are passed to `tifffile.TiffWriter.write`, as in `write_tiff`.
+    """
+    writer.write(chunk, metadata={"y": int(y), "x": int(x)}, **{**(tiff_options or {}), **kwargs})
+
+
+def pack_chunks(
+    path,
+    chunks: Iterable[tuple[int, int, np.ndarray]],
+    tiff_options: dict | None = None,
+    **kwargs,
+) -> int:
+    """Write `(y, x, chunk)` items into one packed container and return how many were written."""
+    count = 0
+    with open_packed_chunks(path) as writer:
+        for y, x, chunk in chunks:
+            write_packed_chunk(writer, chunk, y, x, tiff_options, **kwargs)
+            count += 1
+    return count
+
+
+def iter_packed_chunks(path, indices: Iterable[int] | None = None) -> Iterator[tuple[int, int, int, np.ndarray]]:
+    """
+    Yield `(index, y, x, chunk)` from a packed chunk container, decoding one chunk at a time.
+
+    `index` is the position of the chunk in the container (the order it was
+    written in). With `indices`, only those chunks are decoded, in that order.
+    """
+    with tifffile.TiffFile(path) as tif:
+        series = tif.series
+        metadata = tif.shaped_metadata or ()
+        if len(metadata) != len(series):
+            raise ValueError(f"Not a packed chunk container:\n{path}")
+        for index in range(len(series)) if indices is None else indices:
+            yield index, metadata[index]["y"], metadata[index]["x"], series[index].asarray()
+
+
+def require_2d_pages(tif: tifffile.TiffFile, path: Path, allow_samples: bool = False) -> list[tifffile.TiffPage]:
+    """
+    Return the pages of a TIFF, checking they are 2D planes of one shape and dtype.
+
+    Pages must be single-channel unless `allow_samples`, which also accepts
+    interleaved samples such as RGB (y, x, 3).
+    """
+    pages = list(tif.pages)
+    for page in pages:
+        interleaved = allow_samples and page.planarconfig == tifffile.PLANARCONFIG.CONTIG
+        if (page.samplesperpixel != 1 and not interleaved) or page.imagedepth != 1:
+            raise ValueError(f"Band reading supports 2D pages with single-channel or interleaved samples only:\n{path}")
+        if page.dtype != pages[0].dtype or page.shape != pages[0].shape:
+            raise ValueError(f"All pages must share one shape and dtype:\n{path}")
+    return pages
+
+
+def _segment_rows(page: tifffile.TiffPage) -> int:
+    """Rows covered by one strip or one row of tiles."""
+    return page.tilelength if page.is_tiled else page.rowsperstrip
+
+
+def band_rows_for_budget(
+    page: tifffile.TiffPage,
+    budget_bytes: int,
+    bytes_per_pixel: float,
+    row_multiple: int = 1,
+) -> int:
+    """
+    Return how many rows of `page` to process at once within `budget_bytes`.
+
+    The band height is a multiple of `row_multiple` (e.g. the output tile
+    height) and at least one strip/tile high, even if that exceeds the budget.
+    """
+    row_bytes = page.imagewidth * bytes_per_pixel
+    budget_rows = int(budget_bytes // row_bytes) // row_multiple * row_multiple
+    min_rows = math.ceil(min(_segment_rows(page), page.imagelength) / row_multiple) * row_multiple
+    return min(max(budget_rows, min_rows), math.ceil(page.imagelength / row_multiple) * row_multiple)
+
+
+def iter_tiff_bands(
+    page: tifffile.TiffPage,
+    band_rows: int,
+    buffersize: int | None = None,
+) -> Iterator[tuple[int, np.ndarray]]:
+    """
+    Yield `(first_row, band)` horizontal bands of a 2D TIFF page (`(rows, x)`, or
+    `(rows, x, samples)` for interleaved RGB pages).
+
+    Strips or tiles are decoded one at a time and copied into a band buffer,
+    so only one band (plus the rows of one strip/tile row that spill into the
+    next band) is held in memory, never the whole frame. `band_rows` must be
+    at least one strip/tile high (see `band_rows_for_budget`). `buffersize`
+    caps the encoded bytes read from file in one go.
+    """
+    height, width = page.imagelength, page.imagewidth
+    samples = (page.samplesperpixel,) if page.samplesperpixel > 1 else ()
+    if band_rows < min(_segment_rows(page), height):
+        raise ValueError(f"Band height {band_rows} is smaller than the strip/tile height {_segment_rows(page)}.")
+
+    def _new_band(start: int) -> np.ndarray:
+        return np.zeros((min(band_rows, height - start), width, *samples), dtype=page.dtype)
+
+    def _place(band: np.ndarray, band_start: int, data: np.ndarray, row: int, col: int) -> np.ndarray | None:
+        """Copy the part of `data` inside the band; return the rows below the band, if any."""
+        inside = min(data.shape[0], band_start + band.shape[0] - row)
+        cols = min(data.shape[1], width - col)
+        band[row - band_start:row - band_start + inside, col:col + cols] = data[:inside, :cols]
+        below = data[inside:min(data.shape[0], height - row)]
+        return below.copy() if below.size else None
+
+    band_start = 0
+    band = _new_band(band_start)
+    spill: list[tuple[np.ndarray, int, int]] = []
+    for segment, (_, _, row, col, _), _ in page.segments(maxworkers=1, buffersize=buffersize):
+        while row >= band_start + band.shape[0]:
+            yield band_start, band
+            band_start += band.shape[0]
+            band = _new_band(band_start)
+            for data, data_row, data_col in spill:
+                _place(band, band_start, data, data_row, data_col)
+            spill = []
+        if segment is None:
+            continue
+        data = segment.reshape(segment.shape[1:3] + samples)
+        below = _place(band, band_start, data, row, col)
+        if below is not None:
+            spill.append((below, band_start + band.shape[0], col))
+
+    while True:
+        yield band_start, band
+        band_start += band.shape[0]
+        if band_start >= height:
+            break
+        band = _new_band(band_start)
+        for data, data_row, data_col in spill:
+            _place(band, band_start, data, data_row, data_col)
+        spill = []
+
+
+def iter_tiff_row_bands(
+    path: Path,
+    band_rows: int,
+    buffersize: int | None = None,
+) -> Iterator[tuple[int, np.ndarray]]:
+    """
+    Yield `(first_row, band)` horizontal bands of `band_rows` rows of a 2D image or z-stack TIFF.
+
+    Bands keep the axes of the file, sliced along y: `(rows, x)` for 2D
+    images, `(z, rows, x)` for stacks and `(rows, x, 3)` for RGB; the last
+    band may be shorter. Uncompressed contiguous files are memory-mapped, so
+    a band is a view and only the pixels that are sliced from it are read.
+    Otherwise every page is decoded strip by strip (or tile row by tile row)
+    in lockstep, holding one band per page; bands are read at least one
+    strip/tile high and split into `band_rows` blocks. Each strip or tile is
+    decoded once. Layouts neither path supports (e.g. planar RGB) are
+    decoded whole. `buffersize` caps the encoded bytes read from file in one
+    go (default: about one band).
+    """
+    with tifffile.TiffFile(path) as tif:
+        series = tif.series[0]
+        y_axis = series.axes.index("Y")
+        if series.dataoffset is not None:
+            yield from _split_rows(tifffile.memmap(path, mode="r"), y_axis, band_rows)
+            return
+
+        try:
+            pages = require_2d_pages(tif, path, allow_samples=True)
+        except ValueError:
+            pages = []
+        if len(pages) != math.prod(series.shape[:y_axis]):
+            yield from _split_rows(series.asarray(), y_axis, band_rows)
+            return
+
+        read_rows = math.ceil(max(band_rows, _segment_rows(pages[0])) / band_rows) * band_rows
+        if buffersize is None:
+            # encoded bytes read per file access, about one decoded band
+            buffersize = read_rows * pages[0].nbytes // pages[0].imagelength
+        for bands in zip(*(iter_tiff_bands(page, read_rows, buffersize) for page in pages)):
+            first_row, band = bands[0]
+            if len(pages) > 1:
+                band = np.stack([b for _, b in bands]).reshape(*series.shape[:y_axis], *band.shape)
+            yield from _split_rows(band, y_axis, band_rows, first_row)
+
+
+def _split_rows(
+    data: np.ndarray,
+    y_axis: int,
+    band_rows: int,
+    first_row: int = 0,
+) -> Iterator[tuple[int, np.ndarray]]:
+    """Yield `(first_row + row, block)` slices of `band_rows` rows of `data` along `y_axis`."""
+    for row in range(0, data.shape[y_axis], band_rows):
+        yield first_row + row, data[(slice(None),) * y_axis + (slice(row, row + band_rows),)]
+
+
+def iter_tiles(band: np.ndarray, tile: tuple[int, int]) -> Iterator[np.ndarray]:
+    """Yield tiles of a band in row-major order; edge tiles are left short for tifffile to pad."""
+    for row in range(0, band.shape[0], tile[0]):
+        for col in range(0, band.shape[1], tile[1]):
+            yield band[row:row + tile[0], col:col + tile[1]]
@@ -0,0 +1,250 @@
+import os
+import shutil
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+import tifffile
+
+from .io_helpers import materialize_file
+from .tiff_io import iter_tiff_row_bands
+
+ZARR_SUFFIX = ".zarr"
+ZARR_COMPRESSORS = ("zstd", "blosc-zstd", "gzip", "none")
+
+
+def _import_zarr():
+    """Import the optional zarr package, with install instructions if it is missing."""
+    try:
+        import zarr
+    except ImportError as e:
+        raise RuntimeError(
+            "Zarr output/input needs the optional 'zarr' package (version 3 or newer).\n"
+            "Install it with: pip install zarr"
+        ) from e
+    return zarr
+
+
+def is_zarr_image(path: Path) -> bool:
+    """Return True if `path` is a Zarr image folder (by its `.zarr` suffix)."""
+    return Path(path).suffix.lower() == ZARR_SUFFIX
+
+
+def _compressors(zarr_format: int, compressor: str, compression_level: int):
+    zarr = _import_zarr()
+    if compressor not in ZARR_COMPRESSORS:
+        raise ValueError(f"Unknown Zarr compressor '{compressor}'. Use one of: {', '.join(ZARR_COMPRESSORS)}")
+    if compressor == "none":
+        return None
+    if zarr_format == 2:
+        import numcodecs
+
+        if compressor == "zstd":
+            return numcodecs.Zstd(level=compression_level)
+        if compressor == "blosc-zstd":
+            return numcodecs.Blosc(cname="zstd", clevel=compression_level, shuffle=numcodecs.Blosc.BITSHUFFLE)
+        return numcodecs.GZip(level=compression_level)
+    if compressor == "zstd":
+        return zarr.codecs.ZstdCodec(level=compression_level)
+    if compressor == "blosc-zstd":
+        return zarr.codecs.BloscCodec(cname="zstd", clevel=compression_level, shuffle="bitshuffle")
+    return zarr.codecs.GzipCodec(level=compression_level)
+
+
+def _downsample_mean_2x(band: np.ndarray) -> np.ndarray:
+    """Halve the last two axes by 2x2 mean (odd trailing rows/columns are dropped), keeping the dtype."""
+    h, w = band.shape[-2] // 2 * 2, band.shape[-1] // 2 * 2
+    b = band[..., :h, :w].astype(np.float32)
+    mean = (b[..., 0::2, 0::2] + b[..., 1::2, 0::2] + b[..., 0::2, 1::2] + b[..., 1::2, 1::2]) / 4
+    if np.issubdtype(band.dtype, np.integer):
+        mean = np.rint(mean)
+    return mean.astype(band.dtype)
+
+
+def _multiscales_metadata(ndim: int, n_levels: int, zarr_format: int) -> dict[str, Any]:
+    axes = [{"name": "z", "type": "space"}] if ndim == 3 else []
+    axes += [{"name": "y", "type": "space"}, {"name": "x", "type": "space"}]
+    datasets = [
+        {
+            "path": str(level),
+            "coordinateTransformations": [
+                {"type": "scale", "scale": [1.0] * (ndim - 2) + [float(2**level)] * 2}
+            ],
+        }
+        for level in range(n_levels)
+    ]
+    multiscale = {"axes": axes, "datasets": datasets, "name": "image"}
+    if zarr_format == 2:
+        # OME-NGFF 0.4 (Zarr v2)
+        return {"multiscales": [{"version": "0.4", **multiscale}]}
+    # OME-Zarr 0.5 (Zarr v3)
+    return {"ome": {"version": "0.5", "multiscales": [multiscale]}}
+
+
+def pyramid_row_multiple(chunk_size: int = 256, pyramid_levels: int = 4) -> int:
+    """Return the band height multiple that keeps bands aligned with chunks and pyramid levels."""
+    return np.lcm(chunk_size, 2 ** (pyramid_levels - 1)).item()
+
+
+def write_ome_zarr_bands(
+    path: Path,
+    shape: tuple[int, ...],
+    dtype,
+    bands: Iterable[tuple[tuple[int, ...], np.ndarray]],
+    chunk_size: int = 256,
+    pyramid_levels: int = 4,
+    compressor: str = "zstd",
+    compression_level: int = 3,
+    zarr_format: int = 2,
+) -> Path:
+    """
+    Write a 2D image or z-stack as an OME-Zarr multiscale pyramid from horizontal bands.
+
+    `bands` yields `(start, band)` where `start` is `(row,)` for 2D images or
+    `(z, row)` for stacks and `band` is a 2D block of full image width. Each
+    band is written to level 0 and downsampled (2x2 mean) into the coarser
+    levels, so the full image is never needed in memory. Band rows must start
+    at multiples of `pyramid_row_multiple(chunk_size, pyramid_levels)`.
+
+    The folder is written under a temporary name and moved into place once
+    complete, replacing any existing output.
+
+    Parameters
+    ----------
+    path : Path
+        Output folder, normally ending in `.zarr`.
+    shape : tuple[int, ...]
+        (y, x) or (z, y, x) shape of the full-resolution image.
+    dtype : numpy dtype
+        Pixel dtype.
+    bands : Iterable[tuple[tuple[int, ...], np.ndarray]]
+        Image bands, see above.
+    chunk_size : int, optional
+        Chunk edge length in y and x (stacks are chunked one plane deep).
+    pyramid_levels : int, optional
+        Number of resolution levels including full resolution. Levels that
+        would be smaller than one pixel are not written.
+    compressor : str, optional
+        One of `ZARR_COMPRESSORS`.
+    compression_level : int, optional
+        Compression level passed to the codec.
+    zarr_format : int, optional
+        2 (OME-NGFF 0.4) or 3 (OME-Zarr 0.5).
+
+    Returns
+    -------
+    Path
+        The written `path`.
+    """
+    zarr = _import_zarr()
+    if zarr_format not in (2, 3):
+        raise ValueError(f"zarr_format must be 2 or 3, got {zarr_format}")
+    if len(shape) not in (2, 3):
+        raise ValueError(f"OME-Zarr output supports (y, x) or (z, y, x) images, got shape {shape}")
+
+    n_levels = max(1, min(pyramid_levels, int(np.log2(max(1, min(shape[-2:])))) + 1))
+    row_multiple = pyramid_row_multiple(chunk_size, n_levels)
+    compressors = _compressors(zarr_format, compressor, compression_level)
+
+    tmp_path = path.with_suffix(".part")
+    if tmp_path.exists():
+        shutil.rmtree(tmp_path)
+    group = zarr.open_group(tmp_path, mode="w", zarr_format=zarr_format)
+
+    levels = []
+    for level in range(n_levels):
+        level_shape = (*shape[:-2], shape[-2] >> level, shape[-1] >> level)
+        chunks = (1,) * (len(shape) - 2) + (chunk_size, chunk_size)
+        levels.append(
+            group.create_array(
+                str(level),
+                shape=level_shape,
+                chunks=chunks,
+                dtype=dtype,
+                compressors=compressors,
+                fill_value=0,
+            )
+        )
+
+    for start, band in bands:
+        *plane, row = start
+        if row % row_multiple:
+            raise ValueError(f"Band row {row} is not a multiple of {row_multiple}")
+        for level, array in enumerate(levels):
+            if level:
+                band = _downsample_mean_2x(band)
+            level_row = row >> level
+            array[(*plane, slice(level_row, level_row + band.shape[0]), slice(None))] = band
+
+    group.attrs.update(_multiscales_metadata(len(shape), n_levels, zarr_format))
+
+    if path.exists():
+        shutil.rmtree(path)
+    os.replace(tmp_path, path)
+    return path
+
+
+def write_ome_zarr(path: Path, image: np.ndarray, **zarr_options) -> Path:
+    """Write an in-memory 2D image or z-stack as an OME-Zarr pyramid (see `write_ome_zarr_bands`)."""
+    if image.ndim == 3:
+        bands = (((z, 0), plane) for z, plane in enumerate(image))
+    else:
+        bands = [((0,), image)]
+    return write_ome_zarr_bands(path, image.shape, image.dtype, bands, **zarr_options)
+
+
+def open_image(path: Path, level: int = 0):
+    """
+    Open an image for reading: a lazy Zarr array for `.zarr` folders, else the decoded TIFF.
+
+    Slicing the Zarr array (`img[y0:y1, x0:x1]`) reads and decompresses only
+    the chunks it overlaps. TIFFs are read whole, as before.
+    """
+    if is_zarr_image(path):
+        zarr = _import_zarr()
+        return zarr.open_group(path, mode="r")[str(level)]
+    return tifffile.TiffFile(path).asarray()
+
+
+def iter_image_bands(path: Path, band_rows: int) -> Iterator[tuple[int, np.ndarray]]:
+    """
+    Yield `(first_row, band)` horizontal bands of a TIFF or Zarr image without loading it whole.
+
+    Bands are `(rows, x)` for 2D images and `(z, rows, x)` for stacks. Zarr
+    bands read only the chunks they overlap; TIFFs are memory-mapped or
+    decoded strip by strip (see `iter_tiff_row_bands`).
+    """
+    if is_zarr_image(path):
+        data = open_image(path)
+        for row in range(0, data.shape[-2], band_rows):
+            yield row, data[..., row:row + band_rows, :]
+        return
+    yield from iter_tiff_row_bands(path, band_rows)
+
+
+def image_shape(path: Path) -> tuple[int, ...]:
+    """Return the full-resolution shape of a TIFF or Zarr image from its metadata only."""
+    if is_zarr_image(path):
+        return tuple(open_image(path).shape)
+    with tifffile.TiffFile(path) as tif:
+        return tuple(tif.series[0].shape)
+
+
+def copy_image(src: Path, dst: Path, link_mode: str = "copy") -> None:
+    """
+    Copy a TIFF file or Zarr image folder, or link it (see `io_helpers.materialize_file`).
+
+    Zarr folders are symlinked as a whole, or rebuilt with every chunk file
+    hardlinked/reflinked/copied.
+    """
+    if not src.is_dir():
+        materialize_file(src, dst, link_mode)
+    elif link_mode == "symlink":
+        try:
+            os.symlink(src.resolve(), dst, target_is_directory=True)
+        except OSError as e:
+            print(f"Warning: symlink not possible ({e.strerror or e}), copying instead:\n{src}")
+            shutil.copytree(src, dst)
+    else:
+        shutil.copytree(src, dst, copy_function=lambda s, d: materialize_file(s, d, link_mode))
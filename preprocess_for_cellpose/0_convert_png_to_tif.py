@@ -12,13 +12,13 @@ from pathlib import Path
 import sys
 
 import numpy as np
-import tifffile
 from PIL import Image
 
 parent_dir = Path(__file__).resolve().parent.parent
 sys.path.append(str(parent_dir))
 
 from lsfm_data_processing.utils.io_helpers import load_script_config, normalize_user_path, require_dir
+from lsfm_data_processing.utils.tiff_io import tiff_options_from_config, write_tiff
 
 
 def find_png_files(input_dir: Path, recursive: bool) -> list[Path]:
@@ -44,12 +44,12 @@ def convert_image(image_path: Path, mode: str, channel: int) -> np.ndarray:
     return arr[:, :, channel]
 
 
-def write_tiff(out_path: Path, image_array: np.ndarray) -> None:
+def save_tiff(out_path: Path, image_array: np.ndarray, tiff_options: dict) -> None:
     if image_array.ndim == 3 and image_array.shape[2] in {3, 4}:
-        tifffile.imwrite(out_path, image_array, photometric="rgb")
+        write_tiff(out_path, image_array, tiff_options, photometric="rgb")
         return
 
-    tifffile.imwrite(out_path, image_array)
+    write_tiff(out_path, image_array, tiff_options)
 
 
 def invert_image(image_array: np.ndarray) -> np.ndarray:
@@ -92,6 +92,7 @@ conversion_mode = cfg.get("conversion_mode", "single_channel")
 invert_output = cfg.get("invert_output", False)
 recursive = cfg.get("recursive", False)
 overwrite = cfg.get("overwrite", False)
+tiff_options = tiff_options_from_config(cfg)
 
 if conversion_mode == "conversion_only":
     conversion_mode = "format_only"
@@ -144,7 +145,7 @@ for png_path in png_files:
     )
     if invert_output:
         converted_image = invert_image(converted_image)
-    write_tiff(out_path, converted_image)
+    save_tiff(out_path, converted_image, tiff_options)
     converted += 1
     print(f"Converted: {png_path.name} -> {out_path.name} shape={converted_image.shape}")
 
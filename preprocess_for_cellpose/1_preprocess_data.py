@@ -7,6 +7,9 @@ Expected default channel folder naming:
 - Ex_640_Ch2_stitched for channel 2
 
 Use `flag_custom_format` settings in config if your folder layout differs.
+
+Set `channels` in the config to process several channels of each sample in one
+run; their MIPs share one worker pool and read schedule.
 """
 
 from pathlib import Path
@@ -17,8 +20,22 @@ import tifffile
 parent_dir = Path(__file__).resolve().parent.parent
 sys.path.append(str(parent_dir))
 
-from lsfm_data_processing.utils.image_ops import _raise_if_windows_path_too_long, normalize_array
-from lsfm_data_processing.utils.mip import create_mips_from_folder
+from lsfm_data_processing.utils.image_ops import (
+    _raise_if_windows_path_too_long,
+    normalize_array,
+    normalize_tiff_tiled,
+    stack_percentiles,
+)
+from lsfm_data_processing.utils.tiff_io import tiff_nbytes, tiff_options_from_config, write_tiff
+from lsfm_data_processing.utils.zarr_io import ZARR_SUFFIX, write_ome_zarr
+from lsfm_data_processing.utils.manifest import (
+    file_signature,
+    load_manifest,
+    output_is_current,
+    record_output,
+    save_manifest,
+)
+from lsfm_data_processing.utils.mip import create_mips_from_folders
 from lsfm_data_processing.utils.io_helpers import (
     load_script_config,
     normalize_user_path,
@@ -47,13 +64,25 @@ input_folders = [
 
 create_MIPs = cfg["create_MIPs"]
 mip_thickness = cfg["mip_thickness"]
-channel = cfg["channel"]
+mip_stride = cfg.get("mip_stride")
+channels = cfg.get("channels", [cfg.get("channel")])
 
 do_normalization = cfg["do_normalization"]
 min_val = cfg["min_val"]
 max_val = cfg["max_val"]
+channel_normalization = cfg.get("channel_normalization", {})
+normalization_scope = cfg.get("normalization_scope", "image")
+histogram_slice_step = cfg.get("histogram_slice_step", 1)
 convert_to_8bit = cfg.get("convert_to_8bit", True)
 use_lzw_compression = cfg.get("use_lzw_compression", True)
+# tiff_* keys; configs without tiff_compression keep the older use_lzw_compression switch
+tiff_options = tiff_options_from_config(cfg, "lzw" if use_lzw_compression else "none")
+output_format = cfg.get("output_format", "tiff")
+num_workers = cfg.get("num_workers", 1)
+read_ahead_slices = cfg.get("read_ahead_slices", 0)
+resume = cfg.get("resume", False)
+tile_budget_mb = cfg.get("tile_budget_mb", 0)
+tile_budget_bytes = int(tile_budget_mb * 1024**2) if tile_budget_mb else None
 
 # advanced
 z_step_user = cfg.get("z_step_user")
@@ -62,137 +91,272 @@ flag_custom_format = cfg["flag_custom_format"]
 subfolder_name = cfg["subfolder_name"]
 underscores_to_z_plane_cfg = cfg["underscores_to_z_plane"]
 
+if output_format not in ("tiff", "zarr"):
+    raise RuntimeError(f'output_format must be "tiff" or "zarr", got "{output_format}".')
+# Keyword arguments of write_ome_zarr_bands; None writes TIFFs.
+zarr_options = None
+if output_format == "zarr":
+    zarr_options = {
+        "chunk_size": cfg.get("zarr_chunk_size", 256),
+        "pyramid_levels": cfg.get("zarr_pyramid_levels", 4),
+        "compressor": cfg.get("zarr_compressor", "zstd"),
+        "compression_level": cfg.get("zarr_compression_level", 3),
+        "zarr_format": cfg.get("zarr_format", 2),
+    }
+
+if normalization_scope not in ("image", "sample"):
+    raise RuntimeError(f'normalization_scope must be "image" or "sample", got "{normalization_scope}".')
+
+if flag_custom_format and isinstance(subfolder_name, list):
+    if len(subfolder_name) != len(channels):
+        raise RuntimeError("subfolder_name must list one folder per entry in channels.")
+elif flag_custom_format and len(channels) > 1:
+    raise RuntimeError("With flag_custom_format and several channels, give subfolder_name as a list (one per channel).")
+
 # -------------------------
-# MAIN CODE
+# HELPERS
 # -------------------------
 
-for folder in input_folders:
-    sample_id = get_underscore_token(folder.name, 5, "sample_id")
-
-    params_dict = {"create_MIPs": create_MIPs,
-                "mip_thickness": mip_thickness,
-                "channel": channel,
-                "do_normalization": do_normalization,
-                "min_val": min_val,
-                "max_val": max_val,
-                "convert_to_8bit": convert_to_8bit,
-                "use_lzw_compression": use_lzw_compression}
 
+def get_channel_folder(folder: Path, channel_index: int) -> tuple[Path, int]:
+    """Return the stitched folder of the `channel_index`-th configured channel and its z-token index."""
+    channel = channels[channel_index]
     if flag_old_format:
-        underscores_to_z_plane = 0
         channel_wavelengths = {0:"00", 1:"01", 2:"02"}
-        channel_folder = Path(folder / f"stitched_{channel_wavelengths.get(channel)}//")
-    
-    elif flag_custom_format:
-        underscores_to_z_plane = underscores_to_z_plane_cfg
-        channel_folder = Path(folder / subfolder_name)
-                              
-    else:
-        underscores_to_z_plane = 2
-        channel_wavelengths = {0:"488", 1:"561", 2:"640"}
-        channel_folder = Path(folder / f"Ex_{channel_wavelengths.get(channel)}_Ch{channel}_stitched//")
-
-    if create_MIPs:
-        print(f"Creating MIPs for {sample_id} ...")
-    
-        json_file = Path(folder) / "metadata.json"
-
-        # Check if the JSON file exists
-        if json_file.is_file():
-            with open(json_file, 'r', encoding='cp1252') as file:
-                json_data = json.load(file)
-                z_step_size = int(float(json_data['session_config']['Z step (µm)']))
-                print(f"Using z step of {z_step_size}")
-        else:
-            print(f"No {json_file} file found.")
+        return Path(folder / f"stitched_{channel_wavelengths.get(channel)}//"), 0
 
-            # Check if z_step_user is defined
-            if z_step_user is not None:
-                print(f"Using user defined z step, which is {z_step_user}.")
-                z_step_size = z_step_user
-            else:
-                print("Z step is set to None. Please set your z step manually and try again.")
-
-        params_dict["z_step_size"] = z_step_size
-
-        if do_normalization:
-            MIP_output_folder = channel_folder.parent / f"{channel_folder.name}_MIP{mip_thickness}um_min{min_val}_max{max_val}"
-            
-            create_mips_from_folder(
-                channel_folder,
-                MIP_output_folder,
-                z_step_size,
-                mip_thickness,
-                underscores_to_z_plane,
-                do_normalization=True,
-                min_val=min_val,
-                max_val=max_val,
-                convert_to_8bit=convert_to_8bit,
-                use_lzw_compression=use_lzw_compression,
-            )
+    if flag_custom_format:
+        name = subfolder_name[channel_index] if isinstance(subfolder_name, list) else subfolder_name
+        return Path(folder / name), underscores_to_z_plane_cfg
 
-            params_file = Path(MIP_output_folder / "parameters.txt")
-            if sys.platform.startswith("win"):
-                _raise_if_windows_path_too_long(params_file)
-            with open(params_file, "w") as file:
-                file.write(str(params_dict))
+    channel_wavelengths = {0:"488", 1:"561", 2:"640"}
+    return Path(folder / f"Ex_{channel_wavelengths.get(channel)}_Ch{channel}_stitched//"), 2
 
-        else:
-            MIP_output_folder = channel_folder.parent / f"{channel_folder.name}_MIP{mip_thickness}um"
-            create_mips_from_folder(
-                channel_folder,
-                MIP_output_folder,
-                z_step_size,
-                mip_thickness,
-                underscores_to_z_plane,
-                do_normalization=False,
-                convert_to_8bit=convert_to_8bit,
-                use_lzw_compression=use_lzw_compression,
-            )
-            
-            params_file = Path(MIP_output_folder / "parameters.txt")
-            if sys.platform.startswith("win"):
-                _raise_if_windows_path_too_long(params_file)
-            with open(params_file, "w") as file:
-                file.write(str(params_dict))
-    else:
-
-        if do_normalization:
-            print(f"Creating normalized images for {sample_id} ...")
-            img_output_folder = channel_folder.parent / f"{channel_folder.name}_norm_min{min_val}_max{max_val}"
-            img_output_folder.mkdir(parents=True, exist_ok=True)
-
-            images = sorted(channel_folder.glob("*.tif*"))
-            if sys.platform.startswith("win"):
-                for image in images:
-                    _raise_if_windows_path_too_long(img_output_folder / image.name)
-
-            for image in images:
+
+def get_channel_norm_params(channel) -> tuple[float, float]:
+    """Return (min_val, max_val) for a channel, using `channel_normalization` overrides when given."""
+    override = channel_normalization.get(str(channel), {})
+    return override.get("min_val", min_val), override.get("max_val", max_val)
+
+
+def get_norm_thresholds(channel_folder: Path, ch_min_val: float, ch_max_val: float) -> list[float] | None:
+    """Return sample-level (lower, upper) clip values for a channel, or None for per-image normalization."""
+    if not do_normalization or normalization_scope != "sample":
+        return None
+    print(f"Computing sample-level thresholds for {channel_folder.name} (slice step {histogram_slice_step}) ...")
+    thresholds = stack_percentiles(
+        sorted(channel_folder.glob("*.tif*")),
+        (ch_min_val, ch_max_val),
+        slice_step=histogram_slice_step,
+        read_ahead=read_ahead_slices,
+        tile_budget_bytes=tile_budget_bytes,
+    )
+    thresholds = [float(t) for t in thresholds]
+    print(f"Using thresholds {thresholds[0]} - {thresholds[1]}")
+    return thresholds
+
+
+def get_norm_suffix(ch_min_val: float, ch_max_val: float) -> str:
+    """Return the output folder suffix describing the normalization settings."""
+    suffix = f"min{ch_min_val}_max{ch_max_val}"
+    return f"{suffix}_sample" if normalization_scope == "sample" else suffix
+
+
+def write_parameters(output_folder: Path, params: dict) -> None:
+    params_file = Path(output_folder / "parameters.txt")
+    if sys.platform.startswith("win"):
+        _raise_if_windows_path_too_long(params_file)
+    with open(params_file, "w") as file:
+        json.dump(params, file, indent=2)
+
+
+def normalize_folder(
+    channel_folder: Path,
+    img_output_folder: Path,
+    params_dict: dict,
+    ch_min_val: float,
+    ch_max_val: float,
+    norm_thresholds: list[float] | None = None,
+) -> None:
+    """Normalize every image of a channel folder, skipping up-to-date outputs when resuming."""
+    img_output_folder.mkdir(parents=True, exist_ok=True)
+
+    images = sorted(channel_folder.glob("*.tif*"))
+    if sys.platform.startswith("win"):
+        for image in images:
+            _raise_if_windows_path_too_long(img_output_folder / image.name)
+
+    manifest = load_manifest(img_output_folder, {**params_dict, "input_dir": str(channel_folder)}, resume)
+    skipped = 0
+    try:
+        for n_done, image in enumerate(images, start=1):
+            out_image = img_output_folder / (image.name if zarr_options is None else image.stem + ZARR_SUFFIX)
+            input_signatures = [file_signature(image)]
+            if resume and output_is_current(manifest, out_image, input_signatures):
+                skipped += 1
+                continue
+
+            if tile_budget_bytes is not None and tiff_nbytes(image) > tile_budget_bytes:
+                # Larger than the budget: stream bands and write a tiled TIFF instead of loading the frame.
+                normalize_tiff_tiled(
+                    image,
+                    out_image,
+                    min_val=ch_min_val,
+                    max_val=ch_max_val,
+                    convert_to_8bit=convert_to_8bit,
+                    thresholds=norm_thresholds,
+                    tile_budget_bytes=tile_budget_bytes,
+                    tiff_options=tiff_options,
+                    zarr_options=zarr_options,
+                )
+            else:
                 image_array = tifffile.TiffFile(image).asarray()
                 normalized_image = normalize_array(
                     image_array,
-                    min_val=min_val,
-                    max_val=max_val,
+                    min_val=ch_min_val,
+                    max_val=ch_max_val,
                     convert_to_8bit=convert_to_8bit,
+                    thresholds=norm_thresholds,
                 )
-                tifffile.imwrite(
-                    img_output_folder / image.name,
-                    normalized_image,
-                    compression="lzw" if use_lzw_compression else None,
+                if zarr_options is not None:
+                    write_ome_zarr(out_image, normalized_image, **zarr_options)
+                else:
+                    write_tiff(out_image, normalized_image, tiff_options)
+            record_output(manifest, out_image, input_signatures)
+            if n_done % 20 == 0:
+                save_manifest(img_output_folder, manifest)
+    finally:
+        save_manifest(img_output_folder, manifest)
+
+    if skipped:
+        print(f"Skipped {skipped} up-to-date normalized images")
+
+    write_parameters(img_output_folder, params_dict)
+
+
+# -------------------------
+# MAIN CODE
+# -------------------------
+
+# The guard keeps worker processes (num_workers > 1) from re-running the pipeline on import.
+if __name__ == "__main__":
+    for folder in input_folders:
+        sample_id = get_underscore_token(folder.name, 5, "sample_id")
+
+        if create_MIPs:
+            print(f"Creating MIPs for {sample_id} ...")
+
+            json_file = Path(folder) / "metadata.json"
+
+            # Check if the JSON file exists
+            if json_file.is_file():
+                with open(json_file, 'r', encoding='cp1252') as file:
+                    json_data = json.load(file)
+                    z_step_size = int(float(json_data['session_config']['Z step (µm)']))
+                    print(f"Using z step of {z_step_size}")
+            else:
+                print(f"No {json_file} file found.")
+
+                # Check if z_step_user is defined
+                if z_step_user is not None:
+                    print(f"Using user defined z step, which is {z_step_user}.")
+                    z_step_size = z_step_user
+                else:
+                    print("Z step is set to None. Please set your z step manually and try again.")
+
+            # A list of thicknesses is produced in one read pass, one output folder per thickness.
+            mip_thicknesses = mip_thickness if isinstance(mip_thickness, list) else [mip_thickness]
+            # Sliding-window MIPs (mip_stride set) are named after thickness and stride.
+            mip_suffixes = [f"MIP{t}um" if mip_stride is None else f"MIP{t}um_stride{mip_stride}um" for t in mip_thicknesses]
+
+            # All channels of a sample are scheduled together so they share workers and reads.
+            mip_jobs = []
+            params_by_folder = {}
+            for channel_index, channel in enumerate(channels):
+                channel_folder, underscores_to_z_plane = get_channel_folder(folder, channel_index)
+                ch_min_val, ch_max_val = get_channel_norm_params(channel)
+                norm_thresholds = get_norm_thresholds(channel_folder, ch_min_val, ch_max_val)
+
+                if do_normalization:
+                    MIP_output_folders = [
+                        channel_folder.parent / f"{channel_folder.name}_{suffix}_{get_norm_suffix(ch_min_val, ch_max_val)}"
+                        for suffix in mip_suffixes
+                    ]
+                else:
+                    MIP_output_folders = [
+                        channel_folder.parent / f"{channel_folder.name}_{suffix}" for suffix in mip_suffixes
+                    ]
+
+                mip_jobs.append(
+                    dict(
+                        input_dir=channel_folder,
+                        output_dir=MIP_output_folders,
+                        z_step_size=z_step_size,
+                        mip_thickness=mip_thicknesses,
+                        underscores_to_plane_z=underscores_to_z_plane,
+                        do_normalization=do_normalization,
+                        min_val=ch_min_val,
+                        max_val=ch_max_val,
+                        convert_to_8bit=convert_to_8bit,
+                        tiff_options=tiff_options,
+                        mip_stride=mip_stride,
+                        norm_thresholds=norm_thresholds,
+                        zarr_options=zarr_options,
+                    )
                 )
-            
-            params_file = Path(img_output_folder / "parameters.txt")
-            if sys.platform.startswith("win"):
-                _raise_if_windows_path_too_long(params_file)
-            with open(params_file, "w") as file:
-                file.write(str(params_dict))
-                
-        else:
-            print("MIP creation and normalization set to False. Nothing to do here...")
+                for MIP_output_folder, t in zip(MIP_output_folders, mip_thicknesses):
+                    params_by_folder[MIP_output_folder] = {
+                        "create_MIPs": create_MIPs,
+                        "mip_thickness": t,
+                        "mip_stride": mip_stride,
+                        "channel": channel,
+                        "do_normalization": do_normalization,
+                        "min_val": ch_min_val,
+                        "max_val": ch_max_val,
+                        "normalization_scope": normalization_scope,
+                        "norm_thresholds": norm_thresholds,
+                        "convert_to_8bit": convert_to_8bit,
+                        "tiff_options": tiff_options,
+                        "output_format": output_format,
+                        "zarr_options": zarr_options,
+                        "z_step_size": z_step_size,
+                    }
 
-    print(f"Finished creating MIPs for {sample_id}")
+            create_mips_from_folders(
+                mip_jobs,
+                num_workers=num_workers,
+                read_ahead=read_ahead_slices,
+                resume=resume,
+            )
 
+            for MIP_output_folder, params in params_by_folder.items():
+                write_parameters(MIP_output_folder, params)
 
+        elif do_normalization:
+            for channel_index, channel in enumerate(channels):
+                print(f"Creating normalized images for {sample_id}, channel {channel} ...")
+                channel_folder, _ = get_channel_folder(folder, channel_index)
+                ch_min_val, ch_max_val = get_channel_norm_params(channel)
+                norm_thresholds = get_norm_thresholds(channel_folder, ch_min_val, ch_max_val)
+                img_output_folder = channel_folder.parent / f"{channel_folder.name}_norm_{get_norm_suffix(ch_min_val, ch_max_val)}"
 
+                params_dict = {"create_MIPs": create_MIPs,
+                            "mip_thickness": mip_thickness,
+                            "channel": channel,
+                            "do_normalization": do_normalization,
+                            "min_val": ch_min_val,
+                            "max_val": ch_max_val,
+                            "normalization_scope": normalization_scope,
+                            "norm_thresholds": norm_thresholds,
+                            "convert_to_8bit": convert_to_8bit,
+                            "tiff_options": tiff_options,
+                            "output_format": output_format,
+                            "zarr_options": zarr_options}
+                normalize_folder(
+                    channel_folder, img_output_folder, params_dict, ch_min_val, ch_max_val, norm_thresholds
+                )
 
+        else:
+            print("MIP creation and normalization set to False. Nothing to do here...")
 
+        print(f"Finished creating MIPs for {sample_id}")
@@ -1,12 +1,11 @@
 """
-Select representative TIFF sections from MIP folders, with optional z-stack generation.
+Select representative TIFF/OME-Zarr sections from MIP folders, with optional z-stack generation.
 
 Selection is evenly spaced with deterministic shuffling by sample ID.
 The script oversamples by two planes so first/last slices can be dropped.
 """
 
 from pathlib import Path
-import shutil
 import sys
 
 
@@ -15,12 +14,16 @@ sys.path.append(str(parent_dir))
 
 from lsfm_data_processing.utils.stacks import tifs_to_zstack
 from lsfm_data_processing.utils.io_helpers import (
+    link_mode_from_config,
+    list_image_files,
     load_script_config,
     normalize_user_path,
     require_dir,
 )
 from lsfm_data_processing.utils.naming import get_underscore_token
 from lsfm_data_processing.utils.selection import select_sections_evenly
+from lsfm_data_processing.utils.tiff_io import tiff_options_from_config
+from lsfm_data_processing.utils.zarr_io import copy_image
 
 # -------------------------
 # CONFIG LOADING (shared helper)
@@ -48,6 +51,8 @@ z_stack_number = cfg["z_stack_number"]
 
 flag_custom_format = cfg["flag_custom_format"]
 underscores_to_id_cfg = cfg["underscores_to_id"]
+tiff_options = tiff_options_from_config(cfg)
+link_mode = link_mode_from_config(cfg)
 
 # validate output parent exists, then create output folder
 out_path.mkdir(exist_ok=True, parents=True)
@@ -67,7 +72,7 @@ for path in folder_paths:
     sample_id = get_underscore_token(folder_parent, underscores_to_id, "sample_id")
     
     # Load files
-    files = sorted(path.glob("*.tif*"))
+    files = list_image_files(path)
     n = len(files)
     
     if n == 0:
@@ -108,7 +113,7 @@ for path in folder_paths:
                 stacked_samples.append(files[idx])
 
             # Generate the Z-stack for the collected images
-            tifs_to_zstack(stacked_samples, out_path, sample_id)
+            tifs_to_zstack(stacked_samples, out_path, sample_id, tiff_options)
 
         print(f"All z stacks for {sample_id} created")
         print("-----------")
@@ -118,7 +123,7 @@ for path in folder_paths:
             # Define the destination path for each file
             destination_path = out_path / f"{sample_id}_{file.name}"
             print(f"Copying {file} to {destination_path}")
-            shutil.copy2(str(file), str(destination_path))
+            copy_image(file, destination_path, link_mode)
     
         print(f"All selected files from {sample_id} copied.")
         print("-----------")
@@ -11,7 +11,6 @@ import matplotlib.pyplot as plt
 import nibabel as nib
 from PIL import Image
 import numpy as np
-import cv2
 
 parent_dir = Path(__file__).resolve().parent.parent
 sys.path.append(str(parent_dir))
@@ -25,6 +24,7 @@ from lsfm_data_processing.utils.io_helpers import (
     require_subpath,
 )
 from lsfm_data_processing.utils.naming import get_underscore_int, get_underscore_token
+from lsfm_data_processing.utils.tiff_io import tiff_options_from_config, write_tiff
 
 # -------------------------
 # CONFIG LOADING
@@ -51,6 +51,8 @@ flag_custom_format = cfg.get("flag_custom_format", False)
 underscores_to_id_cfg = cfg.get("underscores_to_id", 5)
 all_images_subfolder = cfg.get("all_images_subfolder", "Ex_561_Ch1_stitched")
 show_preview = cfg.get("show_preview", True)
+# OpenCV wrote these slices LZW-compressed; keep that as the default
+tiff_options = tiff_options_from_config(cfg, "lzw")
 
 # -------------------------
 # MAIN CODE
@@ -120,7 +122,7 @@ for sample_path in sample_paths:
         # save the atlas slice as a 16 bit tiff image
 
         out_file = selected_images_path / f"{name.split('.')[0]}_atlas_slice.tif"
-        cv2.imwrite(str(out_file), atlas_slice)
+        write_tiff(out_file, atlas_slice, tiff_options)
 
         print("Image has been saved successfully.")
 
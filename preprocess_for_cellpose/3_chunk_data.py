@@ -1,22 +1,50 @@
 """
 Chunk TIFF images (2D or z-stack) for Cellpose workflows.
 
-Supports standard images, MIPs, z-stacks, and atlas-slice images.
+Supports standard images, MIPs, z-stacks, and atlas-slice images, stored as
+TIFF files or OME-Zarr folders. Images are read one row of chunks at a time
+(memory-mapped, strip by strip, or chunk by chunk), never whole.
+
+With filter_chunks=true, chunking and 4_filter_black_chunks.py run as one
+step: only chunks above pixel_val_threshold (and their paired atlas chunks)
+are written, straight to the filtered_image_chunks/filtered_atlas_chunks
+folders that step 4 would create.
+
+With write_catalog=true, chunk_catalog.sqlite is written next to the chunks
+(one row per chunk: source, y/x, shape, dtype, mean, nonzero fraction and,
+with atlas pairs, the atlas region histogram), so steps 4, 5a and 5b can
+filter and select without decoding chunks.
+
+With virtual_chunks=true no chunk TIFFs are written at all: the catalog
+rows reference (source, y, x, size) and steps 4, 5a and 5b filter and select
+on them; only the finally selected chunks are cropped from the sources and
+written. With packed_chunks=true the chunks of each image are written into
+one container (<image stem>_chunks.tif, one TIFF series per chunk) instead of
+one file each; the catalog indexes them and only the final selection is
+unpacked to loose TIFFs.
+
+With num_workers > 1 the images are chunked on that many processes, and
+write_threads > 1 writes the loose chunk TIFFs of each image on background
+threads; max_inflight_mb caps the memory held by chunks waiting to be written.
+The output (and catalog) is the same as a serial run's.
 """
 
 from pathlib import Path
-import tifffile
 import sys
 
 parent_dir = Path(__file__).resolve().parent.parent
 sys.path.append(str(parent_dir))
 
-from lsfm_data_processing.utils.chunking import chunk_image, chunk_z_stack
+from lsfm_data_processing.utils.chunk_catalog import create_catalog
+from lsfm_data_processing.utils.chunking import chunk_images
 from lsfm_data_processing.utils.io_helpers import (
+    list_image_files,
     load_script_config,
     normalize_user_path,
     require_dir,
 )
+from lsfm_data_processing.utils.tiff_io import tiff_options_from_config
+from lsfm_data_processing.utils.zarr_io import image_shape
 
 # -------------------------
 # CONFIG LOADING
@@ -39,62 +67,152 @@ file_path = require_dir(
 
 chunk_size = cfg["chunk_size"]
 stack_mode = cfg.get("stack_mode", False)
-
-# -------------------------
-# OUTPUT SETUP
-# -------------------------
-
-chunk_root = file_path / f"chunked_images_{chunk_size}by{chunk_size}"
-chunk_root.mkdir(exist_ok=True)
+filter_chunks = cfg.get("filter_chunks", False)
+pixel_val_threshold = cfg.get("pixel_val_threshold", 50.0)
+atlas_chunks_included = cfg.get("atlas_chunks_included", False)
+write_catalog = cfg.get("write_catalog", True)
+virtual_chunks = cfg.get("virtual_chunks", False)
+packed_chunks = cfg.get("packed_chunks", False)
+tiff_options = tiff_options_from_config(cfg)
+num_workers = cfg.get("num_workers", 1)
+write_threads = cfg.get("write_threads", 1)
+max_inflight_mb = cfg.get("max_inflight_mb", 512)
+
+if num_workers < 1 or write_threads < 1:
+    raise RuntimeError("num_workers and write_threads must be >= 1.")
+# Shared by all worker processes; each gets an equal share for its queued chunk writes
+max_inflight_bytes = int(max_inflight_mb * 1024**2 / num_workers)
+
+if virtual_chunks and not write_catalog:
+    raise RuntimeError("virtual_chunks=true needs write_catalog=true: the catalog is the only output.")
+if packed_chunks and not write_catalog:
+    raise RuntimeError("packed_chunks=true needs write_catalog=true: steps 4 and 5 find packed chunks through it.")
+if packed_chunks and virtual_chunks:
+    raise RuntimeError("Set only one of virtual_chunks and packed_chunks.")
+
+# Only loose chunks get loose atlas chunks; otherwise they are cropped from the atlas slices at selection
+loose_chunks = not (virtual_chunks or packed_chunks)
 
 # -------------------------
 # MAIN
 # -------------------------
 
-# Glob for TIFF files using pathlib
-files = sorted(file_path.glob("*.tif*"))
-
-if not files:
-    raise RuntimeError(
-        f"No TIFF files found in:\n{file_path}"
-    )
-
-print(f"Found {len(files)} images to chunk.\n")
-print(f"stack_mode = {stack_mode}")
-
-# Process each file
-for file in files:
-    print(f"Chunking image {file}...")
-    
-    img = tifffile.TiffFile(file).asarray()
-    shape = img.shape
-
-    # Extract folder name using pathlib
-    folder_name = file.stem
-
-    # Define the output directory for chunked images
-    image_outdir = chunk_root / folder_name
-
-    # Create the output directory if it doesn't exist
-    image_outdir.mkdir(parents=True, exist_ok=True)
-    
-    # Use explicit config intent rather than inferring stack-vs-image from ndim.
-    if stack_mode:
-        if len(shape) != 3:
-            raise RuntimeError(
-                "stack_mode=true requires 3D stack images with shape (z, y, x).\n"
-                f"Found shape {shape} for file:\n{file}"
-            )
-        chunk_z_stack(file, image_outdir, chunk_size=chunk_size)
+# The guard keeps worker processes (num_workers > 1) from re-running the pipeline on import.
+if __name__ == "__main__":
+    # -------------------------
+    # OUTPUT SETUP
+    # -------------------------
+
+    chunk_root = file_path / f"chunked_images_{chunk_size}by{chunk_size}"
+    if filter_chunks:
+        # Same output folders as 4_filter_black_chunks.py (next to the chunk folder it reads).
+        image_out_path = file_path / "filtered_image_chunks"
+        image_out_path.mkdir(parents=True, exist_ok=False)
+        if atlas_chunks_included and loose_chunks:
+            atlas_out_path = file_path / "filtered_atlas_chunks"
+            atlas_out_path.mkdir(parents=True, exist_ok=False)
     else:
-        is_supported_2d = len(shape) == 2 or (len(shape) == 3 and shape[-1] in {3, 4})
-        if not is_supported_2d:
-            raise RuntimeError(
-                "stack_mode=false requires a 2D image.\n"
-                "Supported shapes are (y, x) for grayscale or (y, x, 3/4) for RGB/RGBA.\n"
-                f"Found shape {shape} for file:\n{file}"
-            )
-        chunk_image(file, image_outdir, chunk_size=chunk_size)
-
-print("\nChunking complete.")
-
+        chunk_root.mkdir(exist_ok=True)
+
+    catalog = None
+    if write_catalog:
+        catalog = create_catalog(image_out_path if filter_chunks else chunk_root)
+
+    # -------------------------
+    # CHUNKING
+    # -------------------------
+
+    # TIFF files and OME-Zarr image folders
+    files = list_image_files(file_path)
+
+    if not files:
+        raise RuntimeError(
+            f"No TIFF or Zarr images found in:\n{file_path}"
+        )
+
+    atlas_files = {f.stem: f for f in files if f.stem.endswith("_atlas_slice")}
+    if filter_chunks or not loose_chunks:
+        # Atlas slices are only chunked as partners of their image; step 4 never keeps them on their own.
+        files = [f for f in files if not f.stem.endswith("_atlas_slice")]
+
+    print(f"Found {len(files)} images to chunk.\n")
+    print(f"stack_mode = {stack_mode}")
+
+    # One chunk_and_filter_image job per file; every file is checked before the first chunk is written
+    jobs = []
+    for file in files:
+        # Shape from the file header only; the chunkers read the pixels.
+        shape = image_shape(file)
+
+        # Use explicit config intent rather than inferring stack-vs-image from ndim.
+        if stack_mode:
+            if len(shape) != 3:
+                raise RuntimeError(
+                    "stack_mode=true requires 3D stack images with shape (z, y, x).\n"
+                    f"Found shape {shape} for file:\n{file}"
+                )
+        else:
+            is_supported_2d = len(shape) == 2 or (len(shape) == 3 and shape[-1] in {3, 4})
+            if not is_supported_2d:
+                raise RuntimeError(
+                    "stack_mode=false requires a 2D image.\n"
+                    "Supported shapes are (y, x) for grayscale or (y, x, 3/4) for RGB/RGBA.\n"
+                    f"Found shape {shape} for file:\n{file}"
+                )
+
+        is_atlas = file.stem in atlas_files
+        atlas_path = None
+        if atlas_chunks_included and not is_atlas:
+            atlas_path = atlas_files.get(f"{file.stem}_atlas_slice")
+            if atlas_path is None:
+                print(f"Warning: atlas slice missing for {file}")
+
+        job = dict(
+            path_to_image=file,
+            chunk_size=chunk_size,
+            stack=stack_mode,
+            atlas_path=atlas_path,
+            tiff_options=tiff_options,
+            catalog=write_catalog,
+            packed=packed_chunks,
+            write_workers=write_threads,
+            max_inflight_bytes=max_inflight_bytes,
+        )
+        if filter_chunks:
+            job["image_outdir"] = None if virtual_chunks else image_out_path
+            job["pixel_val_threshold"] = pixel_val_threshold
+            job["atlas_outdir"] = atlas_out_path if atlas_chunks_included and loose_chunks else None
+        elif not loose_chunks:
+            # Containers sit directly in the chunk folder, one per image
+            job["image_outdir"] = None if virtual_chunks else chunk_root
+        else:
+            # Define the output directory for chunked images, named after the image
+            image_outdir = chunk_root / file.stem
+            image_outdir.mkdir(parents=True, exist_ok=True)
+            job["image_outdir"] = image_outdir
+            # Atlas slices are chunked as their own images but catalogued with their image's chunks.
+            job["catalog"] = write_catalog and not is_atlas
+        jobs.append(job)
+
+    if num_workers > 1:
+        print(f"Chunking {len(jobs)} images with {num_workers} worker processes")
+
+    kept_chunks = 0
+    total_chunks = 0
+    try:
+        for job, kept, total in chunk_images(jobs, catalog, num_workers):
+            kept_chunks += kept
+            total_chunks += total
+            if filter_chunks:
+                print(f"Chunked image {job['path_to_image']}: kept {kept} of {total} chunks above {pixel_val_threshold}")
+            else:
+                print(f"Chunked image {job['path_to_image']}: {total} chunks")
+    finally:
+        if catalog is not None:
+            catalog.close()
+
+    if filter_chunks:
+        print(f"\nKept {kept_chunks} of {total_chunks} chunks in:\n{image_out_path}")
+    if virtual_chunks:
+        print(f"\nVirtual chunks catalogued in:\n{image_out_path if filter_chunks else chunk_root}")
+    print("\nChunking complete.")
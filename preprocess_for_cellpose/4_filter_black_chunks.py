@@ -2,20 +2,32 @@
 Filter out chunk images with low average intensity.
 
 Optionally copies corresponding atlas chunks when atlas pairing is enabled.
+When the chunk folder has a chunk_catalog.sqlite (3_chunk_data.py), chunk
+means are taken from it instead of decoding every chunk, and the rows of the
+kept chunks are written to a catalog in filtered_image_chunks/. Virtual and
+packed chunks (3_chunk_data.py with virtual_chunks/packed_chunks=true) have no
+loose files to copy: only their catalog rows are filtered, and the packed
+containers stay where step 3 wrote them.
 """
 
 from pathlib import Path
 import numpy as np
 import matplotlib.pyplot as plt
 from PIL import Image
-import shutil
 import sys
 
 parent_dir = Path(__file__).resolve().parent.parent
 sys.path.append(str(parent_dir))
 
+from lsfm_data_processing.utils.chunk_catalog import add_chunk_rows, create_catalog, load_catalog
 from lsfm_data_processing.utils.chunking import get_avg_pixel_value
-from lsfm_data_processing.utils.io_helpers import load_script_config, normalize_user_path, require_dir
+from lsfm_data_processing.utils.io_helpers import (
+    link_mode_from_config,
+    load_script_config,
+    materialize_file,
+    normalize_user_path,
+    require_dir,
+)
 
 # -------------------------
 # CONFIG LOADING
@@ -35,6 +47,7 @@ data_path = require_dir(
 pixel_val_threshold = cfg["pixel_val_threshold"]
 display_selected_chunks = cfg["display_selected_chunks"]
 atlas_chunks_included = cfg["atlas_chunks_included"]
+link_mode = link_mode_from_config(cfg)
 
 # -------------------------
 # OUTPUT PATHS
@@ -51,50 +64,65 @@ if atlas_chunks_included:
 # MAIN CODE
 # -------------------------
 
-# Get input paths using pathlib
-# Define output paths and create directories if they don't exist
-image_chunk_paths = sorted([p for p in data_path.glob("*") if not p.name.endswith("_atlas_slice")])
+def copy_selected_chunk(chunk_path: Path) -> None:
+    # Extract chunk name and number using pathlib
+    chunk_name = chunk_path.stem.split("_chunk")[0]
+    chunk_number = chunk_path.stem.split("chunk_")[-1]
+
+    if display_selected_chunks:
+        # Display the chunk image
+        chunk_img = np.array(Image.open(chunk_path))
+        print(f"Displaying {chunk_path}, Shape: {chunk_img.shape}")
+        plt.imshow(chunk_img)
+        plt.axis('off')
+        plt.show()
+        plt.close()
+
+    materialize_file(chunk_path, image_out_path / chunk_path.name, link_mode)
+
+    if atlas_chunks_included:
 
-# Process each image chunk
-for image_chunk_path in image_chunk_paths:
-    # Glob for tif files using pathlib
-    image_chunks = list(image_chunk_path.glob("*.tif"))
-    
-    for chunk_path in image_chunks:
+        atlas_chunk_path = chunk_path.parent.with_name(f"{chunk_path.parent.name}_atlas_slice") / f"{chunk_name}_atlas_slice_chunk_{chunk_number}.tif"
 
-        # Extract chunk name and number using pathlib
-        chunk_name = chunk_path.stem.split("_chunk")[0] 
-        chunk_number = chunk_path.stem.split("chunk_")[-1]
+        if atlas_chunk_path.exists():
+            materialize_file(atlas_chunk_path, atlas_out_path / atlas_chunk_path.name, link_mode)
+        else:
+            print(f"Warning: atlas chunk missing for {chunk_path}")
 
-        # Calculate average pixel value
-        average_pixel_value = get_avg_pixel_value(str(chunk_path))
-            
-        if average_pixel_value > pixel_val_threshold:
-            # Display the chunk image
-            chunk_img = np.array(Image.open(chunk_path))
 
-            if display_selected_chunks:
-                print(f"Displaying {chunk_path}, Shape: {chunk_img.shape}")
-                plt.imshow(chunk_img)
-                plt.axis('off')
-                plt.show()
-                plt.close()
+# Chunk means recorded by 3_chunk_data.py (write_catalog = true) avoid decoding every chunk.
+catalog_rows = load_catalog(data_path, min_mean=pixel_val_threshold, with_regions=True)
 
-            shutil.copy2(chunk_path, image_out_path / chunk_path.name) 
+if catalog_rows is not None:
+    print(f"Using chunk catalog: {len(catalog_rows)} chunks above {pixel_val_threshold}")
+    for row in catalog_rows:
+        if row["virtual"]:
+            continue
+        # Unfiltered chunks live in one folder per source image
+        copy_selected_chunk(data_path / Path(row["source_file"]).stem / row["chunk_file"])
 
-            if atlas_chunks_included:
+    # Carry the selected rows over so 5a/5b can use them too
+    filtered_catalog = create_catalog(image_out_path)
+    add_chunk_rows(filtered_catalog, catalog_rows)
+    filtered_catalog.close()
+    print("Finished copying filtered chunks")
 
-                atlas_chunk_path = chunk_path.parent.with_name(f"{image_chunk_path.name}_atlas_slice") / f"{chunk_name}_atlas_slice_chunk_{chunk_number}.tif"
+else:
+    # Get input paths using pathlib
+    # Define output paths and create directories if they don't exist
+    image_chunk_paths = sorted([p for p in data_path.glob("*") if p.is_dir() and not p.name.endswith("_atlas_slice")])
 
-                if atlas_chunk_path.exists():
-                    shutil.copy2(atlas_chunk_path, atlas_out_path / atlas_chunk_path.name)
-                else:
-                    print(f"Warning: atlas chunk missing for {chunk_path}")
-        
-    print(f"Finished copying filtered chunks for {image_chunk_path.name}")
-    
+    # Process each image chunk
+    for image_chunk_path in image_chunk_paths:
+        # Glob for tif files using pathlib
+        image_chunks = list(image_chunk_path.glob("*.tif"))
 
+        for chunk_path in image_chunks:
 
+            # Calculate average pixel value
+            average_pixel_value = get_avg_pixel_value(str(chunk_path))
 
-            
+            if average_pixel_value > pixel_val_threshold:
+                copy_selected_chunk(chunk_path)
 
+        print(f"Finished copying filtered chunks for {image_chunk_path.name}")
@@ -2,18 +2,29 @@
 Select a random subset of filtered image chunks.
 
 Use this when atlas chunks are not available.
+Virtual and packed chunks from the chunk catalog (3_chunk_data.py with
+virtual_chunks/packed_chunks=true) are cropped from their source images or
+unpacked from their containers when they are selected.
 """
 
 from pathlib import Path
-import shutil
 import random
 import sys
 
 parent_dir = Path(__file__).resolve().parent.parent
 sys.path.append(str(parent_dir))
 
-from lsfm_data_processing.utils.io_helpers import load_script_config, normalize_user_path, require_dir
+from lsfm_data_processing.utils.chunk_catalog import CATALOG_NAME, load_catalog
+from lsfm_data_processing.utils.chunking import read_catalog_chunks
+from lsfm_data_processing.utils.io_helpers import (
+    link_mode_from_config,
+    load_script_config,
+    materialize_file,
+    normalize_user_path,
+    require_dir,
+)
 from lsfm_data_processing.utils.selection import select_evenly_spaced_items
+from lsfm_data_processing.utils.tiff_io import tiff_options_from_config, write_tiff
 
 # -------------------------
 # CONFIG LOADING
@@ -33,6 +44,8 @@ chunk_dir = require_dir(
 out_dir = normalize_user_path(cfg["out_dir"])
 num_files_to_select = cfg["num_files_to_select"]
 avoid_reselect_existing = cfg.get("avoid_reselect_existing", False)
+link_mode = link_mode_from_config(cfg)
+tiff_options = tiff_options_from_config(cfg)
 
 # -------------------------
 # OUTPUT SETUP
@@ -44,8 +57,14 @@ out_dir.mkdir(parents=True, exist_ok=True)
 # MAIN CODE
 # -------------------------
 
-# List all chunk files
-files = sorted([p for p in chunk_dir.glob("*") if p.is_file()])
+# List all chunk files, from the chunk catalog when there is one (no folder listing needed)
+catalog_rows = load_catalog(chunk_dir)
+rows_by_file = {}
+if catalog_rows is not None:
+    rows_by_file = {chunk_dir / row["chunk_file"]: row for row in catalog_rows}
+    files = sorted(rows_by_file)
+else:
+    files = sorted([p for p in chunk_dir.glob("*") if p.is_file() and p.name != CATALOG_NAME])
 
 if not files:
     raise RuntimeError(f"No files found in chunk directory:\n{chunk_dir}")
@@ -92,6 +111,7 @@ random.shuffle(selected_files)
 
 # Iterate over the shuffled selected files and copy them with a unique prefix
 current_prefix = next_prefix
+virtual_destinations = {}
 for file in selected_files:
     # Rename the file with a unique prefix
     destination_file_name = f"{current_prefix}_{file.name}"
@@ -103,10 +123,23 @@ for file in selected_files:
         destination_file_name = f"{current_prefix}_{file.name}"
         destination_path = out_dir / destination_file_name
 
-    # Copy the file from source to target with the new name
-    shutil.copy2(file, destination_path)
+    row = rows_by_file.get(file)
+    if row is not None and row["virtual"]:
+        # Unpacked or cropped from the source image below, one read per container/source
+        virtual_destinations[row["chunk_file"]] = destination_path
+        current_prefix += 1
+        continue
+
+    # Copy (or link) the file from source to target with the new name
+    materialize_file(file, destination_path, link_mode)
     print(f"Copied: {file} as {destination_file_name}")
     current_prefix += 1
 
+virtual_rows = [row for row in catalog_rows or [] if row["chunk_file"] in virtual_destinations]
+for row, chunk in read_catalog_chunks(virtual_rows):
+    destination_path = virtual_destinations[row["chunk_file"]]
+    write_tiff(destination_path, chunk, tiff_options)
+    print(f"Wrote: {row['chunk_file']} as {destination_path.name}")
+
 print(f"Completed copying {num_files_to_select} files with randomized prefixes.")
 
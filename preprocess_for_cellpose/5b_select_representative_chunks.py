@@ -2,20 +2,49 @@
 Select representative chunk pairs (image + atlas) to maximize region coverage.
 
 Requires matching atlas chunks; otherwise use 5a_select_random_chunks.py.
+When chunk_dir has a chunk_catalog.sqlite with atlas region histograms
+(3_chunk_data.py with atlas_chunks_included), region IDs are read from it
+instead of decoding every atlas chunk. Virtual and packed chunks
+(virtual_chunks/packed_chunks=true) have no loose chunk files: the selected
+image chunks are cropped from their sources or unpacked from their
+containers, the atlas chunks are cropped from the atlas slices, and
+atlas_chunk_dir is not needed.
+
+With atlas_slice_dir set, no atlas chunks are needed at all: the region
+histograms of all chunks of each *_atlas_slice.tif are computed in one pass
+(chunking.image_region_histograms), and the atlas chunks of the selected
+pairs are cropped from the slices.
 """
 
+from collections import defaultdict
+from functools import partial
 import numpy as np
 from PIL import Image
 from pathlib import Path
-import shutil
 import random
 import sys
 
 parent_dir = Path(__file__).resolve().parent.parent
 sys.path.append(str(parent_dir))
 
-from lsfm_data_processing.utils.io_helpers import load_script_config, normalize_user_path, require_dir
-from lsfm_data_processing.utils.selection import greedy_region_coverage_select, random_fill_selection
+from lsfm_data_processing.utils.chunk_catalog import load_catalog
+from lsfm_data_processing.utils.chunking import image_region_histograms, read_catalog_chunks
+from lsfm_data_processing.utils.io_helpers import (
+    link_mode_from_config,
+    list_image_files,
+    load_script_config,
+    materialize_file,
+    normalize_user_path,
+    require_dir,
+)
+from lsfm_data_processing.utils.selection import (
+    RegionIncidence,
+    greedy_region_coverage_select,
+    random_fill_selection,
+    stochastic_greedy_region_coverage_select,
+)
+from lsfm_data_processing.utils.tiff_io import tiff_options_from_config, write_tiff
+from lsfm_data_processing.utils.zarr_io import open_image
 
 # -------------------------
 # CONFIG LOADING
@@ -32,22 +61,82 @@ chunk_dir = require_dir(
     "Filtered image chunks folder"
 )
 
-atlas_chunk_dir = require_dir(
-    normalize_user_path(cfg["atlas_chunk_dir"]),
-    "Filtered atlas chunks folder"
+atlas_chunk_dir = normalize_user_path(cfg["atlas_chunk_dir"])
+atlas_slice_dir_cfg = cfg.get("atlas_slice_dir", "")
+atlas_slice_dir = (
+    require_dir(normalize_user_path(atlas_slice_dir_cfg), "Atlas slice folder")
+    if atlas_slice_dir_cfg
+    else None
 )
+# Chunk edge of the chunk files; only used with atlas_slice_dir and no chunk catalog
+chunk_size = cfg.get("chunk_size", 256)
 
 number_of_chunks = cfg["number_of_chunks"]
+coverage_mode = cfg.get("coverage_mode", "exact")
+coverage_epsilon = cfg.get("coverage_epsilon", 0.1)
+random_seed = cfg.get("random_seed", 12345)
+link_mode = link_mode_from_config(cfg)
+tiff_options = tiff_options_from_config(cfg)
+
+if coverage_mode not in ("exact", "stochastic"):
+    raise RuntimeError(f'coverage_mode must be "exact" or "stochastic", got "{coverage_mode}".')
 
 # -------------------------
 # INPUT FILES
 # -------------------------
 
-atlas_chunks = sorted(atlas_chunk_dir.glob("*.tif"))
+catalog_rows = load_catalog(chunk_dir, with_regions=True)
+rows_by_atlas_chunk = None
+# Atlas chunk path -> (image chunk catalog row or file, atlas slice, y, x, chunk size)
+slice_chunks = None
+if atlas_slice_dir is not None:
+    if catalog_rows is not None:
+        image_chunks = [
+            (row, Path(row["source_file"]).stem, row["y"], row["x"], row["chunk_size"]) for row in catalog_rows
+        ]
+    else:
+        image_chunks = []
+        for image_path in sorted(chunk_dir.glob("*.tif")):
+            if "_chunk_" not in image_path.stem:
+                raise RuntimeError(f"Not a chunk file (<image stem>_chunk_<y>_<x>.tif):\n{image_path}")
+            source_stem, position = image_path.stem.rsplit("_chunk_", 1)
+            y, x = (int(value) for value in position.split("_"))
+            image_chunks.append((image_path, source_stem, y, x, chunk_size))
+
+    slice_files = {f.stem: f for f in list_image_files(atlas_slice_dir) if f.stem.endswith("_atlas_slice")}
+    slice_chunks = {}
+    missing_slices = set()
+    for image_chunk, source_stem, y, x, size in image_chunks:
+        atlas_slice = slice_files.get(f"{source_stem}_atlas_slice")
+        if atlas_slice is None:
+            # Like 3_chunk_data.py, images without an atlas slice have no atlas pairs
+            if source_stem not in missing_slices:
+                print(f"Warning: atlas slice missing for {source_stem}, skipping its chunks")
+                missing_slices.add(source_stem)
+            continue
+        # Named like the atlas chunks of step 3, so chunks are ordered (and tie-broken) the same way
+        atlas_chunk = atlas_slice_dir / f"{atlas_slice.stem}_chunk_{y}_{x}.tif"
+        slice_chunks[atlas_chunk] = (image_chunk, atlas_slice, y, x, size)
+    atlas_chunks = sorted(slice_chunks)
+    print(f"Counting atlas region IDs from the atlas slices in:\n{atlas_slice_dir}")
+elif catalog_rows is not None and any(row["regions"] is not None for row in catalog_rows):
+    rows_by_atlas_chunk = {
+        atlas_chunk_dir / row["atlas_chunk_file"]: row for row in catalog_rows if row["regions"] is not None
+    }
+    atlas_chunks = sorted(rows_by_atlas_chunk)
+    print("Using atlas region IDs from the chunk catalog.")
+
+if slice_chunks is None:
+    if rows_by_atlas_chunk is None or not all(row["virtual"] for row in rows_by_atlas_chunk.values()):
+        require_dir(atlas_chunk_dir, "Filtered atlas chunks folder")
+    if rows_by_atlas_chunk is None:
+        atlas_chunks = sorted(atlas_chunk_dir.glob("*.tif"))
 
 if not atlas_chunks:
     raise RuntimeError(
         f"No atlas chunk TIFF files found in:\n{atlas_chunk_dir}"
+        if slice_chunks is None
+        else f"No image chunks found in:\n{chunk_dir}"
     )
 
 print(f"Found {len(atlas_chunks)} atlas chunks.")
@@ -56,26 +145,47 @@ print(f"Found {len(atlas_chunks)} atlas chunks.")
 # REGION COVERAGE ANALYSIS
 # -------------------------
 
+# Region labels of each atlas chunk, collected into one candidate-by-region incidence matrix
 image_region_ids = []
 
-for idx, image_path in enumerate(atlas_chunks):
-    image_data = np.array(Image.open(image_path))
-    regions = set(np.unique(image_data))
-
-    image_region_ids.append(regions)
-
-all_regions = set().union(*image_region_ids) if image_region_ids else set()
-print(f"Found {len(all_regions)} unique atlas region IDs.")
+if slice_chunks is not None:
+    indices_by_slice = defaultdict(list)
+    for idx, atlas_chunk in enumerate(atlas_chunks):
+        _, atlas_slice, _, _, size = slice_chunks[atlas_chunk]
+        indices_by_slice[(atlas_slice, size)].append(idx)
+
+    image_region_ids = [None] * len(atlas_chunks)
+    for (atlas_slice, size), indices in indices_by_slice.items():
+        # Region IDs of every chunk of the slice in one pass
+        regions_grid, _ = image_region_histograms(atlas_slice, size)
+        for idx in indices:
+            _, _, y, x, _ = slice_chunks[atlas_chunks[idx]]
+            image_region_ids[idx] = regions_grid[y // size, x // size]
+else:
+    for idx, image_path in enumerate(atlas_chunks):
+        if rows_by_atlas_chunk is not None:
+            image_region_ids.append(list(rows_by_atlas_chunk[image_path]["regions"]))
+            continue
+
+        image_data = np.array(Image.open(image_path))
+        image_region_ids.append(np.unique(image_data))
+
+region_incidence = RegionIncidence(image_region_ids)
+print(f"Found {region_incidence.n_regions} unique atlas region IDs.")
 
 # -------------------------
 # GREEDY COVERAGE SELECTION
 # -------------------------
 
-regions_by_id = {idx: regions for idx, regions in enumerate(image_region_ids)}
-selected_images, covered_regions = greedy_region_coverage_select(
-    candidate_ids=list(range(len(image_region_ids))),
-    regions_by_id=regions_by_id,
-    limit=min(number_of_chunks, len(image_region_ids)),
+rng = random.Random(random_seed)
+coverage_select = greedy_region_coverage_select
+if coverage_mode == "stochastic":
+    coverage_select = partial(stochastic_greedy_region_coverage_select, rng=rng, epsilon=coverage_epsilon)
+
+selected_images, covered_regions = coverage_select(
+    candidate_ids=list(range(len(region_incidence))),
+    regions_by_id=region_incidence,
+    limit=min(number_of_chunks, len(region_incidence)),
 )
 
 print(f"Coverage-based selected: {len(selected_images)}")
@@ -84,11 +194,10 @@ print(f"Coverage-based selected: {len(selected_images)}")
 # RANDOM FILL (IF NEEDED)
 # -------------------------
 
-rng = random.Random(12345)
 selected_images = random_fill_selection(
     selected=selected_images,
-    all_ids=list(range(len(image_region_ids))),
-    target_total=min(number_of_chunks, len(image_region_ids)),
+    all_ids=list(range(len(region_incidence))),
+    target_total=min(number_of_chunks, len(region_incidence)),
     rng=rng,
 )
 
@@ -111,25 +220,61 @@ atlas_out_path.mkdir(parents=True, exist_ok=True)
 # -------------------------
 
 copied = 0
-
-for atlas_chunk in selected_atlas_chunks:
-
-    chunk_name = atlas_chunk.stem.split("_atlas")[0]
-    chunk_number = atlas_chunk.stem.split("chunk_")[-1]
-
-    corresponding_image_name = f"{chunk_name}_chunk_{chunk_number}.tif"
-    image_path = chunk_dir / corresponding_image_name
-
-    if not image_path.exists():
-        raise RuntimeError(
-            f"Missing corresponding image chunk:\n{image_path}"
-        )
-
-    shutil.copy2(image_path, image_out_path / image_path.name)
-    shutil.copy2(atlas_chunk, atlas_out_path / atlas_chunk.name)
-
+virtual_rows = []
+
+if slice_chunks is not None:
+    crops_by_slice = defaultdict(list)
+    for atlas_chunk in selected_atlas_chunks:
+        image_chunk, atlas_slice, y, x, size = slice_chunks[atlas_chunk]
+        crops_by_slice[atlas_slice].append((atlas_chunk.name, y, x, size))
+        if isinstance(image_chunk, dict):
+            if image_chunk["virtual"]:
+                # Unpacked/cropped from the container or source image below
+                virtual_rows.append(image_chunk)
+                continue
+            image_chunk = chunk_dir / image_chunk["chunk_file"]
+
+        materialize_file(image_chunk, image_out_path / image_chunk.name, link_mode)
+        copied += 1
+        print(f"Copied pair: {image_chunk.name}")
+
+    for atlas_slice, crops in crops_by_slice.items():
+        atlas_data = open_image(atlas_slice)
+        for atlas_chunk_file, y, x, size in crops:
+            atlas_chunk = np.asarray(atlas_data[y : y + size, x : x + size])
+            write_tiff(atlas_out_path / atlas_chunk_file, atlas_chunk, tiff_options)
+else:
+    for atlas_chunk in selected_atlas_chunks:
+        if rows_by_atlas_chunk is not None and rows_by_atlas_chunk[atlas_chunk]["virtual"]:
+            # Unpacked/cropped from the container or source image and atlas slice below
+            virtual_rows.append(rows_by_atlas_chunk[atlas_chunk])
+            continue
+
+        chunk_name = atlas_chunk.stem.split("_atlas")[0]
+        chunk_number = atlas_chunk.stem.split("chunk_")[-1]
+
+        corresponding_image_name = f"{chunk_name}_chunk_{chunk_number}.tif"
+        image_path = chunk_dir / corresponding_image_name
+
+        if not image_path.exists():
+            raise RuntimeError(
+                f"Missing corresponding image chunk:\n{image_path}"
+            )
+
+        materialize_file(image_path, image_out_path / image_path.name, link_mode)
+        materialize_file(atlas_chunk, atlas_out_path / atlas_chunk.name, link_mode)
+
+        copied += 1
+        print(f"Copied pair: {image_path.name}")
+
+for row, chunk in read_catalog_chunks(virtual_rows):
+    write_tiff(image_out_path / row["chunk_file"], chunk, tiff_options)
     copied += 1
-    print(f"Copied pair: {image_path.name}")
+    print(f"Wrote pair: {row['chunk_file']}")
+
+if slice_chunks is None:
+    for row, atlas_chunk in read_catalog_chunks(virtual_rows, atlas=True):
+        write_tiff(atlas_out_path / row["atlas_chunk_file"], atlas_chunk, tiff_options)
 
 print(f"\nFinished copying {copied} representative chunk pairs.")
 
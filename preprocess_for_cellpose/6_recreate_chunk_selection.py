@@ -16,18 +16,20 @@ from pathlib import Path
 import shutil
 import sys
 
-import tifffile
 
 parent_dir = Path(__file__).resolve().parent.parent
 sys.path.append(str(parent_dir))
 
 from lsfm_data_processing.utils.io_helpers import (
+    list_image_files,
     list_tiff_files,
     load_script_config,
     normalize_user_path,
     require_dir,
 )
 from lsfm_data_processing.utils.naming import get_underscore_int, get_underscore_token
+from lsfm_data_processing.utils.tiff_io import tiff_options_from_config, write_tiff
+from lsfm_data_processing.utils.zarr_io import image_shape, open_image
 
 
 def find_source_candidates(subject_files: list[Path], source_stem: str) -> list[Path]:
@@ -71,12 +73,11 @@ def parse_chunk_filename(
     if source_stem == "":
         raise RuntimeError(f"Could not infer source stem from:\n{chunk_path.name}")
 
-    old_chunk = tifffile.TiffFile(chunk_path).asarray()
     return {
         "chunk_path": chunk_path,
         "y": y,
         "x": x,
-        "old_shape": old_chunk.shape,
+        "old_shape": image_shape(chunk_path),
         "sample_id": sample_id,
         "source_stem": source_stem,
     }
@@ -107,6 +108,7 @@ strict_bounds = cfg["strict_bounds"]
 underscores_to_sample_id = cfg["underscores_to_sample_id"]
 underscores_to_mip = cfg["underscores_to_mip"]
 underscores_to_chunk = cfg["underscores_to_chunk"]
+tiff_options = tiff_options_from_config(cfg)
 
 # -------------------------
 # OUTPUT GUARDS
@@ -121,9 +123,9 @@ output_chunk_dir.mkdir(parents=True, exist_ok=True)
 # -------------------------
 subject_to_files: dict[str, list[Path]] = {}
 for subject_id, search_dir in subject_to_new_image_dir.items():
-    files = list_tiff_files(search_dir)
+    files = list_image_files(search_dir)
     if len(files) == 0:
-        raise RuntimeError(f"No TIFF images found in subject directory:\n{search_dir}")
+        raise RuntimeError(f"No TIFF or Zarr images found in subject directory:\n{search_dir}")
     subject_to_files[subject_id] = files
 
 # -------------------------
@@ -203,7 +205,8 @@ copied_seg = 0
 
 for (sample_id, source_stem), jobs in jobs_by_source.items():
     source_image_path = resolved_source_path[(sample_id, source_stem)]
-    source_img = tifffile.TiffFile(source_image_path).asarray()
+    # Zarr sources are opened lazily, so only the chunks being recreated are read.
+    source_img = open_image(source_image_path)
 
     for job in jobs:
         chunk_path: Path = job["chunk_path"]  # type: ignore[assignment]
@@ -274,7 +277,7 @@ for (sample_id, source_stem), jobs in jobs_by_source.items():
         if out_chunk_path.exists():
             raise RuntimeError(f"Refusing to overwrite existing file:\n{out_chunk_path}")
 
-        tifffile.imwrite(out_chunk_path, new_chunk)
+        write_tiff(out_chunk_path, new_chunk, tiff_options)
         written += 1
 
         if copy_seg_files:
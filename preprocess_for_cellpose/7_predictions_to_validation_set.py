@@ -14,6 +14,7 @@ User-facing flow:
 from __future__ import annotations
 
 from collections import defaultdict
+from functools import partial
 from pathlib import Path
 import csv
 import random
@@ -22,7 +23,6 @@ import sys
 
 import nibabel as nib
 import numpy as np
-import tifffile
 
 parent_dir = Path(__file__).resolve().parent.parent
 sys.path.append(str(parent_dir))
@@ -34,7 +34,9 @@ from lsfm_data_processing.utils.cellpose_io import (  # noqa: E402
     load_prediction_masks,
     match_prediction_for_mip,
 )
+from lsfm_data_processing.utils.chunking import block_region_histograms, block_stats  # noqa: E402
 from lsfm_data_processing.utils.io_helpers import (  # noqa: E402
+    list_image_files,
     list_tiff_files,
     load_script_config,
     normalize_user_path,
@@ -44,11 +46,15 @@ from lsfm_data_processing.utils.io_helpers import (  # noqa: E402
 )
 from lsfm_data_processing.utils.naming import get_underscore_int, get_underscore_token  # noqa: E402
 from lsfm_data_processing.utils.selection import (  # noqa: E402
+    RegionIncidence,
     balanced_random_seed_selection,
     greedy_region_coverage_select,
     random_fill_selection,
     select_sections_evenly,
+    stochastic_greedy_region_coverage_select,
 )
+from lsfm_data_processing.utils.tiff_io import tiff_options_from_config, write_tiff  # noqa: E402
+from lsfm_data_processing.utils.zarr_io import copy_image, image_shape, open_image  # noqa: E402
 
 
 def split_preselected_mip_name(mip_path: Path) -> tuple[str, str]:
@@ -154,10 +160,13 @@ min_chunks_per_sample = cfg["min_chunks_per_sample"]
 require_nonzero_prediction = cfg["require_nonzero_prediction"]
 save_atlas_chunks = cfg["save_atlas_chunks"]
 random_seed = cfg["random_seed"]
+coverage_mode = cfg.get("coverage_mode", "exact")
+coverage_epsilon = cfg.get("coverage_epsilon", 0.1)
 
 underscores_to_index = cfg["underscores_to_index"]
 file_number_increment = cfg["file_number_increment"]
 all_images_subfolder = cfg.get("all_images_subfolder", "Ex_561_Ch1_stitched")
+tiff_options = tiff_options_from_config(cfg)
 
 if not use_atlas_registration and save_atlas_chunks:
     save_atlas_chunks = False
@@ -200,9 +209,9 @@ for subject_parent in subject_parent_dirs:
 
         subject_meta[sample_id].update({"reg_data": reg_data, "no_images": no_images})
 
-    mip_files = list_tiff_files(mip_dir)
+    mip_files = list_image_files(mip_dir)
     if not mip_files:
-        raise RuntimeError(f"No TIFF MIP files found for sample {sample_id} in:\n{mip_dir}")
+        raise RuntimeError(f"No TIFF or Zarr MIP files found for sample {sample_id} in:\n{mip_dir}")
 
     subject_meta[sample_id].update({"mip_dir": mip_dir, "mip_files": mip_files})
 
@@ -236,7 +245,7 @@ if not preselected_mode:
             jobs.append({"sample_id": sample_id, "mip_path": mip_path, "prediction_path": prediction_path})
 
             if save_selected_sections:
-                shutil.copy2(mip_path, (selected_sections_root / sample_id / "images" / mip_path.name))
+                copy_image(mip_path, (selected_sections_root / sample_id / "images" / mip_path.name))
                 shutil.copy2(prediction_path, (selected_sections_root / sample_id / "predictions" / prediction_path.name))
 
         print(f"Selected {len(selected_mips)} sections for sample {sample_id}")
@@ -283,6 +292,8 @@ if not jobs:
 # BUILD CANDIDATE CHUNKS
 # -------------------------
 candidates: list[dict] = []
+# Atlas region labels of each candidate, in candidate order (see RegionIncidence)
+candidate_regions: list[np.ndarray] = []
 by_sample: dict[str, list[int]] = defaultdict(list)
 
 for job in jobs:
@@ -291,15 +302,16 @@ for job in jobs:
     prediction_path = job["prediction_path"]
     source_mip_stem = job.get("source_mip_stem", mip_path.stem)
 
-    mip_img = tifffile.TiffFile(mip_path).asarray()
-    if mip_img.ndim != 2:
-        raise RuntimeError(f"MIP image must be 2D. Found shape {mip_img.shape}:\n{mip_path}")
+    # Only the shape is needed here; pixels of the selected chunks are read at output time.
+    mip_shape = image_shape(mip_path)
+    if len(mip_shape) != 2:
+        raise RuntimeError(f"MIP image must be 2D. Found shape {mip_shape}:\n{mip_path}")
 
     pred_masks = load_prediction_masks(prediction_path)
-    if pred_masks.shape != mip_img.shape:
+    if pred_masks.shape != mip_shape:
         raise RuntimeError(
             f"Prediction masks shape does not match MIP image shape:\n"
-            f"MIP {mip_path.name}: {mip_img.shape}\n"
+            f"MIP {mip_path.name}: {mip_shape}\n"
             f"Prediction {prediction_path.name}: {pred_masks.shape}"
         )
 
@@ -311,25 +323,29 @@ for job in jobs:
             no_images=subject_meta[sample_id]["no_images"],
             section_number=section_number,
             file_number_increment=file_number_increment,
-            target_h=mip_img.shape[0],
-            target_w=mip_img.shape[1],
+            target_h=mip_shape[0],
+            target_w=mip_shape[1],
         )
 
-    for y in range(0, mip_img.shape[0], chunk_size):
-        for x in range(0, mip_img.shape[1], chunk_size):
-            if y + chunk_size > mip_img.shape[0] or x + chunk_size > mip_img.shape[1]:
+    # Nonzero prediction pixels (and atlas regions) of every chunk in one pass, before any chunk is cut
+    mask_nonzero_grid = block_stats(pred_masks, chunk_size)["nonzero"]
+    atlas_regions_grid = None
+    if use_atlas_registration and atlas_img is not None:
+        atlas_regions_grid, _ = block_region_histograms(atlas_img, chunk_size)
+
+    for y in range(0, mip_shape[0], chunk_size):
+        for x in range(0, mip_shape[1], chunk_size):
+            if y + chunk_size > mip_shape[0] or x + chunk_size > mip_shape[1]:
                 continue
 
-            mask_chunk = pred_masks[y : y + chunk_size, x : x + chunk_size]
-            mask_nonzero = int(np.count_nonzero(mask_chunk))
+            mask_nonzero = int(mask_nonzero_grid[y // chunk_size, x // chunk_size])
             if require_nonzero_prediction and mask_nonzero == 0:
                 continue
 
-            regions: set[int] = set()
-            if use_atlas_registration and atlas_img is not None:
-                atlas_chunk = atlas_img[y : y + chunk_size, x : x + chunk_size]
-                regions = set(np.unique(atlas_chunk))
-                regions.discard(0)
+            regions = np.zeros(0, dtype=np.int64)
+            if atlas_regions_grid is not None:
+                regions = atlas_regions_grid[y // chunk_size, x // chunk_size]
+                regions = regions[regions != 0]
 
             idx = len(candidates)
             candidates.append(
@@ -341,11 +357,11 @@ for job in jobs:
                     "x": x,
                     "size": chunk_size,
                     "mask_nonzero": mask_nonzero,
-                    "regions": regions,
                     "region_count": len(regions),
                     "source_mip_stem": source_mip_stem,
                 }
             )
+            candidate_regions.append(regions)
             by_sample[sample_id].append(idx)
 
 if not candidates:
@@ -357,20 +373,23 @@ if number_of_chunks <= 0:
 if min_chunks_per_sample < 0:
     raise RuntimeError("min_chunks_per_sample must be >= 0.")
 
+if coverage_mode not in ("exact", "stochastic"):
+    raise RuntimeError(f'coverage_mode must be "exact" or "stochastic", got "{coverage_mode}".')
+
 # -------------------------
 # REPRESENTATIVE CHUNK SELECTION
 # -------------------------
 rng = random.Random(random_seed)
-all_regions = set()
-for c in candidates:
-    all_regions.update(c["regions"])
+region_incidence = RegionIncidence(candidate_regions)
+coverage_select = greedy_region_coverage_select
+if coverage_mode == "stochastic":
+    coverage_select = partial(stochastic_greedy_region_coverage_select, rng=rng, epsilon=coverage_epsilon)
 
 selected: set[int] = set()
 covered_regions: set[int] = set()
 target_total = min(number_of_chunks, len(candidates))
 
 if use_atlas_registration:
-    regions_by_id = {cid: candidates[cid]["regions"] for cid in range(len(candidates))}
     secondary_score_by_id = {
         cid: (int(candidates[cid]["mask_nonzero"]), int(candidates[cid]["region_count"]))
         for cid in range(len(candidates))
@@ -378,9 +397,9 @@ if use_atlas_registration:
     for sample_id in sorted(by_sample.keys()):
         sample_candidate_ids = by_sample[sample_id]
         target_for_sample = min(min_chunks_per_sample, len(sample_candidate_ids))
-        selected, covered_regions = greedy_region_coverage_select(
+        selected, covered_regions = coverage_select(
             candidate_ids=sample_candidate_ids,
-            regions_by_id=regions_by_id,
+            regions_by_id=region_incidence,
             limit=len(selected) + target_for_sample,
             selected=selected,
             covered_regions=covered_regions,
@@ -388,9 +407,9 @@ if use_atlas_registration:
         )
 
     all_candidate_ids = list(range(len(candidates)))
-    selected, covered_regions = greedy_region_coverage_select(
+    selected, covered_regions = coverage_select(
         candidate_ids=all_candidate_ids,
-        regions_by_id=regions_by_id,
+        regions_by_id=region_incidence,
         limit=target_total,
         selected=selected,
         covered_regions=covered_regions,
@@ -443,7 +462,7 @@ for idx in selected_ids:
     size = int(c["size"])
 
     if mip_path not in mip_cache:
-        mip_cache[mip_path] = tifffile.TiffFile(mip_path).asarray()
+        mip_cache[mip_path] = open_image(mip_path)
     if prediction_path not in pred_cache:
         pred_cache[prediction_path] = load_prediction_masks(prediction_path)
 
@@ -463,7 +482,7 @@ for idx in selected_ids:
             if preselected_mode:
                 provenance_atlas_path = preselected_images_dir / f"atlas_{mip_path.name}"
                 if provenance_atlas_path not in saved_preselected_atlas_paths:
-                    tifffile.imwrite(provenance_atlas_path, atlas_cache[atlas_key])
+                    write_tiff(provenance_atlas_path, atlas_cache[atlas_key], tiff_options)
                     saved_preselected_atlas_paths.add(provenance_atlas_path)
         atlas_chunk = atlas_cache[atlas_key][y : y + size, x : x + size]
 
@@ -479,14 +498,14 @@ for idx in selected_ids:
     if out_tif.exists() or out_seg.exists():
         raise RuntimeError(f"Refusing to overwrite existing output files:\n{out_tif}\n{out_seg}")
 
-    tifffile.imwrite(out_tif, image_chunk)
+    write_tiff(out_tif, image_chunk, tiff_options)
     np.save(out_seg, create_cellpose_npy_dict(mask_chunk, out_tif), allow_pickle=True)
 
     if save_atlas_chunks and use_atlas_registration and atlas_chunk is not None:
         out_atlas = out_atlas_dir / f"{chunk_stem}_atlas.tif"
         if out_atlas.exists():
             raise RuntimeError(f"Refusing to overwrite existing output file:\n{out_atlas}")
-        tifffile.imwrite(out_atlas, atlas_chunk)
+        write_tiff(out_atlas, atlas_chunk, tiff_options)
 
     metadata_rows.append(
         {
@@ -525,7 +544,7 @@ print(f"Selected sections processed: {len(jobs)}")
 print(f"Candidate chunks: {len(candidates)}")
 print(f"Selected chunks written: {len(selected_ids)}")
 if use_atlas_registration:
-    print(f"Atlas regions covered: {len(covered_regions)} / {len(all_regions)}")
+    print(f"Atlas regions covered: {len(covered_regions)} / {region_incidence.n_regions}")
 else:
     print("Selection mode: random (atlas registration disabled)")
 print(f"Chunk output directory: {out_chunk_dir}")